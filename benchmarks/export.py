@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Export synthetic payment history and report rows per second and file size
+
+    python benchmarks/export.py --records 1000000 --path /tmp/history.parquet
+"""
+import argparse
+import os
+import sys
+import time
+
+# Run from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yappa.export import HistoryExporter
+
+
+def synthetic_records(count):
+    for index in range(count):
+        yield {
+            'payKey': 'AP-{:012d}'.format(index),
+            'status': 'COMPLETED',
+            'currencyCode': 'USD',
+            'senderEmail': 'buyer{}@example.com'.format(index % 100000),
+            'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'},
+            'paymentInfoList': {'paymentInfo': [
+                {'receiver': {'email': 'seller{}@example.com'.format(index % 5000),
+                              'amount': '{}.{:02d}'.format(index % 500, index % 100), 'primary': 'true'},
+                 'transactionId': 'T{:012d}'.format(index), 'transactionStatus': 'COMPLETED'},
+                {'receiver': {'email': 'partner@example.com', 'amount': '1.50', 'primary': 'false'},
+                 'transactionId': 'S{:012d}'.format(index), 'transactionStatus': 'COMPLETED'},
+            ]},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--path', default='yappa-bench-history.parquet')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rows = HistoryExporter(args.path, chunk_size=args.chunk_size).export(synthetic_records(args.records))
+    elapsed = time.perf_counter() - started
+
+    print('{} records, {} rows in {:.1f}s: {:.0f} rows/s, {:.1f} MB'.format(
+        args.records, rows, elapsed, rows / elapsed, os.path.getsize(args.path) / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Compare payload build time and wire size of the schema builders against the previous builders
+
+    python benchmarks/payload.py
+"""
+import json
+import os
+import sys
+import timeit
+from decimal import Decimal
+
+# Run from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yappa.api import Pay, PreApproval
+from yappa.models import Receiver, ReceiverList
+from yappa.utils import decimal_default
+
+CREDENTIALS = {
+    'PAYPAL_USER_ID': 'bench',
+    'PAYPAL_PASSWORD': 'bench',
+    'PAYPAL_SIGNATURE': 'bench',
+    'PAYPAL_APP_ID': 'APP-bench'
+}
+
+
+def legacy_preapproval_payload(**kwargs):
+    return {
+        'startingDate': kwargs.get('startingDate'),
+        'endingDate': kwargs.get('endingDate'),
+        'returnUrl': kwargs.get('returnUrl'),
+        'cancelUrl': kwargs.get('cancelUrl'),
+        'currencyCode': kwargs.get('currencyCode'),
+        'maxAmountPerPayment': kwargs.get('maxAmountPerPayment'),
+        'maxNumberOfPayments': kwargs.get('maxNumberOfPayments'),
+        'maxTotalAmountOfAllPayments': kwargs.get('maxTotalAmountOfAllPayments')
+    }
+
+
+def legacy_pay_payload(**kwargs):
+    receiver_list = kwargs.get('receiverList')
+    preapproval_key = kwargs.get('preapprovalKey', None)
+    memo = kwargs.get('memo', None)
+
+    if not isinstance(receiver_list, ReceiverList):
+        raise TypeError('receiverList needs to be instance of yappa.models.RecieverList')
+
+    payload = {
+        'actionType': 'PAY',
+        'feesPayer': kwargs.get('feesPayer', 'EACHRECEIVER'),
+        'currencyCode': kwargs.get('currencyCode'),
+        'senderEmail': kwargs.get('senderEmail'),
+        'receiverList': receiver_list.to_json(),
+        'returnUrl': kwargs.get('returnUrl'),
+        'cancelUrl': kwargs.get('cancelUrl'),
+    }
+
+    if preapproval_key is not None:
+        payload['preapprovalKey'] = preapproval_key
+
+    if memo is not None and memo.strip() != '':
+        payload['memo'] = memo
+
+    return payload
+
+
+def wire_bytes(payload):
+    return len(json.dumps(payload, default=decimal_default).encode('utf-8'))
+
+
+def compare(name, legacy, current, kwargs, number):
+    legacy_time = timeit.timeit(lambda: legacy(**kwargs), number=number) / number
+    current_time = timeit.timeit(lambda: current(**kwargs), number=number) / number
+
+    print('{}'.format(name))
+    print('  build time  legacy {:8.2f}us   schema {:8.2f}us'.format(legacy_time * 1e6, current_time * 1e6))
+    print('  wire bytes  legacy {:8d}     schema {:8d}'.format(wire_bytes(legacy(**kwargs)),
+                                                              wire_bytes(current(**kwargs))))
+
+
+def main(number=100000):
+    preapproval = PreApproval(CREDENTIALS)
+    pay = Pay(CREDENTIALS)
+
+    minimal_preapproval = {
+        'startingDate': '2016-05-28T00:33:00+08:00',
+        'currencyCode': 'USD',
+        'returnUrl': 'http://return.url',
+        'cancelUrl': 'http://cancel.url',
+    }
+    full_preapproval = dict(minimal_preapproval,
+                            endingDate='2016-06-28T00:33:00+08:00',
+                            maxAmountPerPayment=Decimal('50.00'),
+                            maxNumberOfPayments=20,
+                            maxTotalAmountOfAllPayments=Decimal('1500.00'))
+    pay_kwargs = {
+        'currencyCode': 'USD',
+        'returnUrl': 'http://return.url',
+        'cancelUrl': 'http://cancel.url',
+        'preapprovalKey': 'PA-11111111111111111',
+        'receiverList': ReceiverList([Receiver(email='receiver{}@gmail.com'.format(i), amount=Decimal('10.00'))
+                                      for i in range(6)]),
+    }
+
+    compare('PreApproval, required fields only', legacy_preapproval_payload, preapproval.build_payload,
+            minimal_preapproval, number)
+    compare('PreApproval, all fields', legacy_preapproval_payload, preapproval.build_payload,
+            full_preapproval, number)
+    compare('Pay, 6 receivers', legacy_pay_payload, pay.build_payload, pay_kwargs, number)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Measure ShardedPayoutRunner throughput against a local stub server for a growing number of processes
+
+    python benchmarks/payout_runner.py --items 20000 --latency 0.005
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+from decimal import Decimal
+
+# Run from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yappa.models import Receiver, ReceiverList
+from yappa.runner import ShardedPayoutRunner
+from yappa.stub import StubServer
+
+CREDENTIALS = {
+    'PAYPAL_USER_ID': 'bench',
+    'PAYPAL_PASSWORD': 'bench',
+    'PAYPAL_SIGNATURE': 'bench',
+    'PAYPAL_APP_ID': 'APP-bench'
+}
+
+
+def build_items(count):
+    for i in range(count):
+        receivers = [Receiver(email='receiver{}-{}@example.com'.format(i, n), amount=Decimal('10.00'))
+                     for n in range(6)]
+
+        yield 'payout-{}'.format(i), {
+            'currencyCode': 'USD',
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+            'senderEmail': 'sender{}@example.com'.format(i % 1000),
+            'receiverList': ReceiverList(receivers),
+        }
+
+
+def main():
+    cpus = multiprocessing.cpu_count()
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.0, help='stub response delay in seconds')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker process')
+    parser.add_argument('--server-processes', type=int, default=cpus)
+    args = parser.parse_args()
+
+    process_counts = sorted({1, 2, 4, cpus} & set(range(1, cpus + 1)))
+
+    with StubServer(latency=args.latency, processes=args.server_processes) as server:
+        baseline = None
+
+        for processes in process_counts:
+            runner = ShardedPayoutRunner(CREDENTIALS, processes=processes, threads=args.threads,
+                                         endpoint=server.endpoint)
+
+            for _ in runner.run(build_items(args.items)):
+                pass
+
+            metrics = runner.metrics
+            baseline = baseline or metrics.throughput
+
+            print('{:3d} processes  {:9.1f} payouts/s  speedup {:4.2f}x  failed {}'.format(
+                processes, metrics.throughput, metrics.throughput / baseline, metrics.failed))
+
+
+if __name__ == '__main__':
+    main()
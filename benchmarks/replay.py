@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Replay a capture file offline and report latency and throughput
+
+    python benchmarks/replay.py traffic.jsonl.gz --speed 60
+"""
+import argparse
+import os
+import sys
+
+# Run from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yappa.api import Pay, PreApproval, PreApprovalDetails
+from yappa.capture import ReplayTransport, TrafficReplayer
+
+CREDENTIALS = {
+    'PAYPAL_USER_ID': 'replay',
+    'PAYPAL_PASSWORD': 'replay',
+    'PAYPAL_SIGNATURE': 'replay',
+    'PAYPAL_APP_ID': 'APP-replay'
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path', help='capture file written by yappa.capture.TrafficRecorder')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='arrival and response time acceleration, 0 replays as fast as possible')
+    parser.add_argument('--workers', type=int, default=20)
+    args = parser.parse_args()
+
+    speed = args.speed or None
+    transport = ReplayTransport(args.path, speed=speed)
+    clients = {operation.OPERATION: operation(CREDENTIALS, session=transport)
+               for operation in (Pay, PreApproval, PreApprovalDetails)}
+
+    stats = TrafficReplayer(args.path, clients, speed=speed, max_workers=args.workers).run()
+
+    print('calls:      {}'.format(stats.count))
+    print('errors:     {}'.format(stats.errors))
+    print('duration:   {:.3f}s'.format(stats.duration))
+    print('throughput: {:.1f} calls/s'.format(stats.throughput))
+
+    for name in ('p50', 'p95', 'p99'):
+        value = getattr(stats, name)
+        print('{}:        {}'.format(name, '-' if value is None else '{:.1f}ms'.format(value * 1000)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Compare the batched split calculator with a per-order Decimal loop
+
+    python benchmarks/split.py --orders 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from decimal import Decimal, ROUND_HALF_EVEN
+
+# Run from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yappa.split import SplitCalculator, CommissionRule
+
+RATE = Decimal('0.15')
+FEE_RATE = Decimal('0.029')
+FEE_FIXED = Decimal('0.30')
+CENT = Decimal('0.01')
+
+
+def loop_split(totals):
+    """
+    The plain per-order approach: Decimal arithmetic and quantize for every order
+    """
+    results = []
+
+    for total in totals:
+        commission = (total * RATE).quantize(CENT, rounding=ROUND_HALF_EVEN)
+        secondary = total - commission
+        fee = (total * FEE_RATE).quantize(CENT, rounding=ROUND_HALF_EVEN) + FEE_FIXED
+        secondary_fee = (fee * secondary / total).quantize(CENT, rounding=ROUND_HALF_EVEN)
+        results.append((commission, secondary, fee - secondary_fee, secondary_fee))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--orders', type=int, default=1000000)
+    args = parser.parse_args()
+
+    random.seed(1)
+    cents = [random.randint(100, 1000000) for _ in range(args.orders)]
+    totals = [Decimal(value).scaleb(-2) for value in cents]
+    rule = CommissionRule('market@example.com', 'seller@example.com', RATE)
+    calculator = SplitCalculator('USD', fee_rate=FEE_RATE, fee_fixed=FEE_FIXED)
+
+    clock = time.perf_counter()
+    loop_split(totals)
+    loop_time = time.perf_counter() - clock
+
+    clock = time.perf_counter()
+    calculator.calculate(totals, rule)
+    decimal_time = time.perf_counter() - clock
+
+    clock = time.perf_counter()
+    result = calculator.calculate(cents, rule, minor_units=True)
+    minor_time = time.perf_counter() - clock
+
+    drift = sum(result.totals) - sum(result.commissions) - sum(result.secondary)
+
+    print('{} orders'.format(args.orders))
+    print('  per-order Decimal loop      {:6.2f}s'.format(loop_time))
+    print('  calculator, Decimal totals  {:6.2f}s'.format(decimal_time))
+    print('  calculator, minor units     {:6.2f}s'.format(minor_time))
+    print('  penny drift                 {}'.format(drift))
+
+
+if __name__ == '__main__':
+    main()
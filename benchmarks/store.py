@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Fill a state store with synthetic payments and time its indexed queries
+
+    python benchmarks/store.py --rows 10000000 --path /tmp/yappa-state.db
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+# Run from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yappa.store import SQLiteBackend, StateStore, extract_record
+
+STATUSES = ['COMPLETED'] * 8 + ['CREATED', 'PROCESSING', 'ERROR']
+
+
+def synthetic_records(rows, start):
+    for index in range(rows):
+        pay_key = 'AP-{:012d}'.format(index)
+        payload = {
+            'trackingId': 'T-{:012d}'.format(index),
+            'senderEmail': 'buyer{}@example.com'.format(index % 100000),
+            'receiverList': {'receiver': [{'email': 'seller{}@example.com'.format(index % 5000),
+                                           'amount': '{}.{:02d}'.format(index % 500, index % 100)}]},
+        }
+        response = {'payKey': pay_key, 'paymentExecStatus': random.choice(STATUSES),
+                    'responseEnvelope': {'ack': 'Success'}}
+        # Spread creation times over the last 30 days
+        yield extract_record('Pay', payload, response, start - random.random() * 30 * 86400)
+
+
+def timed(label, fn, repeat=100):
+    started = time.perf_counter()
+
+    for _ in range(repeat):
+        result = fn()
+
+    print('{:<40} {:>10.3f} ms  ({} rows)'.format(label, (time.perf_counter() - started) * 1000 / repeat,
+                                                  len(result)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--batch', type=int, default=5000)
+    parser.add_argument('--path', default='yappa-bench-state.db')
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        os.remove(args.path)
+
+    now = time.time()
+    backend = SQLiteBackend(args.path)
+    started = time.perf_counter()
+    batch = []
+
+    for record in synthetic_records(args.rows, now):
+        batch.append(record)
+
+        if len(batch) == args.batch:
+            backend.write_batch(batch)
+            batch = []
+
+    if batch:
+        backend.write_batch(batch)
+
+    elapsed = time.perf_counter() - started
+    print('bulk load: {} rows in {:.1f}s, {:.0f} rows/s'.format(args.rows, elapsed, args.rows / elapsed))
+
+    store = StateStore(backend=backend)
+    probe = args.rows // 2
+
+    timed('find payKey', lambda: store.find(payKey='AP-{:012d}'.format(probe)))
+    timed('find trackingId', lambda: store.find(trackingId='T-{:012d}'.format(probe)))
+    timed('find senderEmail', lambda: store.find(senderEmail='buyer42@example.com'))
+    timed('find receiverEmail (limit 100)', lambda: store.find(receiverEmail='seller42@example.com', limit=100))
+    timed('pending older than 29 days', lambda: store.pending_payments(29 * 24 * 60), repeat=10)
+    timed('pending older than 15 min (limit 1000)', lambda: store.pending_payments(15, limit=1000), repeat=10)
+
+    # Throughput of the write path the operations use: record() on the caller, batching on the writer thread
+    response = {'payKey': 'AP-live', 'paymentExecStatus': 'CREATED', 'responseEnvelope': {'ack': 'Success'}}
+    payload = {'senderEmail': 'buyer@example.com',
+               'receiverList': {'receiver': [{'email': 'seller@example.com', 'amount': '1.00'}]}}
+    count = min(args.rows, 100000)
+    started = time.perf_counter()
+
+    for _ in range(count):
+        store.record('Pay', payload, response)
+
+    queued = time.perf_counter() - started
+    store.flush()
+    elapsed = time.perf_counter() - started
+    print('record(): {:.1f} us per call on the caller, {:.0f} records/s written'.format(
+        queued * 1e6 / count, count / elapsed))
+
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
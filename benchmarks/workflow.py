@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+Measure preapproval-pay workflow throughput against a local stub server
+
+    python benchmarks/workflow.py --flows 5000 --latency 0.02 --concurrency 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+
+# Run from a checkout without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yappa.api import Pay, PaymentDetails, PreApproval, PreApprovalDetails
+from yappa.models import Receiver, ReceiverList
+from yappa.stub import StubServer
+from yappa.transport import PooledSession
+from yappa.workflow import WorkflowEngine, preapproval_pay_workflow
+
+CREDENTIALS = {
+    'PAYPAL_USER_ID': 'bench',
+    'PAYPAL_PASSWORD': 'bench',
+    'PAYPAL_SIGNATURE': 'bench',
+    'PAYPAL_APP_ID': 'APP-bench'
+}
+
+
+def build_state(index, payments):
+    return {
+        'preapproval': {
+            'startingDate': datetime(2030, 1, 1, tzinfo=timezone.utc),
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+            'currencyCode': 'USD',
+        },
+        'payments': [{
+            'currencyCode': 'USD',
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+            'receiverList': ReceiverList([Receiver(email='seller{}@example.com'.format(index % 1000),
+                                                   amount=Decimal('10.00'))]),
+        } for _ in range(payments)],
+    }
+
+
+async def run(engine, concurrency):
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    await engine.run(until_done=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--flows', type=int, default=2000)
+    parser.add_argument('--payments', type=int, default=1, help='Pay calls per flow')
+    parser.add_argument('--latency', type=float, default=0.0, help='stub response delay in seconds')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--batch', type=int, default=500)
+    parser.add_argument('--server-processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with StubServer(latency=args.latency, processes=args.server_processes) as server, \
+            tempfile.TemporaryDirectory() as tmp_dir:
+        session = PooledSession(pool_size=args.concurrency)
+        options = {'debug': True, 'session': session, 'endpoint': server.endpoint}
+        workflow = preapproval_pay_workflow(PreApproval(CREDENTIALS, **options),
+                                            PreApprovalDetails(CREDENTIALS, **options),
+                                            Pay(CREDENTIALS, **options), PaymentDetails(CREDENTIALS, **options))
+        engine = WorkflowEngine(workflow, path=os.path.join(tmp_dir, 'workflows.db'), batch_size=args.batch,
+                                concurrency=args.concurrency, idle_interval=0.01)
+
+        engine.start_many((None, build_state(index, args.payments)) for index in range(args.flows))
+        started = time.perf_counter()
+        asyncio.run(run(engine, args.concurrency))
+        elapsed = time.perf_counter() - started
+
+        print('{} flows in {:.2f}s  {:8.1f} flows/s  {:8.1f} calls/s  {}'.format(
+            args.flows, elapsed, args.flows / elapsed, engine.calls / elapsed, engine.counts()))
+
+        engine.close()
+        session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -14,15 +14,23 @@ setup(
     author='Spin Lai',
     author_email='pengo.lai@gmail.com',
     install_requires=REQUIREMENTS,
+    extras_require={
+        'export': ['pyarrow'],
+        'django': ['django>=5.0'],
+    },
     description='Another Python library for integrating PayPal Adaptive Payments',
     packages=find_packages(),
     include_package_data=True,
+    python_requires='>=3.9',
     classifiers=[
         'Environment :: Web Environment',
         "Intended Audience :: Developers",
         "Operating System :: OS Independent",
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
         'Topic :: Software Development :: Libraries :: Python Modules'
     ],
     test_suite='nose.collector',
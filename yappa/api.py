@@ -1,4 +1,7 @@
+import asyncio
+import hashlib
 import json
+import time
 from abc import ABCMeta, abstractmethod
 from collections import namedtuple
 
@@ -7,17 +10,37 @@ import requests
 from .settings import Settings
 from .utils import decimal_default
 from .models import ReceiverList
-from .exceptions import InvalidReceiverException
+from .exceptions import AdaptiveApiException
+from .schema import Schema, Field, date_field, amount_field, not_greater_than
+from .schema import ACTION_TYPES, CURRENCY_CODES, FEES_PAYERS
 
 
 class AdaptiveApiBase(metaclass=ABCMeta):
+    OPERATION = None
+    READ_ONLY = False   # Only read-only operations may be coalesced or sent more than once
 
-    def __init__(self, credentials, debug=False):
+    def __init__(self, credentials, debug=False, session=None, single_flight=None, recorder=None, endpoint=None,
+                 hedge=None, store=None, scheduler=None, lane=None, timeout=None):
         settings = Settings(debug=debug)
 
-        self.endpoint = settings.PAYPAL_ENDPOINT
+        # endpoint overrides the PayPal service URL, e.g. to point at a local stub server
+        self.endpoint = '{}/{}'.format(endpoint or settings.PAYPAL_ENDPOINT, self.OPERATION)
         self.auth_url = settings.PAYPAL_AUTH_URL
         self.credentials = credentials
+        self.session = session
+        self.single_flight = single_flight
+        self.recorder = recorder
+        self.hedge = hedge
+        self.store = store
+        self.scheduler = scheduler
+        self.lane = lane
+        self.timeout = timeout  # Seconds to wait for PayPal to connect and answer, None waits forever
+
+        if single_flight is not None:
+            self._check_read_only('single flight')
+
+        if hedge is not None:
+            self._check_read_only('hedging')
 
         self.headers = {}
         self.payload = {
@@ -28,6 +51,11 @@ class AdaptiveApiBase(metaclass=ABCMeta):
 
         self._build_headers()
 
+    def _check_read_only(self, feature):
+        if not self.READ_ONLY:
+            raise AdaptiveApiException('{} can only be used with read-only operations, not {}'.
+                                       format(feature, self.OPERATION))
+
     def _build_headers(self):
         headers = {
             'X-PAYPAL-SECURITY-USERID': self.credentials['PAYPAL_USER_ID'],
@@ -59,14 +87,122 @@ class AdaptiveApiBase(metaclass=ABCMeta):
             message=error.get('message'),
             timestamp=timestamp)
 
+    def _post(self, payload):
+        """
+        Send payload to the operation endpoint
+
+        @param payload: complete request payload, including the request envelope
+        @return: decoded JSON response
+        """
+        http = self.session if self.session is not None else requests
+        options = {'timeout': self.timeout} if self.timeout is not None else {}
+        started = time.time()
+        clock = time.perf_counter()
+
+        try:
+            response = http.post(self.endpoint,
+                                 data=json.dumps(payload, default=decimal_default),
+                                 headers=self.headers, **options).json()
+        except Exception as e:
+            if self.recorder is not None:
+                self.recorder.record(self.OPERATION, payload, None, started, time.perf_counter() - clock, error=e)
+            raise
+
+        if self.recorder is not None:
+            self.recorder.record(self.OPERATION, payload, response, started, time.perf_counter() - clock)
+
+        return response
+
+    def prewarm(self, count):
+        """
+        Open connections to the operation endpoint before the first request
+
+        @param count: connections to open
+        @return: number of connections opened
+        """
+        if not hasattr(self.session, 'prewarm'):
+            raise AdaptiveApiException('prewarm needs a yappa.transport.PooledSession as session')
+
+        return self.session.prewarm(count, self.endpoint)
+
+    def _send(self, payload):
+        if self.hedge is not None:
+            return self.hedge.execute(self, lambda: self._post(payload))
+
+        return self._post(payload)
+
+    def _scheduled_send(self, payload):
+        if self.scheduler is None:
+            return self._send(payload)
+
+        with self.scheduler.slot(self.lane):
+            return self._send(payload)
+
+    def _store(self, payload, response):
+        # Only queues the record, the store writes it on its own thread
+        if self.store is not None:
+            self.store.record(self.OPERATION, payload, response)
+
+    def _exchange(self, payload):
+        """
+        Send an already built payload the way request() does, in a scheduler slot and recorded in the store
+
+        @param payload: complete request payload
+        @return: decoded JSON response
+        """
+        response = self._scheduled_send(payload)
+        self._store(payload, response)
+        return response
+
+    def flight_key(self, payload):
+        """
+        Build the key identifying identical requests: operation, account and normalized payload
+
+        @param payload: complete request payload
+        @return: hex digest string
+        """
+        normalized = json.dumps([self.endpoint, self.credentials['PAYPAL_USER_ID'], payload],
+                                sort_keys=True, default=decimal_default)
+
+        return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+    def _build_request_payload(self, *args, **kwargs):
+        # Build a fresh payload per call so one instance can be shared between threads
+        payload = dict(self.payload)
+        payload.update(self.build_payload(*args, **kwargs))
+
+        return payload
+
     def request(self, *args, **kwargs):
-        self.payload.update(self.build_payload(*args, **kwargs))
+        payload = self._build_request_payload(*args, **kwargs)
+
+        if self.single_flight is not None:
+            # Only the caller making the HTTP call records it, coalesced callers share its row
+            response = self.single_flight.do(self.flight_key(payload), lambda: self._exchange(payload))
+        else:
+            response = self._exchange(payload)
 
-        response = requests.post(self.endpoint,
-                                 data=json.dumps(self.payload, default=decimal_default),
-                                 headers=self.headers)
+        return self.build_response(response)
 
-        return self.build_response(response.json())
+    async def arequest(self, *args, **kwargs):
+        """
+        Same as request(), for asyncio callers. The HTTP call runs in the loop's default executor.
+        """
+        payload = self._build_request_payload(*args, **kwargs)
+
+        if self.single_flight is not None:
+            response = await self.single_flight.do_async(self.flight_key(payload), lambda: self._exchange(payload))
+            return self.build_response(response)
+
+        if self.scheduler is not None:
+            # Wait for the slot on the loop, not in an executor thread
+            async with self.scheduler.aslot(self.lane):
+                response = await asyncio.get_running_loop().run_in_executor(None, self._send, payload)
+        else:
+            response = await asyncio.get_running_loop().run_in_executor(None, self._send, payload)
+
+        self._store(payload, response)
+        return self.build_response(response)
 
     @abstractmethod
     def build_payload(self, *args, **kwargs):
@@ -78,22 +214,23 @@ class AdaptiveApiBase(metaclass=ABCMeta):
 
 
 class PreApproval(AdaptiveApiBase):
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.endpoint = '{}/{}'.format(self.endpoint, 'Preapproval')
+    OPERATION = 'Preapproval'
+
+    schema = Schema({
+        'startingDate': date_field(required=True),
+        'endingDate': date_field(),
+        'returnUrl': Field(required=True),
+        'cancelUrl': Field(required=True),
+        'currencyCode': Field(required=True, choices=CURRENCY_CODES),
+        'maxAmountPerPayment': amount_field(),
+        'maxNumberOfPayments': Field(types=int, min_value=1),
+        'maxTotalAmountOfAllPayments': amount_field(),
+    }, checks=[
+        not_greater_than('maxAmountPerPayment', 'maxTotalAmountOfAllPayments'),
+    ])
 
     def build_payload(self, *args, **kwargs):
-        return {
-            'startingDate': kwargs.get('startingDate'),
-            'endingDate': kwargs.get('endingDate'),
-            'returnUrl': kwargs.get('returnUrl'),
-            'cancelUrl': kwargs.get('cancelUrl'),
-            'currencyCode': kwargs.get('currencyCode'),
-            'maxAmountPerPayment': kwargs.get('maxAmountPerPayment'),
-            'maxNumberOfPayments': kwargs.get('maxNumberOfPayments'),
-            'maxTotalAmountOfAllPayments': kwargs.get('maxTotalAmountOfAllPayments')
-        }
+        return self.schema.build(kwargs)
 
     def build_response(self, response):
         ack = response['responseEnvelope']['ack']
@@ -115,27 +252,29 @@ class PreApproval(AdaptiveApiBase):
 
 
 class PreApprovalDetails(AdaptiveApiBase):
+    OPERATION = 'PreapprovalDetails'
+    READ_ONLY = True
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.endpoint = '{}/{}'.format(self.endpoint, 'PreapprovalDetails')
+    schema = Schema({
+        'preapprovalKey': Field(required=True),
+    })
 
     def build_payload(self, *args, **kwargs):
-        return {
-            'preapprovalKey': kwargs.get('preapprovalKey'),
-        }
+        return self.schema.build(kwargs)
 
     def build_response(self, response):
         ack = response['responseEnvelope']['ack']
         response_fields = ['ack', 'approved', 'cancelUrl', 'curPayments', 'curPaymentsAmount',
                            'curPeriodAttempts', 'currencyCode', 'dateOfMonth', 'dayOfWeek',
-                           'displayMaxTotalAmount', 'endingDate', 'maxTotalAmountOfAllPayments',
+                           'displayMaxTotalAmount', 'endingDate', 'maxAmountPerPayment', 'maxNumberOfPayments',
+                           'maxTotalAmountOfAllPayments',
                            'paymentPeriod', 'pinType', 'returnUrl', 'startingDate', 'status',
-                           'sender', 'senderEmail']
+                           'sender', 'senderEmail', 'timestamp']
 
         if ack in ('Success', 'SuccessWithWarning'):
             ApiResponse = namedtuple('ApiResponse', response_fields)
             response_kwargs = {field: ack if field == 'ack' else response.get(field) for field in response_fields}
+            response_kwargs['timestamp'] = response['responseEnvelope'].get('timestamp')
 
             api_response = ApiResponse(**response_kwargs)
 
@@ -146,37 +285,33 @@ class PreApprovalDetails(AdaptiveApiBase):
 
 
 class Pay(AdaptiveApiBase):
+    OPERATION = 'Pay'
     DEFAULT_FEES_PAYER = 'EACHRECEIVER'
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.endpoint = '{}/{}'.format(self.endpoint, 'Pay')
+    schema = Schema({
+        'actionType': Field(required=True, choices=ACTION_TYPES, default='PAY'),
+        'feesPayer': Field(choices=FEES_PAYERS, default=DEFAULT_FEES_PAYER),
+        'currencyCode': Field(required=True, choices=CURRENCY_CODES),
+        'senderEmail': Field(),
+        'receiverList': Field(types=ReceiverList, required=True, validate=ReceiverList.validate,
+                              to_wire=ReceiverList.to_json),
+        'returnUrl': Field(required=True),
+        'cancelUrl': Field(required=True),
+        'preapprovalKey': Field(),
+        'trackingId': Field(),
+        'ipnNotificationUrl': Field(),
+        'memo': Field(to_wire=lambda memo: memo if memo.strip() != '' else None),
+    })
 
     def build_payload(self, *args, **kwargs):
-        receiver_list = kwargs.get('receiverList')
-        preapproval_key = kwargs.get('preapprovalKey', None)
-        memo = kwargs.get('memo', None)
-
-        if not isinstance(receiver_list, ReceiverList):
-            raise InvalidReceiverException('receiverList needs to be instance of yappa.models.RecieverList')
-
-        payload = {
-            'actionType': 'PAY',
-            'feesPayer': kwargs.get('feesPayer', self.DEFAULT_FEES_PAYER),
-            'currencyCode': kwargs.get('currencyCode'),
-            'senderEmail': kwargs.get('senderEmail'),
-            'receiverList': receiver_list.to_json(),
-            'returnUrl': kwargs.get('returnUrl'),
-            'cancelUrl': kwargs.get('cancelUrl'),
-        }
+        return self.schema.build(kwargs)
 
-        if preapproval_key is not None:
-            payload['preapprovalKey'] = preapproval_key
-
-        if memo is not None and memo.strip() != '':
-            payload['memo'] = memo
-
-        return payload
+    def approval_url(self, pay_key):
+        """
+        @param pay_key: payKey of a payment left for approval (paymentExecStatus CREATED)
+        @return: PayPal page where the sender approves it
+        """
+        return '{}?cmd=_ap-payment&paykey={}'.format(self.auth_url, pay_key)
 
     def build_response(self, response):
         ack = response['responseEnvelope']['ack']
@@ -201,3 +336,66 @@ class Pay(AdaptiveApiBase):
             api_response = self.build_failure_response(response)
 
         return api_response
+
+
+class SetPaymentOptions(AdaptiveApiBase):
+    OPERATION = 'SetPaymentOptions'
+
+    schema = Schema({
+        'payKey': Field(required=True),
+        'displayOptions': Field(types=dict),
+        'senderOptions': Field(types=dict),
+        'receiverOptions': Field(types=list),
+        'shippingAddressId': Field(),
+    })
+
+    def build_payload(self, *args, **kwargs):
+        return self.schema.build(kwargs)
+
+    def build_response(self, response):
+        ack = response['responseEnvelope']['ack']
+
+        if ack in ('Success', 'SuccessWithWarning'):
+            ApiResponse = namedtuple('ApiResponse', ['ack'])
+            api_response = ApiResponse(ack=ack)
+
+        else:
+            api_response = self.build_failure_response(response)
+
+        return api_response
+
+
+class PaymentDetails(AdaptiveApiBase):
+    OPERATION = 'PaymentDetails'
+    READ_ONLY = True
+
+    schema = Schema({
+        'payKey': Field(),
+        'trackingId': Field(),
+        'transactionId': Field(),
+    }, checks=[
+        lambda values: None if values else 'one of payKey, trackingId or transactionId is required',
+    ])
+
+    def build_payload(self, *args, **kwargs):
+        return self.schema.build(kwargs)
+
+    def build_response(self, response):
+        ack = response['responseEnvelope']['ack']
+        response_fields = ['ack', 'payKey', 'trackingId', 'status', 'actionType', 'currencyCode', 'feesPayer',
+                           'memo', 'senderEmail', 'sender', 'paymentInfoList']
+
+        if ack in ('Success', 'SuccessWithWarning'):
+            ApiResponse = namedtuple('ApiResponse', response_fields)
+            info_list = response.get('paymentInfoList', None)
+
+            response_kwargs = {field: response.get(field) for field in response_fields}
+            response_kwargs['ack'] = ack
+            response_kwargs['paymentInfoList'] = info_list['paymentInfo'] if info_list else None
+
+            api_response = ApiResponse(**response_kwargs)
+
+        else:
+            api_response = self.build_failure_response(response)
+
+        return api_response
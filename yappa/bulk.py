@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+import requests
+
+from .api import PreApproval
+from .transport import PooledSession
+
+
+BulkPreApprovalResult = namedtuple('BulkPreApprovalResult',
+                                   ['specId', 'ack', 'preapprovalKey', 'nextUrl', 'errors'])
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value
+
+    return datetime.fromisoformat(value)
+
+
+def validate_preapproval_spec(spec):
+    """
+    Check dates and limits of a preapproval spec before sending it to PayPal
+
+    @param spec: keyword arguments for PreApproval.request()
+    @return: list of error messages, empty if the spec is valid
+    """
+    errors = PreApproval.schema.validate(spec)
+    dates = {}
+
+    for field in ('startingDate', 'endingDate'):
+        value = spec.get(field)
+
+        if value is None:
+            continue
+
+        try:
+            dates[field] = _parse_date(value)
+        except (TypeError, ValueError):
+            errors.append('{} is not a valid ISO 8601 date'.format(field))
+
+    if len(dates) == 2:
+        try:
+            if dates['startingDate'] >= dates['endingDate']:
+                errors.append('endingDate needs to be later than startingDate')
+        except TypeError:
+            errors.append('startingDate and endingDate need to have the same time zone awareness')
+
+    return errors
+
+
+def spec_id_for(spec):
+    """
+    Build a stable identifier for a preapproval spec
+
+    @param spec: keyword arguments for PreApproval.request()
+    @return: hex digest of the canonical JSON form of the spec
+    """
+    canonical = json.dumps(spec, sort_keys=True, default=str)
+
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class BulkCheckpoint(object):
+    """
+    Append-only JSON lines file of completed preapprovals, used to resume interrupted runs
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as checkpoint_file:
+                for line in checkpoint_file:
+                    line = line.strip()
+
+                    if not line:
+                        continue
+
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Partially written last line of an interrupted run
+                        continue
+
+                    self.completed[entry['specId']] = entry
+
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, spec_id):
+        return spec_id in self.completed
+
+    def record(self, result):
+        entry = {
+            'specId': result.specId,
+            'preapprovalKey': result.preapprovalKey,
+            'nextUrl': result.nextUrl,
+        }
+
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.completed[result.specId] = entry
+
+    def close(self):
+        self._file.close()
+
+
+class BulkPreApproval(object):
+    """
+    Create many preapprovals concurrently over a shared connection pool
+
+    Results are yielded as soon as each request completes. Successful preapprovals are
+    written to the checkpoint file, so running the same input again skips them.
+    """
+    DEFAULT_MAX_WORKERS = 10
+
+    def __init__(self, credentials, debug=False, max_workers=DEFAULT_MAX_WORKERS, checkpoint_path=None,
+                 session=None):
+        if session is None:
+            session = PooledSession(pool_size=max_workers)
+
+        self.max_workers = max_workers
+        self.checkpoint_path = checkpoint_path
+        self.preapproval = PreApproval(credentials, debug=debug, session=session)
+
+    def _request(self, spec_id, spec, checkpoint):
+        try:
+            resp = self.preapproval.request(**spec)
+        except requests.RequestException as e:
+            return BulkPreApprovalResult(specId=spec_id, ack='Error', preapprovalKey=None, nextUrl=None,
+                                         errors=[str(e)])
+
+        if resp.ack in ('Success', 'SuccessWithWarning'):
+            result = BulkPreApprovalResult(specId=spec_id, ack=resp.ack, preapprovalKey=resp.preapprovalKey,
+                                           nextUrl=resp.nextUrl, errors=[])
+
+            # Checkpoint from the worker thread, so keys are kept even if the consumer stops early
+            if checkpoint is not None:
+                checkpoint.record(result)
+
+            return result
+
+        return BulkPreApprovalResult(specId=spec_id, ack=resp.ack, preapprovalKey=None, nextUrl=None,
+                                     errors=[resp.message])
+
+    def request(self, specs):
+        """
+        Create preapprovals for a stream of specs
+
+        @param specs: iterable of PreApproval.request() keyword arguments, or (spec_id, spec) tuples
+        @return: generator of BulkPreApprovalResult in completion order
+        """
+        checkpoint = BulkCheckpoint(self.checkpoint_path) if self.checkpoint_path else None
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        seen = set()
+        pending = set()
+        max_pending = self.max_workers * 2
+
+        try:
+            for item in specs:
+                spec_id, spec = item if isinstance(item, tuple) else (spec_id_for(item), item)
+
+                if spec_id in seen or (checkpoint is not None and spec_id in checkpoint):
+                    continue
+
+                seen.add(spec_id)
+                errors = validate_preapproval_spec(spec)
+
+                if errors:
+                    yield BulkPreApprovalResult(specId=spec_id, ack='Invalid', preapprovalKey=None,
+                                                nextUrl=None, errors=errors)
+                    continue
+
+                pending.add(executor.submit(self._request, spec_id, spec, checkpoint))
+
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        yield future.result()
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    yield future.result()
+
+        finally:
+            # Requests not started yet are dropped, running ones still finish and get checkpointed
+            for future in pending:
+                future.cancel()
+
+            executor.shutdown(wait=True)
+
+            if checkpoint is not None:
+                checkpoint.close()
@@ -0,0 +1,245 @@
+import gzip
+import json
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .utils import decimal_default, percentile
+
+
+REDACTED = '<redacted>'
+REDACTED_KEYS = frozenset([
+    'PAYPAL_USER_ID', 'PAYPAL_PASSWORD', 'PAYPAL_SIGNATURE',
+    'X-PAYPAL-SECURITY-USERID', 'X-PAYPAL-SECURITY-PASSWORD', 'X-PAYPAL-SECURITY-SIGNATURE',
+])
+
+CapturedCall = namedtuple('CapturedCall', ['started', 'operation', 'elapsed', 'payload', 'response', 'error'])
+ReplayStats = namedtuple('ReplayStats', ['count', 'errors', 'duration', 'throughput', 'p50', 'p95', 'p99'])
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+
+    return open(path, mode, encoding='utf-8')
+
+
+def redact(value):
+    """
+    Replace credential values in a nested structure
+
+    @param value: dict, list or scalar
+    @return: copy of value without credentials
+    """
+    if isinstance(value, dict):
+        return {key: REDACTED if key in REDACTED_KEYS else redact(item) for key, item in value.items()}
+
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+
+    return value
+
+
+def read_capture(path):
+    """
+    Iterate over the calls of a capture file
+
+    @param path: capture file path, gzip compressed if it ends with .gz
+    @return: generator of CapturedCall
+    """
+    with _open(path, 'r') as capture_file:
+        for line in capture_file:
+            line = line.strip()
+
+            if not line:
+                continue
+
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Partially written last line of an interrupted capture
+                continue
+
+            yield CapturedCall(started=entry['t'], operation=entry['op'], elapsed=entry['s'],
+                               payload=entry['req'], response=entry.get('resp'), error=entry.get('err'))
+
+
+class TrafficRecorder(object):
+    """
+    Append API calls to a capture file, one compact JSON object per line
+
+    Pass it as `recorder` to any operation. Headers are never written and credential keys in
+    payloads are redacted. Files ending with .gz are gzip compressed; appending to an existing
+    capture adds a new gzip member, which readers handle transparently.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = _open(path, 'a')
+
+    def record(self, operation, payload, response, started, elapsed, error=None):
+        entry = {
+            't': round(started, 6),
+            'op': operation,
+            's': round(elapsed, 6),
+            'req': redact(payload),
+        }
+
+        if error is not None:
+            entry['err'] = '{}: {}'.format(type(error).__name__, error)
+        else:
+            entry['resp'] = response
+
+        line = json.dumps(entry, separators=(',', ':'), default=decimal_default)
+
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ReplayResponse(object):
+
+    def __init__(self, response):
+        self.status_code = 200
+        self._response = response
+
+    def json(self):
+        return self._response
+
+
+class ReplayTransport(object):
+    """
+    Session-like transport serving captured responses instead of calling PayPal
+
+    Pass it as `session` to any operation. Requests are matched on operation and payload, falling
+    back to the next unused capture of the same operation. Each response is delayed by its
+    recorded latency divided by `speed`; `speed=None` serves responses without delay.
+    """
+
+    def __init__(self, path, speed=1.0):
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._calls = list(read_capture(path))
+        self._used = set()
+        self._by_payload = defaultdict(deque)
+        self._by_operation = defaultdict(deque)
+
+        for index, call in enumerate(self._calls):
+            self._by_payload[self._payload_key(call.operation, call.payload)].append(index)
+            self._by_operation[call.operation].append(index)
+
+    @staticmethod
+    def _payload_key(operation, payload):
+        return operation, json.dumps(redact(payload), sort_keys=True, default=decimal_default)
+
+    def _pop_unused(self, indexes):
+        # Every call sits in a payload queue and an operation queue, skip the ones already served
+        while indexes:
+            index = indexes.popleft()
+
+            if index not in self._used:
+                self._used.add(index)
+                return self._calls[index]
+
+        return None
+
+    def _take(self, operation, payload):
+        with self._lock:
+            call = self._pop_unused(self._by_payload[self._payload_key(operation, payload)])
+
+            if call is None:
+                call = self._pop_unused(self._by_operation[operation])
+
+        if call is None:
+            raise requests.ConnectionError('no captured response left for {}'.format(operation))
+
+        return call
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        # Options such as timeout are accepted like requests does, a replayed call never waits on a socket
+        call = self._take(url.rsplit('/', 1)[-1], json.loads(data))
+
+        if self.speed:
+            time.sleep(call.elapsed / self.speed)
+
+        if call.error is not None:
+            raise requests.ConnectionError(call.error)
+
+        return ReplayResponse(call.response)
+
+
+class TrafficReplayer(object):
+    """
+    Re-issue captured calls with their original arrival pattern and measure the client
+
+    `clients` maps operation names (e.g. 'Pay') to operation instances, typically built with a
+    ReplayTransport or pointed at a stub server. Arrival times are compressed by `speed`;
+    `speed=None` sends every call as fast as the workers allow.
+    """
+
+    def __init__(self, path, clients, speed=1.0, max_workers=20):
+        self.path = path
+        self.clients = clients
+        self.speed = speed
+        self.max_workers = max_workers
+
+    def _send(self, call):
+        client = self.clients[call.operation]
+        clock = time.perf_counter()
+
+        try:
+            client.build_response(client._post(call.payload))
+        except Exception:
+            return time.perf_counter() - clock, True
+
+        return time.perf_counter() - clock, False
+
+    def run(self):
+        """
+        Replay the capture file
+
+        @return: ReplayStats with latencies in seconds and throughput in calls per second
+        """
+        futures = []
+        first_started = None
+        clock = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for call in read_capture(self.path):
+                if call.operation not in self.clients:
+                    continue
+
+                if first_started is None:
+                    first_started = call.started
+
+                if self.speed:
+                    delay = (call.started - first_started) / self.speed - (time.perf_counter() - clock)
+
+                    if delay > 0:
+                        time.sleep(delay)
+
+                futures.append(executor.submit(self._send, call))
+
+        duration = time.perf_counter() - clock
+        results = [future.result() for future in futures]
+        latencies = [latency for latency, failed in results]
+
+        return ReplayStats(
+            count=len(results),
+            errors=sum(1 for latency, failed in results if failed),
+            duration=duration,
+            throughput=len(results) / duration if duration else 0.0,
+            p50=percentile(latencies, 50),
+            p95=percentile(latencies, 95),
+            p99=percentile(latencies, 99))
@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+from django.core.signals import setting_changed
+
+
+def _settings_changed(setting, **kwargs):
+    # Clients are built once from settings, e.g. override_settings needs fresh ones
+    if setting.startswith('YAPPA_') or setting == 'DEBUG':
+        from . import clients
+        clients.reset()
+
+
+class YappaConfig(AppConfig):
+    name = 'yappa.contrib.django'
+    label = 'yappa'
+    verbose_name = 'PayPal Adaptive Payments'
+
+    def ready(self):
+        setting_changed.connect(_settings_changed, dispatch_uid='yappa_settings_changed')
@@ -0,0 +1,95 @@
+import threading
+
+from django.conf import settings
+
+from yappa.api import Pay, PaymentDetails, PreApproval, PreApprovalDetails
+from yappa.transport import PooledSession
+
+
+_lock = threading.Lock()
+_state = {'session': None, 'clients': {}}
+
+
+def _setting(name, default=None):
+    return getattr(settings, name, default)
+
+
+def get_credentials():
+    """
+    @return: YAPPA_CREDENTIALS dict with PAYPAL_USER_ID, PAYPAL_PASSWORD, PAYPAL_SIGNATURE and PAYPAL_APP_ID
+    """
+    return settings.YAPPA_CREDENTIALS
+
+
+def get_session():
+    """
+    @return: PooledSession keeping up to YAPPA_POOL_SIZE connections alive, rebuilt in every forked worker
+    """
+    with _lock:
+        if _state['session'] is None:
+            _state['session'] = PooledSession(pool_size=_setting('YAPPA_POOL_SIZE', 10))
+
+        return _state['session']
+
+
+def get_client(operation_class):
+    """
+    Operation client built once from Django settings
+
+    Clients only hold settings and the shared PooledSession, so the ones a preforked worker
+    inherits stay usable: its connections are its own.
+
+    @param operation_class: e.g. yappa.api.Pay
+    @return: instance safe to use from several threads
+    """
+    session = get_session()
+
+    with _lock:
+        client = _state['clients'].get(operation_class)
+
+        if client is None:
+            client = operation_class(get_credentials(), debug=_setting('YAPPA_DEBUG', settings.DEBUG),
+                                     session=session, endpoint=_setting('YAPPA_ENDPOINT'))
+            _state['clients'][operation_class] = client
+
+        return client
+
+
+def reset():
+    """
+    Drop the session and clients, the next call builds them again from the current settings
+    """
+    with _lock:
+        session = _state['session']
+        _state['session'] = None
+        _state['clients'] = {}
+
+    if session is not None:
+        session.close()
+
+
+def prewarm(count=None):
+    """
+    Open keep-alive connections to PayPal, e.g. from a gunicorn post_fork hook or celery worker_process_init
+
+    @param count: connections to open, defaults to YAPPA_PREWARM or YAPPA_POOL_SIZE
+    @return: number of connections opened
+    """
+    count = count or _setting('YAPPA_PREWARM') or _setting('YAPPA_POOL_SIZE', 10)
+    return pay().prewarm(count)
+
+
+def preapproval():
+    return get_client(PreApproval)
+
+
+def preapproval_details():
+    return get_client(PreApprovalDetails)
+
+
+def pay():
+    return get_client(Pay)
+
+
+def payment_details():
+    return get_client(PaymentDetails)
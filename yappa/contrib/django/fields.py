@@ -0,0 +1,40 @@
+from django.core.validators import RegexValidator
+from django.db import models
+
+
+class _KeyField(models.CharField):
+    PREFIX = None
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', 64)
+        kwargs.setdefault('db_index', True)
+        super().__init__(*args, **kwargs)
+        self.validators.append(RegexValidator(r'^{}-[0-9A-Za-z]+$'.format(self.PREFIX),
+                                              'Enter a valid PayPal {}- key.'.format(self.PREFIX)))
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+
+        if kwargs.get('max_length') == 64:
+            del kwargs['max_length']
+
+        if kwargs.get('db_index') is True:
+            del kwargs['db_index']
+        else:
+            kwargs['db_index'] = False
+
+        return name, path, args, kwargs
+
+
+class PayKeyField(_KeyField):
+    """
+    Indexed CharField holding a payKey, e.g. AP-1WF1234567890123X
+    """
+    PREFIX = 'AP'
+
+
+class PreApprovalKeyField(_KeyField):
+    """
+    Indexed CharField holding a preapprovalKey, e.g. PA-1WF1234567890123X
+    """
+    PREFIX = 'PA'
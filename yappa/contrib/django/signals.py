@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+
+# Sent with `data` (dict of the notification) once PayPal confirmed it as VERIFIED
+ipn_received = Signal()
+
+# Sent with `kind` ('payment' or 'preapproval'), `key`, `details` (the *Details response) and `request`
+returned = Signal()
+cancelled = Signal()
@@ -0,0 +1,12 @@
+from django.urls import path
+
+from . import views
+
+
+app_name = 'yappa'
+
+urlpatterns = [
+    path('ipn/', views.ipn, name='ipn'),
+    path('return/', views.payment_return, name='return'),
+    path('cancel/', views.payment_cancel, name='cancel'),
+]
@@ -0,0 +1,147 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from yappa.exceptions import PayException, PreApprovalException
+
+from . import clients
+from .signals import cancelled, ipn_received, returned
+
+
+IPN_VERIFY_URLS = {
+    True: 'https://ipnpb.sandbox.paypal.com/cgi-bin/webscr',
+    False: 'https://ipnpb.paypal.com/cgi-bin/webscr',
+}
+COOKIES = {
+    'payment': 'yappa_paykey',
+    'preapproval': 'yappa_preapprovalkey',
+}
+KEY_MAX_AGE = 3 * 60 * 60   # PayPal lets keys awaiting approval expire after three hours
+
+
+def _debug():
+    return getattr(settings, 'YAPPA_DEBUG', settings.DEBUG)
+
+
+def _flow_urls(request, kind):
+    return (request.build_absolute_uri('{}?kind={}'.format(reverse('yappa:return'), kind)),
+            request.build_absolute_uri('{}?kind={}'.format(reverse('yappa:cancel'), kind)))
+
+
+def _redirect(url, kind, key):
+    # The key travels in a signed cookie, PayPal sends the buyer back to returnUrl as it was given
+    response = HttpResponseRedirect(url)
+    response.set_signed_cookie(COOKIES[kind], key, max_age=KEY_MAX_AGE, httponly=True, samesite='Lax')
+    return response
+
+
+async def start_preapproval(request, **kwargs):
+    """
+    Request a preapproval and send the buyer to PayPal to approve it
+
+    @param request: Django request
+    @param kwargs: PreApproval.request() arguments, returnUrl and cancelUrl default to the app's views
+    @return: HttpResponseRedirect to the PayPal approval page
+    @raise PreApprovalException: when PayPal refuses the request
+    """
+    return_url, cancel_url = _flow_urls(request, 'preapproval')
+    kwargs.setdefault('returnUrl', return_url)
+    kwargs.setdefault('cancelUrl', cancel_url)
+
+    resp = await clients.preapproval().arequest(**kwargs)
+
+    if resp.ack not in ('Success', 'SuccessWithWarning'):
+        raise PreApprovalException(resp.message)
+
+    return _redirect(resp.nextUrl, 'preapproval', resp.preapprovalKey)
+
+
+async def start_payment(request, **kwargs):
+    """
+    Create a payment and send the buyer to PayPal if it still needs their approval
+
+    Payments made with an approved preapprovalKey complete right away and go straight to the return view.
+
+    @param request: Django request
+    @param kwargs: Pay.request() arguments, returnUrl and cancelUrl default to the app's views
+    @return: HttpResponseRedirect
+    @raise PayException: when PayPal refuses the request
+    """
+    return_url, cancel_url = _flow_urls(request, 'payment')
+    kwargs.setdefault('returnUrl', return_url)
+    kwargs.setdefault('cancelUrl', cancel_url)
+
+    client = clients.pay()
+    resp = await client.arequest(**kwargs)
+
+    if resp.ack not in ('Success', 'SuccessWithWarning'):
+        raise PayException(resp.message)
+
+    if resp.paymentExecStatus == 'CREATED':
+        url = client.approval_url(resp.payKey)
+    else:
+        url = kwargs['returnUrl']
+
+    return _redirect(url, 'payment', resp.payKey)
+
+
+async def _finish_flow(request, signal):
+    kind = request.GET.get('kind')
+
+    if kind not in COOKIES:
+        return HttpResponseBadRequest('unknown flow')
+
+    key = request.get_signed_cookie(COOKIES[kind], default=None, max_age=KEY_MAX_AGE)
+
+    if key is None:
+        return HttpResponseBadRequest('no {} in progress'.format(kind))
+
+    if kind == 'payment':
+        details = await clients.payment_details().arequest(payKey=key)
+    else:
+        details = await clients.preapproval_details().arequest(preapprovalKey=key)
+
+    # Receivers usually touch the database, which is not allowed from async code
+    await sync_to_async(signal.send)(sender=kind, kind=kind, key=key, details=details, request=request)
+
+    response = HttpResponseRedirect(getattr(settings, 'YAPPA_DONE_URL', '/'))
+    response.delete_cookie(COOKIES[kind])
+    return response
+
+
+@require_GET
+async def payment_return(request):
+    return await _finish_flow(request, returned)
+
+
+@require_GET
+async def payment_cancel(request):
+    return await _finish_flow(request, cancelled)
+
+
+def _verify_ipn(body):
+    response = clients.get_session().post(IPN_VERIFY_URLS[bool(_debug())], data=b'cmd=_notify-validate&' + body,
+                                          headers={'Content-Type': 'application/x-www-form-urlencoded'}, timeout=30)
+    return response.text == 'VERIFIED'
+
+
+@csrf_exempt
+@require_POST
+async def ipn(request):
+    """
+    Instant Payment Notification listener, sends ipn_received for notifications PayPal confirms
+
+    Always answers 200 so PayPal does not retry notifications that failed verification.
+    """
+    body = request.body
+    verified = await asyncio.get_running_loop().run_in_executor(None, _verify_ipn, body)
+
+    if verified:
+        await sync_to_async(ipn_received.send)(sender='ipn', data=request.POST.dict())
+
+    return HttpResponse()
@@ -13,3 +13,14 @@ class PreApprovalException(AdaptiveApiException):
 
 class InvalidReceiverException(AdaptiveApiException):
     pass
+
+
+class OutboxFullException(AdaptiveApiException):
+    pass
+
+
+class ValidationException(AdaptiveApiException):
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
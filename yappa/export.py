@@ -0,0 +1,293 @@
+import csv
+import gzip
+from datetime import datetime, timezone
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation
+from functools import lru_cache
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:     # Optional, only Parquet and Arrow files need it
+    pyarrow = None
+
+from .exceptions import AdaptiveApiException
+
+
+STRING, DECIMAL, TIMESTAMP, BOOLEAN, INTEGER = 'string', 'decimal', 'timestamp', 'boolean', 'integer'
+
+# One row per receiver of a payment, one row per preapproval
+EXPORT_COLUMNS = [
+    ('kind', STRING),
+    ('ack', STRING),
+    ('timestamp', TIMESTAMP),
+    ('payKey', STRING),
+    ('preapprovalKey', STRING),
+    ('trackingId', STRING),
+    ('status', STRING),
+    ('currencyCode', STRING),
+    ('senderEmail', STRING),
+    ('feesPayer', STRING),
+    ('memo', STRING),
+    ('receiverEmail', STRING),
+    ('receiverAmount', DECIMAL),
+    ('receiverPrimary', BOOLEAN),
+    ('transactionId', STRING),
+    ('transactionStatus', STRING),
+    ('refundedAmount', DECIMAL),
+    ('startingDate', TIMESTAMP),
+    ('endingDate', TIMESTAMP),
+    ('maxTotalAmountOfAllPayments', DECIMAL),
+    ('curPaymentsAmount', DECIMAL),
+    ('curPayments', INTEGER),
+]
+
+FORMATS = ('parquet', 'arrow', 'csv')
+
+
+# Amounts and timestamps repeat a lot, every receiver row of a payment shares its timestamp
+@lru_cache(maxsize=65536)
+def _decimal(value):
+    if value is None or value == '':
+        return None
+
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
+
+
+@lru_cache(maxsize=65536)
+def _timestamp(value):
+    if not value:
+        return None
+
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+
+    # Naive values are taken as UTC, aware ones are normalized to it
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+
+
+def _boolean(value):
+    if value is None or isinstance(value, bool):
+        return value
+
+    return str(value).lower() == 'true'
+
+
+def _integer(value):
+    return None if value is None or value == '' else int(value)
+
+
+CONVERTERS = {STRING: lambda value: value, DECIMAL: _decimal, TIMESTAMP: _timestamp, BOOLEAN: _boolean,
+              INTEGER: _integer}
+
+
+def flatten_record(record):
+    """
+    Turn a Pay, PaymentDetails or PreApprovalDetails response, or the equivalent raw dict, into export rows
+
+    PreApprovalDetails responses do not repeat the key they were asked for, pass them as
+    (preapprovalKey, response) pairs; a key given with a payment fills in a missing payKey.
+
+    @param record: response namedtuple or dict, or a (key, response) pair; a `timestamp` or
+                   responseEnvelope.timestamp is kept
+    @return: list of row dicts keyed by EXPORT_COLUMNS names, one per receiver for payments
+    """
+    key = None
+
+    if isinstance(record, tuple) and not hasattr(record, '_asdict'):
+        key, record = record
+
+    record = record._asdict() if hasattr(record, '_asdict') else record
+    envelope = record.get('responseEnvelope') or {}
+    info_list = record.get('paymentInfoList') or []
+
+    if isinstance(info_list, dict):
+        info_list = info_list.get('paymentInfo', [])
+
+    kind = 'payment' if record.get('payKey') or info_list else 'preapproval'
+    base = {
+        'kind': kind,
+        'ack': record.get('ack') or envelope.get('ack'),
+        'timestamp': record.get('timestamp') or envelope.get('timestamp'),
+        'status': record.get('paymentExecStatus') or record.get('status'),
+    }
+
+    for name in ('payKey', 'preapprovalKey', 'trackingId', 'currencyCode', 'senderEmail', 'feesPayer', 'memo',
+                 'startingDate', 'endingDate', 'maxTotalAmountOfAllPayments', 'curPaymentsAmount', 'curPayments'):
+        base[name] = record.get(name)
+
+    if key is not None:
+        key_column = 'payKey' if kind == 'payment' else 'preapprovalKey'
+        base[key_column] = base[key_column] or key
+
+    if not info_list:
+        return [base]
+
+    rows = []
+
+    for info in info_list:
+        receiver = info.get('receiver') or {}
+        row = dict(base)
+        row['receiverEmail'] = receiver.get('email')
+        row['receiverAmount'] = receiver.get('amount')
+        row['receiverPrimary'] = receiver.get('primary')
+        row['transactionId'] = info.get('transactionId')
+        row['transactionStatus'] = info.get('transactionStatus')
+        row['refundedAmount'] = info.get('refundedAmount')
+        rows.append(row)
+
+    return rows
+
+
+def _format_for(path):
+    if path.endswith('.parquet'):
+        return 'parquet'
+
+    if path.endswith(('.arrow', '.feather')):
+        return 'arrow'
+
+    return 'csv'
+
+
+class HistoryExporter(object):
+    """
+    Stream payment and preapproval history into a columnar file
+
+    Records are flattened and converted column by column into row groups of `chunk_size` rows,
+    so memory stays the same however many records are exported. Amounts are kept as decimals
+    with `decimal_scale` places, 2 covers the minor units of every PayPal currency; amounts with
+    more places are rounded half to even and counted in `rounded`. Timestamps are kept as UTC.
+    Parquet and Arrow IPC files need pyarrow, any other path gets a gzip compressed CSV written
+    with the standard library only.
+    """
+
+    def __init__(self, path, file_format=None, chunk_size=100000, compression='zstd', decimal_scale=2):
+        file_format = file_format or _format_for(path)
+
+        if file_format not in FORMATS:
+            raise AdaptiveApiException('file_format needs to be one of {}'.format(', '.join(FORMATS)))
+
+        if file_format != 'csv' and pyarrow is None:
+            raise AdaptiveApiException('pyarrow is required to export {} files'.format(file_format))
+
+        self.path = path
+        self.file_format = file_format
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.decimal_scale = decimal_scale
+        self.rounded = 0
+        self._exponent = Decimal(1).scaleb(-decimal_scale)
+
+    def arrow_schema(self):
+        types = {
+            STRING: pyarrow.string(),
+            DECIMAL: pyarrow.decimal128(38, self.decimal_scale),
+            TIMESTAMP: pyarrow.timestamp('ms', tz='UTC'),
+            BOOLEAN: pyarrow.bool_(),
+            INTEGER: pyarrow.int64(),
+        }
+
+        return pyarrow.schema([(name, types[column_type]) for name, column_type in EXPORT_COLUMNS])
+
+    def _chunks(self, records):
+        rows = []
+
+        for record in records:
+            rows.extend(flatten_record(record))
+
+            if len(rows) >= self.chunk_size:
+                yield self._columns(rows[:self.chunk_size])
+                rows = rows[self.chunk_size:]
+
+        while rows:
+            yield self._columns(rows[:self.chunk_size])
+            rows = rows[self.chunk_size:]
+
+    def _quantize(self, value):
+        # A fixed scale column refuses values with more places, round them instead of failing mid-file
+        if value is None:
+            return None
+
+        quantized = value.quantize(self._exponent, rounding=ROUND_HALF_EVEN)
+
+        if quantized != value:
+            self.rounded += 1
+
+        return quantized
+
+    def _columns(self, rows):
+        # Converting a whole column at a time keeps the per-value work in list comprehensions
+        columns = {}
+
+        for name, column_type in EXPORT_COLUMNS:
+            values = [row.get(name) for row in rows]
+
+            if column_type == STRING:
+                columns[name] = values
+            elif column_type == DECIMAL:
+                columns[name] = [self._quantize(value) for value in map(_decimal, values)]
+            else:
+                columns[name] = list(map(CONVERTERS[column_type], values))
+
+        return columns, len(rows)
+
+    def export(self, records):
+        """
+        @param records: iterable of responses, raw response dicts or (key, response) pairs, consumed once
+        @return: number of rows written
+        """
+        if self.file_format == 'csv':
+            return self._export_csv(records)
+
+        schema = self.arrow_schema()
+        rows = 0
+
+        if self.file_format == 'parquet':
+            writer = pyarrow.parquet.ParquetWriter(self.path, schema, compression=self.compression)
+        else:
+            writer = pyarrow.ipc.new_file(self.path, schema,
+                                          options=pyarrow.ipc.IpcWriteOptions(compression=self.compression))
+
+        try:
+            for columns, size in self._chunks(records):
+                writer.write_table(pyarrow.Table.from_pydict(columns, schema=schema))
+                rows += size
+        finally:
+            writer.close()
+
+        return rows
+
+    def _export_csv(self, records):
+        rows = 0
+
+        with gzip.open(self.path, 'wt', compresslevel=6, newline='', encoding='utf-8') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow([name for name, _ in EXPORT_COLUMNS])
+
+            for columns, size in self._chunks(records):
+                values = [[self._csv_value(value) for value in columns[name]] for name, _ in EXPORT_COLUMNS]
+                writer.writerows(zip(*values))
+                rows += size
+
+        return rows
+
+    @staticmethod
+    def _csv_value(value):
+        if value is None:
+            return ''
+
+        if isinstance(value, datetime):
+            return value.isoformat()
+
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+
+        return value
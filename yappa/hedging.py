@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .exceptions import AdaptiveApiException
+from .utils import percentile
+
+
+HedgeStats = namedtuple('HedgeStats', ['requests', 'hedges', 'hedgeWins', 'winRate', 'delay'])
+
+
+class HedgePolicy(object):
+    """
+    Send a second identical request when the first is slower than usual, keep the fastest
+
+    The hedge delay is the given percentile of recent latencies, clamped between min_delay and
+    max_delay (initial_delay until enough samples exist). At most `budget` hedges per request are
+    sent on average, with up to `burst` saved up. Only read-only operations can be hedged.
+
+    Both calls run on the policy's pool, so at most `max_workers` calls are in flight at once;
+    size it to the callers' concurrency. The delay counts from when the first call starts, a call
+    still queued for a worker is not hedged.
+    """
+    MIN_SAMPLES = 20
+
+    def __init__(self, percentile=95, min_delay=0.05, max_delay=2.0, initial_delay=0.5, budget=0.05, burst=10,
+                 window=1000, max_workers=16):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.initial_delay = initial_delay
+        self.budget = budget
+        self.burst = burst
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+        self._tokens = float(burst)
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='yappa-hedge')
+
+    def delay(self):
+        with self._lock:
+            if len(self._latencies) < self.MIN_SAMPLES:
+                return self.initial_delay
+
+            value = percentile(list(self._latencies), self.percentile)
+
+        return min(self.max_delay, max(self.min_delay, value))
+
+    def stats(self):
+        with self._lock:
+            win_rate = self.hedge_wins / self.hedges if self.hedges else 0.0
+            requests, hedges, hedge_wins = self.requests, self.hedges, self.hedge_wins
+
+        return HedgeStats(requests=requests, hedges=hedges, hedgeWins=hedge_wins, winRate=win_rate,
+                          delay=self.delay())
+
+    def _take_token(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+
+            self._tokens -= 1
+            self.hedges += 1
+            return True
+
+    def _timed(self, fn, started=None):
+        clock = time.perf_counter()
+
+        if started is not None:
+            started.set_result(clock)
+
+        result = fn()
+        elapsed = time.perf_counter() - clock
+
+        with self._lock:
+            self._latencies.append(elapsed)
+
+        return result
+
+    def execute(self, operation, fn):
+        """
+        Run fn, hedging it with a second call if it is slow
+
+        @param operation: operation instance the call belongs to, has to be read-only
+        @param fn: function without arguments sending the request
+        @return: result of whichever call finished first without error
+        """
+        if not operation.READ_ONLY:
+            raise AdaptiveApiException('hedging can only be used with read-only operations, not {}'.
+                                       format(operation.OPERATION))
+
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.burst, self._tokens + self.budget)
+
+        started = Future()
+        primary = self._executor.submit(self._timed, fn, started)
+        # Time spent waiting for a free worker is not latency of the call, do not hedge it
+        clock = started.result()
+        done, _ = wait([primary], timeout=max(0.0, clock + self.delay() - time.perf_counter()))
+
+        if done or not self._take_token():
+            return primary.result()
+
+        hedge = self._executor.submit(self._timed, fn)
+        pending = {primary, hedge}
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is not None and pending:
+                    continue
+
+                if future is hedge and future.exception() is None:
+                    with self._lock:
+                        self.hedge_wins += 1
+
+                return future.result()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -60,6 +60,26 @@ class ReceiverList(object):
 
         self.receivers.append(receiver)
 
+    def validate(self):
+        """
+        Check the list as a whole before it is sent
+
+        @return: list of error messages, empty if the list is valid
+        """
+        errors = []
+
+        if not self.receivers:
+            errors.append('receiverList needs at least one receiver')
+
+        for receiver in self.receivers:
+            if receiver.amount <= 0:
+                errors.append('amount of receiver {} needs to be greater than 0'.format(receiver.email))
+
+        if sum(1 for receiver in self.receivers if receiver.primary) > 1:
+            errors.append('receiverList can have only one primary receiver')
+
+        return errors
+
     def to_json(self):
         return {
             'receiver': [receiver.to_dict() for receiver in self.receivers]
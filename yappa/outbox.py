@@ -0,0 +1,396 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import Future, InvalidStateError
+
+import requests
+
+try:
+    from requests.packages.urllib3.exceptions import ConnectTimeoutError
+except ImportError:     # requests without its urllib3 alias
+    from urllib3.exceptions import ConnectTimeoutError
+
+from .api import PaymentDetails
+from .exceptions import AdaptiveApiException, OutboxFullException
+from .transport import PooledSession
+from .utils import decimal_default
+
+
+PENDING = 'PENDING'
+DONE = 'DONE'
+FAILED = 'FAILED'
+
+
+def _not_sent(error):
+    """
+    Whether a request error happened before the request could reach PayPal
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+
+    if isinstance(error, requests.ConnectionError) and error.args:
+        # MaxRetryError wraps the cause; NewConnectionError and NameResolutionError are connect timeouts too
+        reason = getattr(error.args[0], 'reason', error.args[0])
+        return isinstance(reason, ConnectTimeoutError)
+
+    return False
+
+
+class OutboxHandle(object):
+    """
+    Result of an outbox submission, can be polled, waited on, awaited or given callbacks
+
+    result() returns the operation response (e.g. PayResponse) once the call went out.
+    """
+
+    def __init__(self, outbox, key):
+        self.outbox = outbox
+        self.key = key
+        self._future = Future()
+
+    def done(self):
+        return self._future.done()
+
+    def status(self):
+        """
+        @return: PENDING, DONE or FAILED as persisted in the outbox
+        """
+        return self.outbox.status(self.key)
+
+    def result(self, timeout=None):
+        return self._future.result(timeout)
+
+    def exception(self, timeout=None):
+        return self._future.exception(timeout)
+
+    def add_done_callback(self, fn):
+        """
+        @param fn: called with this handle when the call finished, on a worker thread
+        """
+        self._future.add_done_callback(lambda _: fn(self))
+
+    def __await__(self):
+        return asyncio.wrap_future(self._future).__await__()
+
+    def _settle(self, result=None, error=None):
+        # A resubmitted key may resolve the handle from the database while its worker finishes
+        try:
+            if error is not None:
+                self._future.set_exception(error)
+            else:
+                self._future.set_result(result)
+        except InvalidStateError:
+            pass
+
+
+class Outbox(object):
+    """
+    Durable queue in front of an operation, so callers return before the PayPal call is made
+
+    submit() validates the request, writes its payload to SQLite with an idempotency key and
+    returns a handle. Background workers send queued calls over one pooled session. Calls of the
+    same sender always go to the same worker, so they are delivered in submission order. At most
+    `max_pending` calls may wait; beyond that submit() blocks or raises OutboxFullException.
+
+    For operations accepting a trackingId, the idempotency key is sent as trackingId unless one
+    is given, so PayPal refuses a payment that was already made. Calls still pending when the
+    process stopped are sent again when an Outbox is opened on the same file.
+
+    Calls go through the operation's scheduler and store like request() does. Only errors raised
+    before the request was sent are retried as they are. After other errors a Pay call is looked up
+    with PaymentDetails by its trackingId and only sent again if PayPal does not know it; calls of
+    other operations fail. Pay calls recovered on start and Pay calls PayPal refuses are looked up
+    the same way, so a payment that went out before a crash is not reported as failed.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS outbox (
+            seq INTEGER PRIMARY KEY,
+            key TEXT NOT NULL UNIQUE,
+            sender TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            response TEXT,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS outbox_state ON outbox (state, seq);
+    """
+
+    def __init__(self, operation, path='yappa-outbox.db', workers=4, max_pending=1000, retries=3, backoff=0.5):
+        self.operation = operation
+        self.path = path
+        self.retries = retries
+        self.backoff = backoff
+        self._handles = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+        if operation.session is None:
+            # One keep-alive pool shared by every worker
+            operation.session = PooledSession(pool_size=workers)
+
+        self._details = None
+
+        if operation.OPERATION == 'Pay':
+            self._details = PaymentDetails(operation.credentials, session=operation.session,
+                                           endpoint=operation.endpoint.rsplit('/', 1)[0])
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=FULL')
+        self._connection.executescript(self.SCHEMA)
+
+        self._queues = [[] for _ in range(workers)]
+        self._conditions = [threading.Condition() for _ in range(workers)]
+        self._closing = False
+        self._threads = [threading.Thread(target=self._work, args=(index,), name='yappa-outbox-{}'.format(index),
+                                          daemon=True) for index in range(workers)]
+
+        for thread in self._threads:
+            thread.start()
+
+        self._recover()
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def _recover(self):
+        for key, sender, payload in self._execute('SELECT key, sender, payload FROM outbox WHERE state = ? '
+                                                  'ORDER BY seq', (PENDING,)):
+            # Recovered calls do not count against max_pending, nobody is waiting to submit them
+            self._dispatch(self._handle(key), sender, json.loads(payload), slot=False, recovered=True)
+
+    def _handle(self, key):
+        with self._lock:
+            handle = self._handles.get(key)
+
+            if handle is None:
+                handle = self._handles[key] = OutboxHandle(self, key)
+
+            return handle
+
+    def _dispatch(self, handle, sender, payload, slot=True, recovered=False):
+        index = zlib.crc32(sender.encode('utf-8')) % len(self._queues)
+
+        with self._conditions[index]:
+            self._queues[index].append((handle, payload, slot, recovered))
+            self._conditions[index].notify()
+
+    def submit(self, idempotency_key=None, callback=None, block=True, timeout=None, **kwargs):
+        """
+        Validate and durably enqueue a call
+
+        @param idempotency_key: key identifying the call, submitting the same key again returns the first handle
+        @param callback: called with the handle once the call finished
+        @param block: whether to wait for room when max_pending calls are queued
+        @param kwargs: request arguments of the operation
+        @return: OutboxHandle
+        @raise ValidationException: when the request arguments are invalid
+        @raise OutboxFullException: when there is no room and block is False or timeout expired
+        """
+        key = idempotency_key or uuid.uuid4().hex
+        existing = self._execute('SELECT state FROM outbox WHERE key = ?', (key,))
+
+        if existing:
+            handle = self._handle(key)
+
+            if existing[0][0] != PENDING and not handle.done():
+                self._resolve_finished(handle)
+
+            if callback is not None:
+                handle.add_done_callback(callback)
+
+            return handle
+
+        payload = self.operation._build_request_payload(**kwargs)
+
+        schema = getattr(self.operation, 'schema', None)
+
+        if schema is not None and 'trackingId' in schema.fields and not payload.get('trackingId'):
+            payload['trackingId'] = key
+
+        if not self._slots.acquire(block, timeout):
+            raise OutboxFullException('outbox has too many pending calls')
+
+        sender = payload.get('senderEmail') or key
+
+        try:
+            self._execute('INSERT INTO outbox (key, sender, payload, state, created_at) VALUES (?, ?, ?, ?, ?)',
+                          (key, sender, json.dumps(payload, default=decimal_default), PENDING, time.time()))
+        except sqlite3.IntegrityError:
+            # Submitted concurrently under the same key, the other caller's call is the one sent
+            self._slots.release()
+            return self.submit(idempotency_key=key, callback=callback, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+
+        handle = self._handle(key)
+
+        if callback is not None:
+            handle.add_done_callback(callback)
+
+        # Same JSON the row holds, so recovered and fresh calls send identical payloads
+        self._dispatch(handle, sender, json.loads(json.dumps(payload, default=decimal_default)))
+        return handle
+
+    def _resolve_finished(self, handle):
+        state, response, error = self._execute('SELECT state, response, error FROM outbox WHERE key = ?',
+                                               (handle.key,))[0]
+
+        if state == DONE:
+            handle._settle(self.operation.build_response(json.loads(response)))
+        else:
+            handle._settle(error=AdaptiveApiException(error))
+
+    def status(self, key):
+        rows = self._execute('SELECT state FROM outbox WHERE key = ?', (key,))
+        return rows[0][0] if rows else None
+
+    def pending(self):
+        return self._execute('SELECT count(*) FROM outbox WHERE state = ?', (PENDING,))[0][0]
+
+    def _work(self, index):
+        queue, condition = self._queues[index], self._conditions[index]
+
+        while True:
+            with condition:
+                while not queue and not self._closing:
+                    condition.wait()
+
+                if not queue:
+                    return
+
+                handle, payload, slot, recovered = queue.pop(0)
+
+            try:
+                self._deliver(handle, payload, recovered)
+            except Exception as e:
+                # E.g. an undecodable response; fail the call, the worker carries on with the next one
+                self._finish(handle, FAILED, 1, error=e)
+            finally:
+                if slot:
+                    self._slots.release()
+
+    def _made(self, payload):
+        """
+        @return: Pay response of the payment PayPal made under the payload's trackingId, None if it made none
+        """
+        details = self._details._exchange(self._details._build_request_payload(trackingId=payload['trackingId']))
+
+        if details['responseEnvelope']['ack'] not in ('Success', 'SuccessWithWarning'):
+            return None
+
+        return {
+            'payKey': details.get('payKey'),
+            'paymentExecStatus': details.get('status'),
+            'paymentInfoList': details.get('paymentInfoList'),
+            'sender': details.get('sender'),
+            'responseEnvelope': details['responseEnvelope'],
+        }
+
+    def _lookup(self, payload):
+        # Only Pay calls with a trackingId can be looked up
+        return self._details is not None and bool(payload.get('trackingId'))
+
+    def _deliver(self, handle, payload, recovered=False):
+        attempt = 0
+        uncertain = recovered and self._lookup(payload)     # Whether an earlier attempt may have reached PayPal
+
+        while True:
+            attempt += 1
+
+            try:
+                response = self._made(payload) if uncertain else None
+
+                if response is None:
+                    uncertain = False
+                    response = self.operation._exchange(payload)
+
+                    # Refused, e.g. for a trackingId a payment sent before a crash already used
+                    if response['responseEnvelope']['ack'] not in ('Success', 'SuccessWithWarning') and \
+                            self._lookup(payload):
+                        response = self._made(payload) or response
+
+                break
+            except requests.RequestException as e:
+                if self._closing:
+                    # Stays pending and goes out again on the next start
+                    handle._settle(error=AdaptiveApiException('outbox closed before the call went out'))
+                    return
+
+                if not (uncertain or _not_sent(e)):
+                    if not self._lookup(payload):
+                        self._finish(handle, FAILED, attempt, error=e)
+                        return
+
+                    uncertain = True
+
+                if attempt <= self.retries:
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+                    continue
+
+                self._finish(handle, FAILED, attempt, error=e)
+                return
+
+        try:
+            result = self.operation.build_response(response)
+        except Exception as e:
+            self._finish(handle, FAILED, attempt, response=response, error=e)
+            return
+
+        self._finish(handle, DONE, attempt, response=response, result=result)
+
+    def _finish(self, handle, state, attempts, response=None, result=None, error=None):
+        self._execute('UPDATE outbox SET state = ?, attempts = ?, finished_at = ?, response = ?, error = ? '
+                      'WHERE key = ?',
+                      (state, attempts, time.time(), json.dumps(response) if response is not None else None,
+                       repr(error) if error is not None else None, handle.key))
+
+        with self._lock:
+            self._handles.pop(handle.key, None)
+
+        handle._settle(result, error)
+
+    def close(self, wait=True):
+        """
+        Stop the workers. With wait, queued calls are sent first, otherwise they stay pending for the next start.
+        """
+        if not wait:
+            for index, condition in enumerate(self._conditions):
+                with condition:
+                    dropped = self._queues[index][:]
+                    del self._queues[index][:]
+
+                # They stay pending and go out again on the next start
+                for handle, _, slot, _ in dropped:
+                    handle._settle(error=AdaptiveApiException('outbox closed before the call went out'))
+
+                    if slot:
+                        self._slots.release()
+
+        self._closing = True
+
+        for condition in self._conditions:
+            with condition:
+                condition.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,266 @@
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+
+from .api import SetPaymentOptions
+from .exceptions import AdaptiveApiException, PayException
+from .utils import percentile
+
+
+PAYKEY_LIFETIME = 3 * 60 * 60   # PayPal expires payKeys of unapproved payments after three hours
+
+PooledPayKey = namedtuple('PooledPayKey', ['payKey', 'nextUrl', 'configuration', 'createdAt', 'expiresAt', 'hit'])
+PayKeyPoolStats = namedtuple('PayKeyPoolStats', ['hits', 'misses', 'hitRate', 'ready', 'expired', 'refills',
+                                                 'refillFailures', 'refillP50', 'refillP95'])
+
+
+class PayKeyPool(object):
+    """
+    Keep payments created ahead of time, so checkout can redirect without waiting for Pay
+
+    Every configuration is a fixed set of Pay arguments (currency, receivers and amounts, URLs)
+    created with actionType CREATE. PayPal does not let a created payment change its amounts,
+    so pool the configurations that repeat, e.g. products with a fixed price. Order details such
+    as invoice data or a description can still be bound at checkout with SetPaymentOptions.
+
+    checkout() takes the oldest key that is not about to expire, or creates one on the spot when
+    the pool is empty, and refills the pool in the background. Keys within `expiry_margin`
+    seconds of expiring are dropped and replaced.
+    """
+
+    def __init__(self, pay, size=5, lifetime=PAYKEY_LIFETIME, expiry_margin=600, refill_workers=2,
+                 sweep_interval=60, options=None, window=1000):
+        """
+        @param pay: yappa.api.Pay instance used to create payments
+        @param size: keys kept ready per configuration unless configured otherwise
+        @param options: SetPaymentOptions instance, by default one sharing the credentials and session of pay
+        """
+        self.pay = pay
+        self.size = size
+        self.lifetime = lifetime
+        self.expiry_margin = expiry_margin
+        self.options = options or SetPaymentOptions(pay.credentials, session=pay.session,
+                                                    endpoint=pay.endpoint.rsplit('/', 1)[0])
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.refills = 0
+        self.refill_failures = 0
+
+        self._configurations = {}
+        self._targets = {}
+        self._ready = {}
+        self._inflight = {}
+        self._pending = set()
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=refill_workers, thread_name_prefix='yappa-paykeys')
+        self._closed = threading.Event()
+        self._sweeper = None
+
+        if sweep_interval:
+            self._sweeper = threading.Thread(target=self._sweep_loop, args=(sweep_interval,),
+                                             name='yappa-paykeys-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def configure(self, name, size=None, **pay_kwargs):
+        """
+        Register a configuration to keep payments ready for
+
+        @param name: configuration name used at checkout
+        @param size: keys kept ready, defaults to the pool size
+        @param pay_kwargs: Pay.request() arguments, actionType is always CREATE
+        @raise ValidationException: when the arguments are invalid
+        """
+        pay_kwargs = dict(pay_kwargs, actionType='CREATE')
+        self.pay._build_request_payload(**pay_kwargs)
+
+        with self._lock:
+            self._configurations[name] = pay_kwargs
+            self._targets[name] = self.size if size is None else size
+            self._ready.setdefault(name, deque())
+            self._inflight.setdefault(name, 0)
+
+    def _created(self, name, resp):
+        if resp.ack not in ('Success', 'SuccessWithWarning'):
+            raise PayException(resp.message)
+
+        if resp.paymentExecStatus != 'CREATED':
+            raise PayException('payment of {} was not left for approval but is {}'.format(name,
+                                                                                        resp.paymentExecStatus))
+
+        return resp.payKey, time.time()
+
+    def _create(self, name):
+        return self._created(name, self.pay.request(**self._configurations[name]))
+
+    async def _acreate(self, name):
+        return self._created(name, await self.pay.arequest(**self._configurations[name]))
+
+    def _refill_one(self, name):
+        started = time.perf_counter()
+
+        try:
+            key = self._create(name)
+        except (AdaptiveApiException, requests.RequestException):
+            with self._lock:
+                self.refill_failures += 1
+            return
+        finally:
+            with self._lock:
+                self._inflight[name] -= 1
+
+        with self._lock:
+            self.refills += 1
+            self._latencies.append(time.perf_counter() - started)
+            self._ready[name].append(key)
+
+    def _refill(self, name):
+        with self._lock:
+            missing = self._targets[name] - len(self._ready[name]) - self._inflight[name]
+
+            if missing <= 0 or self._closed.is_set():
+                return []
+
+            self._inflight[name] += missing
+
+        futures = [self._executor.submit(self._refill_one, name) for _ in range(missing)]
+
+        # Checkout threads, the sweeper and finished refills all touch the pending set
+        for future in futures:
+            with self._lock:
+                self._pending.add(future)
+
+            future.add_done_callback(self._forget)
+
+        return futures
+
+    def _forget(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _drop_expired(self, name):
+        # Called with the lock held; the oldest keys are at the left
+        ready = self._ready[name]
+        deadline = time.time() - (self.lifetime - self.expiry_margin)
+
+        while ready and ready[0][1] <= deadline:
+            ready.popleft()
+            self.expired += 1
+
+    def _take(self, name):
+        with self._lock:
+            if name not in self._configurations:
+                raise AdaptiveApiException('unknown configuration {}'.format(name))
+
+            self._drop_expired(name)
+
+            if self._ready[name]:
+                self.hits += 1
+                return self._ready[name].popleft()
+
+            self.misses += 1
+            return None
+
+    def _pooled(self, name, key, hit):
+        pay_key, created = key
+        return PooledPayKey(payKey=pay_key, nextUrl=self.pay.approval_url(pay_key), configuration=name,
+                            createdAt=created, expiresAt=created + self.lifetime, hit=hit)
+
+    def fill(self, wait_for=True):
+        """
+        Create the missing keys of every configuration, e.g. at startup
+
+        @param wait_for: whether to block until they and refills already running are done
+        """
+        for name in list(self._configurations):
+            self._refill(name)
+
+        if wait_for:
+            with self._lock:
+                pending = list(self._pending)
+
+            wait(pending)
+
+    def checkout(self, name, **options):
+        """
+        @param name: configuration name
+        @param options: SetPaymentOptions arguments binding the order, e.g. receiverOptions; costs one call
+        @return: PooledPayKey, with hit False if it had to be created on the spot
+        @raise PayException: when no payment could be created or options could not be set
+        """
+        key = self._take(name)
+        hit = key is not None
+
+        if not hit:
+            key = self._create(name)
+
+        self._refill(name)
+        pooled = self._pooled(name, key, hit)
+
+        if options:
+            self._check_options(self.options.request(payKey=pooled.payKey, **options))
+
+        return pooled
+
+    async def acheckout(self, name, **options):
+        """
+        Same as checkout(), for asyncio callers
+        """
+        key = self._take(name)
+        hit = key is not None
+
+        if not hit:
+            key = await self._acreate(name)
+
+        self._refill(name)
+        pooled = self._pooled(name, key, hit)
+
+        if options:
+            self._check_options(await self.options.arequest(payKey=pooled.payKey, **options))
+
+        return pooled
+
+    @staticmethod
+    def _check_options(resp):
+        if resp.ack not in ('Success', 'SuccessWithWarning'):
+            raise PayException(resp.message)
+
+    def sweep(self):
+        """
+        Drop keys about to expire and create their replacements
+        """
+        with self._lock:
+            names = list(self._configurations)
+
+            for name in names:
+                self._drop_expired(name)
+
+        for name in names:
+            self._refill(name)
+
+    def _sweep_loop(self, interval):
+        while not self._closed.wait(interval):
+            self.sweep()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            latencies = list(self._latencies)
+
+            return PayKeyPoolStats(hits=self.hits, misses=self.misses,
+                                   hitRate=self.hits / lookups if lookups else 0.0,
+                                   ready=sum(len(ready) for ready in self._ready.values()), expired=self.expired,
+                                   refills=self.refills, refillFailures=self.refill_failures,
+                                   refillP50=percentile(latencies, 50), refillP95=percentile(latencies, 95))
+
+    def close(self):
+        self._closed.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+        if self._sweeper is not None:
+            self._sweeper.join()
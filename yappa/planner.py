@@ -0,0 +1,292 @@
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from .exceptions import ValidationException
+from .models import Receiver, ReceiverList
+
+
+Payout = namedtuple('Payout', ['email', 'amount', 'currencyCode', 'senderEmail', 'preapprovalKey', 'feesPayer',
+                               'primary', 'chain'],
+                    defaults=(None, None, 'EACHRECEIVER', None, None))
+Payout.__doc__ = """
+One receiver to pay. Payouts sharing a `chain` id form a chained payment with exactly one
+primary and are kept in the same Pay request; other payouts to the same email are merged.
+"""
+
+PreapprovalLimits = namedtuple('PreapprovalLimits', ['maxAmountPerPayment', 'maxNumberOfPayments',
+                                                     'maxTotalAmountOfAllPayments'],
+                               defaults=(None, None, None))
+
+PlannedPayment = namedtuple('PlannedPayment', ['currencyCode', 'senderEmail', 'preapprovalKey', 'feesPayer',
+                                               'receiverList', 'amount'])
+
+PLAN_KEY_FIELDS = ('currencyCode', 'senderEmail', 'preapprovalKey', 'feesPayer')
+
+
+def _decimal(value):
+    return None if value is None else Decimal(str(value))
+
+
+def limits_from_details(resp):
+    """
+    Remaining limits of an active preapproval, from a PreApprovalDetails response
+
+    @param resp: PreApprovalDetails response
+    @return: PreapprovalLimits
+    """
+    max_total = _decimal(resp.maxTotalAmountOfAllPayments)
+    max_number = int(resp.maxNumberOfPayments) if resp.maxNumberOfPayments else None
+    used_amount = _decimal(resp.curPaymentsAmount) or Decimal(0)
+    used_number = int(resp.curPayments or 0)
+
+    return PreapprovalLimits(
+        maxAmountPerPayment=_decimal(resp.maxAmountPerPayment),
+        maxNumberOfPayments=max_number - used_number if max_number is not None else None,
+        maxTotalAmountOfAllPayments=max_total - used_amount if max_total is not None else None)
+
+
+class _Unit(object):
+    """
+    Receivers that have to travel in the same Pay request: one merged payout or one whole chain
+    """
+
+    def __init__(self, receivers):
+        self.receivers = receivers  # [email, amount, primary] lists
+        self.emails = frozenset(receiver[0] for receiver in receivers)
+        self.primaries = sum(1 for receiver in receivers if receiver[2])
+        # In a chain the sender is only charged the primary's amount, the primary pays the others
+        self.charge = (sum(receiver[1] for receiver in receivers if receiver[2]) if self.primaries
+                       else sum(receiver[1] for receiver in receivers))
+
+
+class _Bin(object):
+
+    def __init__(self):
+        self.receivers = []
+        self.emails = set()
+        self.primaries = 0
+        self.charge = Decimal(0)
+
+    def fits(self, unit, max_amount):
+        # Next to a primary every receiver becomes its secondary, so a chain is always paid on its own
+        return (not self.primaries and not unit.primaries and
+                len(self.receivers) + len(unit.receivers) <= ReceiverList.MAX_RECEIVER_AMOUNT and
+                not self.emails & unit.emails and
+                (max_amount is None or self.charge + unit.charge <= max_amount))
+
+    def add(self, unit):
+        self.receivers.extend(unit.receivers)
+        self.emails |= unit.emails
+        self.primaries += unit.primaries
+        self.charge += unit.charge
+
+
+class ExecutionPlan(object):
+    """
+    Pay requests a batch of payouts was packed into, to be inspected before execute()
+
+    `errors` lists what can not be paid as asked, e.g. a preapproval limit that is exceeded;
+    a plan with errors refuses to execute.
+    """
+
+    def __init__(self, payments, errors, payouts, receivers):
+        self.payments = payments
+        self.errors = errors
+        self.payouts = payouts
+        self.receivers = receivers
+
+    def __len__(self):
+        return len(self.payments)
+
+    def __iter__(self):
+        return iter(self.payments)
+
+    @property
+    def lower_bound(self):
+        """
+        @return: fewest Pay requests possible if only the receiver count mattered
+        """
+        size = ReceiverList.MAX_RECEIVER_AMOUNT
+        groups = {}
+
+        for payment in self.payments:
+            key = tuple(getattr(payment, field) for field in PLAN_KEY_FIELDS)
+            groups[key] = groups.get(key, 0) + len(payment.receiverList)
+
+        return sum(-(-count // size) for count in groups.values())
+
+    def describe(self):
+        """
+        @return: human readable summary of the plan, one line per Pay request
+        """
+        lines = ['{} payouts, {} receivers after merging, {} Pay requests (at least {} needed)'.format(
+            self.payouts, self.receivers, len(self.payments), self.lower_bound)]
+
+        for index, payment in enumerate(self.payments):
+            lines.append('{:>4}. {} {} from {} via {} ({}): {}'.format(
+                index + 1, payment.amount, payment.currencyCode, payment.senderEmail or '-',
+                payment.preapprovalKey or '-', payment.feesPayer,
+                ', '.join('{}{} {}'.format('*' if receiver.primary else '', receiver.email, receiver.amount)
+                          for receiver in payment.receiverList.receivers)))
+
+        for error in self.errors:
+            lines.append('error: {}'.format(error))
+
+        return '\n'.join(lines)
+
+    def execute(self, pay, max_workers=1, **kwargs):
+        """
+        Send every planned Pay request
+
+        @param pay: yappa.api.Pay instance
+        @param max_workers: Pay requests sent at the same time
+        @param kwargs: arguments shared by all requests, e.g. returnUrl and cancelUrl
+        @return: list of (PlannedPayment, response) pairs in plan order
+        @raise ValidationException: if the plan has errors
+        """
+        if self.errors:
+            raise ValidationException(self.errors)
+
+        def send(payment):
+            request_kwargs = dict(kwargs, receiverList=payment.receiverList, currencyCode=payment.currencyCode,
+                                  feesPayer=payment.feesPayer)
+
+            if payment.senderEmail:
+                request_kwargs['senderEmail'] = payment.senderEmail
+
+            if payment.preapprovalKey:
+                request_kwargs['preapprovalKey'] = payment.preapprovalKey
+
+            return payment, pay.request(**request_kwargs)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(send, self.payments))
+
+
+class PayoutPlanner(object):
+    """
+    Pack payouts into as few Pay requests as possible
+
+    Payouts are grouped by currency, sender, preapprovalKey and feesPayer, since one Pay request
+    carries one of each. Within a group, payouts to the same email are merged and the resulting
+    receivers are packed first-fit decreasing into lists of up to MAX_RECEIVER_AMOUNT, never
+    putting the same email twice or more than a preapproval's maxAmountPerPayment into one
+    request. Each chain keeps its single primary and is paid in a request of its own.
+    """
+
+    def __init__(self, limits=None):
+        """
+        @param limits: dict of preapprovalKey to PreapprovalLimits
+        """
+        self.limits = limits or {}
+
+    def _units(self, payouts):
+        merged = OrderedDict()
+        chains = OrderedDict()
+
+        for payout in payouts:
+            if payout.chain is not None:
+                chains.setdefault(payout.chain, []).append([payout.email, payout.amount, bool(payout.primary)])
+            elif payout.email in merged:
+                merged[payout.email][1] += payout.amount
+            else:
+                merged[payout.email] = [payout.email, payout.amount, False]
+
+        units = [_Unit([receiver]) for receiver in merged.values()]
+        errors = []
+
+        for chain, receivers in chains.items():
+            primaries = sum(1 for receiver in receivers if receiver[2])
+
+            if primaries != 1:
+                errors.append('chain {} needs exactly one primary receiver, has {}'.format(chain, primaries))
+            elif len(receivers) > ReceiverList.MAX_RECEIVER_AMOUNT:
+                errors.append('chain {} has more than {} receivers'.format(chain, ReceiverList.MAX_RECEIVER_AMOUNT))
+            elif len({receiver[0] for receiver in receivers}) != len(receivers):
+                errors.append('chain {} pays the same receiver twice'.format(chain))
+            else:
+                units.append(_Unit(receivers))
+
+        return units, errors
+
+    def _pack(self, units, limits):
+        max_amount = limits.maxAmountPerPayment if limits else None
+        bins = []
+
+        # Larger units first, then larger amounts, so small ones fill the gaps
+        for unit in sorted(units, key=lambda unit: (len(unit.receivers), unit.charge), reverse=True):
+            for candidate in bins:
+                if candidate.fits(unit, max_amount):
+                    candidate.add(unit)
+                    break
+            else:
+                candidate = _Bin()
+                candidate.add(unit)
+                bins.append(candidate)
+
+        return bins
+
+    def plan(self, payouts):
+        """
+        @param payouts: iterable of Payout
+        @return: ExecutionPlan
+        """
+        groups = OrderedDict()
+        count = 0
+
+        for payout in payouts:
+            if not isinstance(payout.amount, Decimal):
+                raise ValidationException(['amount of receiver {} needs to be instance of Decimal'.
+                                          format(payout.email)])
+
+            count += 1
+            groups.setdefault(tuple(getattr(payout, field) for field in PLAN_KEY_FIELDS), []).append(payout)
+
+        payments, errors = [], []
+        receivers = 0
+        # Payments and amount charged per preapproval, which may be used by several groups
+        usage = OrderedDict()
+
+        for key, group in groups.items():
+            currency, sender, preapproval_key, fees_payer = key
+            units, unit_errors = self._units(group)
+            errors.extend(unit_errors)
+            limits = self.limits.get(preapproval_key) if preapproval_key else None
+            receivers += sum(len(unit.receivers) for unit in units)
+
+            if limits is not None and limits.maxAmountPerPayment is not None:
+                for unit in units:
+                    if unit.charge > limits.maxAmountPerPayment:
+                        errors.append('{} {} to {} exceeds maxAmountPerPayment {} of preapproval {}'.format(
+                            unit.charge, currency, ', '.join(sorted(unit.emails)), limits.maxAmountPerPayment,
+                            preapproval_key))
+
+            bins = self._pack(units, limits)
+
+            for packed in bins:
+                # A lone primary is a plain payment, PayPal only accepts primary flags on chains
+                chained = len(packed.receivers) > 1 and packed.primaries
+                receiver_list = ReceiverList([Receiver(email=email, amount=amount, primary=primary if chained else None)
+                                              for email, amount, primary in packed.receivers])
+                payments.append(PlannedPayment(currencyCode=currency, senderEmail=sender,
+                                               preapprovalKey=preapproval_key, feesPayer=fees_payer,
+                                               receiverList=receiver_list, amount=packed.charge))
+
+            if limits is not None:
+                used = usage.setdefault(preapproval_key, [0, Decimal(0)])
+                used[0] += len(bins)
+                used[1] += sum(packed.charge for packed in bins)
+
+        for preapproval_key, (number, total) in usage.items():
+            limits = self.limits[preapproval_key]
+
+            if limits.maxNumberOfPayments is not None and number > limits.maxNumberOfPayments:
+                errors.append('preapproval {} allows {} more payments, plan needs {}'.format(
+                    preapproval_key, limits.maxNumberOfPayments, number))
+
+            if limits.maxTotalAmountOfAllPayments is not None and total > limits.maxTotalAmountOfAllPayments:
+                errors.append('preapproval {} allows {} more, plan needs {}'.format(
+                    preapproval_key, limits.maxTotalAmountOfAllPayments, total))
+
+        return ExecutionPlan(payments, errors, count, receivers)
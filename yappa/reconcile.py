@@ -0,0 +1,263 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+import requests
+
+from .exceptions import AdaptiveApiException
+
+
+MISSING_REMOTE = 'missing_remote'   # In the ledger, unknown to PayPal
+MISSING_LOCAL = 'missing_local'     # Paid through PayPal, not in the ledger
+AMOUNT_DIFFERS = 'amount_differs'
+STATUS_DIFFERS = 'status_differs'
+
+REPORT_FIELDS = ['kind', 'key', 'email', 'localAmount', 'remoteAmount', 'localStatus', 'remoteStatus']
+
+ReconciliationSummary = namedtuple('ReconciliationSummary', ['matched', 'missingRemote', 'missingLocal',
+                                                             'amountDiffers', 'statusDiffers', 'refreshed',
+                                                             'resolved'])
+
+
+def _amount(value):
+    if value is None or value == '':
+        return None
+
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
+
+
+def _status(value):
+    return value.upper() if value else None
+
+
+def _as_dict(record):
+    return record._asdict() if hasattr(record, '_asdict') else record
+
+
+def flatten_payment(record, match_on='payKey'):
+    """
+    Turn a Pay / PaymentDetails response, or the equivalent dict, into one entry per receiver
+
+    @param record: response namedtuple or dict with paymentInfoList
+    @param match_on: field identifying the payment, 'payKey' or 'trackingId'
+    @return: list of [key, email, amount, status] entries
+    """
+    record = _as_dict(record)
+    key = record.get(match_on)
+    status = _status(record.get('paymentExecStatus') or record.get('status'))
+    info_list = record.get('paymentInfoList') or []
+
+    if isinstance(info_list, dict):
+        info_list = info_list.get('paymentInfo', [])
+
+    return [[key, info['receiver']['email'].lower(), str(_amount(info['receiver'].get('amount'))), status]
+            for info in info_list if key]
+
+
+def ledger_entry(row, match_on='payKey'):
+    """
+    @param row: dict with payKey or trackingId, email, amount and status
+    @return: [key, email, amount, status] entry
+    """
+    amount = _amount(row.get('amount'))
+    return [row.get(match_on), (row.get('email') or '').lower(), str(amount), _status(row.get('status'))]
+
+
+def classify(local, remote):
+    """
+    @param local: ledger entry or None
+    @param remote: PayPal entry or None
+    @return: mismatch kind, None if both sides agree
+    """
+    if remote is None:
+        return MISSING_REMOTE
+
+    if local is None:
+        return MISSING_LOCAL
+
+    if _amount(local[2]) != _amount(remote[2]):
+        return AMOUNT_DIFFERS
+
+    if local[3] and remote[3] and local[3] != remote[3]:
+        return STATUS_DIFFERS
+
+    return None
+
+
+class Reconciler(object):
+    """
+    Match ledger rows against PayPal payment state in bounded memory
+
+    Both inputs are streamed once into `partitions` temporary bucket files by hash of the match
+    key, then each bucket is joined with a hash index of its PayPal side, so memory holds one
+    bucket at a time. Mismatches are spilled to disk as well; with a `details` client
+    (yappa.api.PaymentDetails) the disputed payments are looked up again concurrently, in chunks,
+    and only mismatches that survive the refresh are written to the CSV report.
+    """
+    DEFAULT_PARTITIONS = 64
+
+    def __init__(self, details=None, match_on='payKey', partitions=DEFAULT_PARTITIONS, refresh_workers=10,
+                 refresh_batch=1000, tmp_dir=None):
+        if match_on not in ('payKey', 'trackingId'):
+            raise AdaptiveApiException('match_on needs to be payKey or trackingId')
+
+        self.details = details
+        self.match_on = match_on
+        self.partitions = partitions
+        self.refresh_workers = refresh_workers
+        self.refresh_batch = refresh_batch
+        self.tmp_dir = tmp_dir
+
+    def _partition(self, key):
+        return zlib.crc32(key.encode('utf-8')) % self.partitions
+
+    def _spill(self, directory, prefix, entries):
+        files = [open(os.path.join(directory, '{}-{}.jsonl'.format(prefix, index)), 'w', encoding='utf-8')
+                 for index in range(self.partitions)]
+
+        try:
+            for entry in entries:
+                # Rows without a key can never match and end up reported as missing
+                files[self._partition(entry[0] or '')].write(json.dumps(entry) + '\n')
+        finally:
+            for bucket_file in files:
+                bucket_file.close()
+
+    @staticmethod
+    def _read(path):
+        with open(path, encoding='utf-8') as bucket_file:
+            for line in bucket_file:
+                yield json.loads(line)
+
+    def _join(self, directory, disputes_file):
+        matched = 0
+
+        for index in range(self.partitions):
+            remote = {}
+
+            for entry in self._read(os.path.join(directory, 'remote-{}.jsonl'.format(index))):
+                remote[(entry[0], entry[1])] = entry
+
+            for local in self._read(os.path.join(directory, 'local-{}.jsonl'.format(index))):
+                other = remote.pop((local[0], local[1]), None)
+                kind = classify(local, other)
+
+                if kind is None:
+                    matched += 1
+                else:
+                    disputes_file.write(json.dumps([kind, local, other]) + '\n')
+
+            for other in remote.values():
+                disputes_file.write(json.dumps([MISSING_LOCAL, None, other]) + '\n')
+
+        return matched
+
+    def _lookup(self, key):
+        try:
+            resp = self.details.request(**{self.match_on: key})
+        except (AdaptiveApiException, requests.RequestException):
+            return key, None
+
+        if resp.ack not in ('Success', 'SuccessWithWarning'):
+            return key, None
+
+        return key, {entry[1]: entry for entry in flatten_payment(resp, self.match_on)}
+
+    def _refresh(self, chunk, executor):
+        keys = {(local or remote)[0] for kind, local, remote in chunk if (local or remote)[0]}
+        fresh = dict(executor.map(self._lookup, keys))
+
+        for kind, local, remote in chunk:
+            entry = local or remote
+            payment = fresh.get(entry[0])
+
+            # Keep the original verdict when the lookup failed
+            if payment is None:
+                yield kind, local, remote
+                continue
+
+            fresh_remote = payment.get(entry[1])
+
+            if local is None:
+                # A receiver that vanished from the payment no longer needs a ledger row
+                if fresh_remote is not None:
+                    yield MISSING_LOCAL, None, fresh_remote
+                continue
+
+            new_kind = classify(local, fresh_remote)
+
+            if new_kind is not None:
+                yield new_kind, local, fresh_remote
+
+    def run(self, local_rows, remote_records, report_path):
+        """
+        @param local_rows: iterable of ledger dicts (payKey/trackingId, email, amount, status)
+        @param remote_records: iterable of Pay / PaymentDetails responses or equivalent dicts
+        @param report_path: CSV file receiving the remaining mismatches
+        @return: ReconciliationSummary
+        """
+        directory = tempfile.mkdtemp(prefix='yappa-reconcile-', dir=self.tmp_dir)
+        counts = {MISSING_REMOTE: 0, MISSING_LOCAL: 0, AMOUNT_DIFFERS: 0, STATUS_DIFFERS: 0}
+        refreshed = disputed = 0
+
+        try:
+            self._spill(directory, 'local', (ledger_entry(row, self.match_on) for row in local_rows))
+            self._spill(directory, 'remote', (entry for record in remote_records
+                                              for entry in flatten_payment(record, self.match_on)))
+
+            disputes_path = os.path.join(directory, 'disputes.jsonl')
+
+            with open(disputes_path, 'w', encoding='utf-8') as disputes_file:
+                matched = self._join(directory, disputes_file)
+
+            with open(report_path, 'w', newline='', encoding='utf-8') as report_file, \
+                    ThreadPoolExecutor(max_workers=self.refresh_workers) as executor:
+                writer = csv.writer(report_file)
+                writer.writerow(REPORT_FIELDS)
+                chunk = []
+
+                for dispute in self._read(disputes_path):
+                    chunk.append(dispute)
+
+                    if len(chunk) == self.refresh_batch:
+                        refreshed += len(chunk)
+                        disputed += self._report(chunk, executor, writer, counts)
+                        chunk = []
+
+                if chunk:
+                    refreshed += len(chunk)
+                    disputed += self._report(chunk, executor, writer, counts)
+
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        if self.details is None:
+            refreshed = disputed = 0
+
+        return ReconciliationSummary(matched=matched, missingRemote=counts[MISSING_REMOTE],
+                                     missingLocal=counts[MISSING_LOCAL], amountDiffers=counts[AMOUNT_DIFFERS],
+                                     statusDiffers=counts[STATUS_DIFFERS], refreshed=refreshed,
+                                     resolved=refreshed - disputed)
+
+    def _report(self, chunk, executor, writer, counts):
+        disputes = self._refresh(chunk, executor) if self.details is not None else chunk
+        written = 0
+
+        for kind, local, remote in disputes:
+            entry = local or remote
+            counts[kind] += 1
+            written += 1
+            writer.writerow([kind, entry[0], entry[1],
+                             local[2] if local else '', remote[2] if remote else '',
+                             (local[3] or '') if local else '', (remote[3] or '') if remote else ''])
+
+        return written
@@ -0,0 +1,271 @@
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import requests
+
+from .api import Pay
+from .exceptions import AdaptiveApiException
+from .transport import PooledSession
+
+
+PayoutResult = namedtuple('PayoutResult', ['itemId', 'ack', 'payKey', 'paymentExecStatus', 'message', 'elapsed'])
+PayoutMetrics = namedtuple('PayoutMetrics', ['items', 'succeeded', 'failed', 'cancelled', 'unknown', 'duration',
+                                             'throughput', 'perWorker'])
+
+SUCCESS_ACKS = ('Success', 'SuccessWithWarning')
+
+# Messages on the result queue are plain tuples, tagged by their first element
+_RESULT = 0
+_DONE = 1
+
+
+def shard_by_sender(pay_kwargs):
+    return pay_kwargs.get('senderEmail') or ''
+
+
+def shard_by_receiver(pay_kwargs):
+    receivers = pay_kwargs['receiverList'].receivers
+    return receivers[0].email if receivers else ''
+
+
+def _worker_thread(pay, worker_index, in_queue, result_queue, stop_event):
+    while True:
+        item = in_queue.get()
+
+        if item is None:
+            result_queue.put((_DONE, worker_index))
+            return
+
+        item_id, pay_kwargs = item
+
+        # After stop() the remaining queued items are reported back instead of being paid
+        if stop_event.is_set():
+            result_queue.put((_RESULT, worker_index, item_id, 'Cancelled', None, None, 'runner stopped', 0.0))
+            continue
+
+        clock = time.perf_counter()
+
+        try:
+            resp = pay.request(**pay_kwargs)
+        except (AdaptiveApiException, requests.RequestException, ValueError) as e:
+            result_queue.put((_RESULT, worker_index, item_id, 'Error', None, None, str(e),
+                              time.perf_counter() - clock))
+            continue
+
+        if resp.ack in SUCCESS_ACKS:
+            message = None
+            pay_key, exec_status = resp.payKey, resp.paymentExecStatus
+        else:
+            message = resp.message
+            pay_key, exec_status = None, None
+
+        result_queue.put((_RESULT, worker_index, item_id, resp.ack, pay_key, exec_status, message,
+                          time.perf_counter() - clock))
+
+
+def _worker_main(worker_index, credentials, client_kwargs, threads, in_queue, result_queue, stop_event):
+    session = PooledSession(pool_size=threads)
+    pay = Pay(credentials, session=session, **client_kwargs)
+    workers = [threading.Thread(target=_worker_thread, args=(pay, worker_index, in_queue, result_queue, stop_event))
+               for _ in range(threads)]
+
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+
+class ShardedPayoutRunner(object):
+    """
+    Run Pay requests across worker processes, each with its own pooled client
+
+    Items are (item_id, Pay.request() keyword arguments) pairs. Every item is routed to the
+    worker owning its shard key, so all payouts of one sender (or receiver) go through the same
+    process. Each item is sent at most once: after stop() queued items come back as 'Cancelled'
+    and the rest of the input is left unread, items of a worker that died mid-run come back as
+    'Unknown' instead of being retried.
+    """
+    DEFAULT_QUEUE_SIZE = 1000
+
+    def __init__(self, credentials, debug=False, processes=None, threads=4, shard_key=shard_by_sender,
+                 endpoint=None, queue_size=DEFAULT_QUEUE_SIZE, mp_context=None):
+        self.credentials = credentials
+        self.client_kwargs = {'debug': debug, 'endpoint': endpoint}
+        self.processes = processes or multiprocessing.cpu_count()
+        self.threads = threads
+        self.shard_key = shard_key
+        self.queue_size = queue_size
+        self.context = multiprocessing.get_context(mp_context)
+        self.metrics = None
+        self._stop_event = self.context.Event()
+
+    def shard_for(self, pay_kwargs):
+        return zlib.crc32(self.shard_key(pay_kwargs).encode('utf-8')) % self.processes
+
+    def stop(self):
+        """
+        Stop paying: items already sent finish, everything still queued is returned as cancelled
+        """
+        self._stop_event.set()
+
+    @staticmethod
+    def _put(in_queue, item, process):
+        # A dead worker never empties its queue, so never block on it for good
+        while process.is_alive():
+            try:
+                in_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _feed(self, items, in_queues, processes, dispatched, dead, lost, lock, feed_errors):
+        try:
+            for item_id, pay_kwargs in items:
+                if self._stop_event.is_set():
+                    break
+
+                shard = self.shard_for(pay_kwargs)
+
+                with lock:
+                    if shard in dead:
+                        lost.append(item_id)
+                        continue
+
+                    dispatched[shard][item_id] = True
+
+                if not self._put(in_queues[shard], (item_id, pay_kwargs), processes[shard]):
+                    with lock:
+                        # Unless the run loop already reported it with the rest of the dead worker's items
+                        if dispatched[shard].pop(item_id, None):
+                            lost.append(item_id)
+        except Exception as e:
+            feed_errors.append(e)
+        finally:
+            for in_queue, process in zip(in_queues, processes):
+                for _ in range(self.threads):
+                    if not self._put(in_queue, None, process):
+                        break
+
+    def run(self, items):
+        """
+        @param items: iterable of (item_id, Pay.request() keyword arguments)
+        @return: generator of PayoutResult in completion order; metrics are set on self.metrics at the end
+        """
+        self._stop_event.clear()
+        in_queues = [self.context.Queue(self.queue_size) for _ in range(self.processes)]
+        result_queue = self.context.Queue()
+        dispatched = [{} for _ in range(self.processes)]
+        dead = set()
+        lost = []
+        lock = threading.Lock()
+        feed_errors = []
+        processes = [self.context.Process(target=_worker_main,
+                                          args=(index, self.credentials, self.client_kwargs, self.threads,
+                                                in_queues[index], result_queue, self._stop_event),
+                                          daemon=True)
+                     for index in range(self.processes)]
+
+        for process in processes:
+            process.start()
+
+        feeder = threading.Thread(target=self._feed,
+                                  args=(items, in_queues, processes, dispatched, dead, lost, lock, feed_errors),
+                                  daemon=True)
+        feeder.start()
+
+        counts = {'items': 0, 'succeeded': 0, 'failed': 0, 'cancelled': 0, 'unknown': 0}
+        per_worker = [0] * self.processes
+        running = {index: self.threads for index in range(self.processes)}
+        clock = time.perf_counter()
+        checked = clock
+
+        def unknown(item_ids, message):
+            for item_id in item_ids:
+                counts['items'] += 1
+                counts['unknown'] += 1
+                yield PayoutResult(itemId=item_id, ack='Unknown', payKey=None, paymentExecStatus=None,
+                                   message=message, elapsed=None)
+
+        try:
+            while running or feeder.is_alive() or lost:
+                if time.perf_counter() - checked >= 0.5 or not running:
+                    checked = time.perf_counter()
+
+                    for index in list(running):
+                        if not processes[index].is_alive():
+                            # Whatever was handed to a dead worker may or may not have been paid
+                            del running[index]
+
+                            with lock:
+                                dead.add(index)
+                                handed = list(dispatched[index])
+                                dispatched[index].clear()
+
+                            yield from unknown(handed, 'worker exited with code {}'.format(processes[index].exitcode))
+
+                    with lock:
+                        skipped = list(lost)
+                        del lost[:]
+
+                    yield from unknown(skipped, 'not sent, the worker of its shard exited')
+
+                try:
+                    message = result_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+
+                if message[0] == _DONE:
+                    if message[1] not in running:
+                        continue
+
+                    running[message[1]] -= 1
+
+                    if not running[message[1]]:
+                        del running[message[1]]
+                    continue
+
+                _, worker_index, item_id, ack, pay_key, exec_status, text, elapsed = message
+
+                with lock:
+                    dispatched[worker_index].pop(item_id, None)
+
+                counts['items'] += 1
+                per_worker[worker_index] += 1
+
+                if ack in SUCCESS_ACKS:
+                    counts['succeeded'] += 1
+                elif ack == 'Cancelled':
+                    counts['cancelled'] += 1
+                else:
+                    counts['failed'] += 1
+
+                yield PayoutResult(itemId=item_id, ack=ack, payKey=pay_key, paymentExecStatus=exec_status,
+                                   message=text, elapsed=elapsed)
+
+        finally:
+            self.stop()
+
+            for process in processes:
+                process.join(timeout=5)
+
+                if process.is_alive():
+                    process.terminate()
+
+            for in_queue in in_queues:
+                # Items left in a dead worker's queue must not keep this process from exiting
+                in_queue.cancel_join_thread()
+
+            duration = time.perf_counter() - clock
+            self.metrics = PayoutMetrics(duration=duration,
+                                         throughput=counts['items'] / duration if duration else 0.0,
+                                         perWorker=per_worker, **counts)
+
+        if feed_errors:
+            raise feed_errors[0]
@@ -0,0 +1,231 @@
+import asyncio
+import contextlib
+import threading
+import time
+from collections import deque, namedtuple
+
+from .exceptions import AdaptiveApiException
+from .utils import percentile
+
+
+Lane = namedtuple('Lane', ['name', 'weight', 'reserved'], defaults=(1, 0))
+Lane.__doc__ = """
+Priority class: `weight` is its share of slots while lanes compete, `reserved` the number of
+concurrent slots no other lane may take.
+"""
+
+LaneStats = namedtuple('LaneStats', ['name', 'queued', 'running', 'dispatched', 'waitP50', 'waitP95', 'waitMax'])
+
+DEFAULT_LANES = (Lane('interactive', weight=4, reserved=2), Lane('bulk', weight=1))
+
+
+class _Waiter(object):
+
+    def __init__(self, lane, tag, loop=None):
+        self.lane = lane
+        self.tag = tag
+        self.enqueued = time.perf_counter()
+        self.granted = False
+        self.cancelled = False
+
+        if loop is None:
+            self.event = threading.Event()
+            self.future = None
+        else:
+            self.loop = loop
+            self.future = loop.create_future()
+
+    def grant(self):
+        self.granted = True
+
+        if self.future is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class _LaneState(object):
+
+    def __init__(self, lane, window):
+        self.lane = lane
+        self.waiters = deque()
+        self.running = 0
+        self.dispatched = 0
+        self.last_tag = 0.0
+        self.waits = deque(maxlen=window)
+
+
+class RequestScheduler(object):
+    """
+    Share concurrency and a request rate between priority lanes
+
+    Operations given a scheduler and a lane take a slot for every PayPal call. At most
+    `concurrency` calls run at once and, with `rate`, at most `rate` calls start per second with
+    bursts up to `burst`. Waiting calls are served by weighted fair queuing: every lane gets slots
+    in proportion to its weight while others are busy, and idle lanes do not bank credit. Slots
+    reserved for a lane stay free for it even when other lanes have long queues.
+    """
+
+    def __init__(self, lanes=DEFAULT_LANES, concurrency=10, rate=None, burst=None, window=1000):
+        lanes = tuple(lanes)
+
+        if sum(lane.reserved for lane in lanes) >= concurrency:
+            raise AdaptiveApiException('reserved slots need to leave room for unreserved traffic')
+
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst if burst is not None else (rate or 0)
+        self.default_lane = lanes[0].name
+
+        self._lanes = {lane.name: _LaneState(lane, window) for lane in lanes}
+        self._lock = threading.Lock()
+        self._running = 0
+        self._virtual_time = 0.0
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._timer = None
+
+    def _state(self, lane):
+        state = self._lanes.get(lane or self.default_lane)
+
+        if state is None:
+            raise AdaptiveApiException('unknown lane {}'.format(lane))
+
+        return state
+
+    def _refill(self, now):
+        if self.rate is None:
+            return
+
+        self._tokens = min(float(self.burst), self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _may_run(self, state):
+        free = self.concurrency - self._running
+        held_for_others = sum(max(0, other.lane.reserved - other.running)
+                              for other in self._lanes.values() if other is not state)
+        return free > held_for_others
+
+    def _dispatch(self):
+        # Called with the lock held: grant slots in finish tag order while capacity and rate allow
+        now = time.monotonic()
+        self._refill(now)
+
+        while True:
+            candidates = [state for state in self._lanes.values() if state.waiters and self._may_run(state)]
+
+            if not candidates:
+                return
+
+            if self.rate is not None and self._tokens < 1:
+                self._schedule_refill((1 - self._tokens) / self.rate)
+                return
+
+            state = min(candidates, key=lambda state: state.waiters[0].tag)
+            waiter = state.waiters.popleft()
+            self._virtual_time = max(self._virtual_time, waiter.tag)
+
+            if self.rate is not None:
+                self._tokens -= 1
+
+            self._running += 1
+            state.running += 1
+            state.dispatched += 1
+            state.waits.append(time.perf_counter() - waiter.enqueued)
+            waiter.grant()
+
+    def _schedule_refill(self, delay):
+        if self._timer is not None:
+            return
+
+        def fire():
+            with self._lock:
+                self._timer = None
+                self._dispatch()
+
+        self._timer = threading.Timer(delay, fire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _enqueue(self, lane, loop=None):
+        with self._lock:
+            state = self._state(lane)
+            # A lane that was idle starts from the current virtual time instead of its old tag
+            tag = max(self._virtual_time, state.last_tag) + 1.0 / state.lane.weight
+            state.last_tag = tag
+            waiter = _Waiter(state, tag, loop)
+            state.waiters.append(waiter)
+            self._dispatch()
+            return waiter
+
+    def _withdraw(self, waiter):
+        with self._lock:
+            if waiter.granted:
+                return False
+
+            waiter.lane.waiters.remove(waiter)
+            return True
+
+    def release(self, lane):
+        with self._lock:
+            state = self._state(lane)
+            self._running -= 1
+            state.running -= 1
+            self._dispatch()
+
+    def acquire(self, lane=None, timeout=None):
+        """
+        Wait for a slot in lane; release() it when the call is done
+
+        @raise AdaptiveApiException: when no slot was granted within timeout seconds
+        """
+        waiter = self._enqueue(lane)
+
+        if not waiter.event.wait(timeout) and self._withdraw(waiter):
+            raise AdaptiveApiException('no slot in lane {} within {}s'.format(waiter.lane.lane.name, timeout))
+
+    async def aacquire(self, lane=None):
+        waiter = self._enqueue(lane, asyncio.get_running_loop())
+
+        try:
+            await asyncio.shield(waiter.future)
+        except asyncio.CancelledError:
+            if not self._withdraw(waiter):
+                # Granted while being cancelled, hand the slot back
+                self.release(lane)
+            raise
+
+    @contextlib.contextmanager
+    def slot(self, lane=None, timeout=None):
+        self.acquire(lane, timeout)
+
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, lane=None):
+        await self.aacquire(lane)
+
+        try:
+            yield
+        finally:
+            self.release(lane)
+
+    def stats(self):
+        """
+        @return: dict of lane name to LaneStats, wait times in seconds over recent dispatches
+        """
+        with self._lock:
+            snapshot = [(state.lane.name, len(state.waiters), state.running, state.dispatched, list(state.waits))
+                        for state in self._lanes.values()]
+
+        return {name: LaneStats(name=name, queued=queued, running=running, dispatched=dispatched,
+                                waitP50=percentile(waits, 50), waitP95=percentile(waits, 95),
+                                waitMax=max(waits) if waits else None)
+                for name, queued, running, dispatched, waits in snapshot}
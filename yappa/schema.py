@@ -0,0 +1,165 @@
+from datetime import datetime
+from decimal import Decimal
+
+from .exceptions import ValidationException
+
+
+CURRENCY_CODES = frozenset([
+    'AUD', 'BRL', 'CAD', 'CHF', 'CZK', 'DKK', 'EUR', 'GBP', 'HKD', 'HUF', 'ILS', 'JPY',
+    'MXN', 'MYR', 'NOK', 'NZD', 'PHP', 'PLN', 'SEK', 'SGD', 'THB', 'TWD', 'USD',
+])
+# Currencies PayPal only accepts in whole units
+ZERO_DECIMAL_CURRENCIES = frozenset(['HUF', 'JPY', 'TWD'])
+FEES_PAYERS = frozenset(['SENDER', 'PRIMARYRECEIVER', 'EACHRECEIVER', 'SECONDARYONLY'])
+ACTION_TYPES = frozenset(['PAY', 'CREATE', 'PAY_PRIMARY'])
+
+
+def _to_iso_date(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class Field(object):
+    """
+    Declaration of a single payload field
+
+    @param types: accepted Python type or tuple of types
+    @param required: whether the field has to be set
+    @param choices: allowed values
+    @param min_value: smallest allowed value
+    @param max_value: largest allowed value
+    @param default: value used when the field is not set
+    @param validate: callable returning a list of error messages for a set value
+    @param to_wire: callable converting a valid value to its JSON form, returning None drops the field
+    """
+
+    def __init__(self, types=str, required=False, choices=None, min_value=None, max_value=None, default=None,
+                 validate=None, to_wire=None):
+        self.types = types if isinstance(types, tuple) else (types,)
+        self.required = required
+        self.choices = frozenset(choices) if choices is not None else None
+        self.min_value = min_value
+        self.max_value = max_value
+        self.default = default
+        self.validate = validate
+        self.to_wire = to_wire
+
+
+class Schema(object):
+    """
+    Payload schema of an operation, compiled once when the operation class is defined
+
+    build() checks every field in one pass, collects all errors and only puts set fields on the
+    wire. `checks` are callables taking the dict of set values and returning an error message
+    or None, for rules involving several fields.
+    """
+
+    def __init__(self, fields, checks=()):
+        self.fields = fields
+        self.checks = tuple(checks)
+        self._compiled = tuple(self._compile(name, field) for name, field in fields.items())
+
+    @staticmethod
+    def _compile(name, field):
+        type_names = ' or '.join(t.__name__ for t in field.types)
+        # bool is a subclass of int, never accept it for numeric fields
+        reject_bool = bool not in field.types
+
+        return (name, field.types, type_names, reject_bool, field.required, field.choices,
+                ', '.join(sorted(field.choices)) if field.choices else None,
+                field.min_value, field.max_value, field.default, field.validate, field.to_wire)
+
+    def validate(self, kwargs):
+        """
+        @param kwargs: keyword arguments of the request
+        @return: list of error messages, empty if kwargs are valid
+        """
+        return self._build(kwargs)[1]
+
+    def build(self, kwargs):
+        """
+        @param kwargs: keyword arguments of the request
+        @return: wire payload containing only set fields
+        @raise ValidationException: with every error found
+        """
+        payload, errors = self._build(kwargs)
+
+        if errors:
+            raise ValidationException(errors)
+
+        return payload
+
+    def _build(self, kwargs):
+        payload = {}
+        values = {}
+        errors = []
+
+        for (name, types, type_names, reject_bool, required, choices, choice_names,
+             min_value, max_value, default, validate, to_wire) in self._compiled:
+            value = kwargs.get(name)
+
+            if value is None:
+                value = default
+
+            if value is None:
+                if required:
+                    errors.append('{} is required'.format(name))
+                continue
+
+            if not isinstance(value, types) or (reject_bool and isinstance(value, bool)):
+                errors.append('{} needs to be instance of {}'.format(name, type_names))
+                continue
+
+            if choices is not None and value not in choices:
+                errors.append('{} needs to be one of {}'.format(name, choice_names))
+                continue
+
+            if min_value is not None and value < min_value:
+                errors.append('{} needs to be at least {}'.format(name, min_value))
+                continue
+
+            if max_value is not None and value > max_value:
+                errors.append('{} needs to be at most {}'.format(name, max_value))
+                continue
+
+            if validate is not None:
+                field_errors = validate(value)
+
+                if field_errors:
+                    errors.extend(field_errors)
+                    continue
+
+            values[name] = value
+
+            if to_wire is not None:
+                value = to_wire(value)
+
+                if value is None:
+                    continue
+
+            payload[name] = value
+
+        for check in self.checks:
+            error = check(values)
+
+            if error:
+                errors.append(error)
+
+        return payload, errors
+
+
+def date_field(required=False):
+    return Field(types=(str, datetime), required=required, to_wire=_to_iso_date)
+
+
+def amount_field(required=False):
+    return Field(types=Decimal, required=required, min_value=Decimal('0.01'))
+
+
+def not_greater_than(name, limit_name):
+    def check(values):
+        value, limit = values.get(name), values.get(limit_name)
+
+        if value is not None and limit is not None and value > limit:
+            return '{} can not exceed {}'.format(name, limit_name)
+
+    return check
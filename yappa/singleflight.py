@@ -0,0 +1,283 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:     # Not available on Windows
+    fcntl = None
+
+from .exceptions import AdaptiveApiException
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.waiters = []   # (loop, future) pairs of asyncio followers
+        self.result = None
+        self.error = None
+
+    def get(self):
+        if self.error is not None:
+            raise self.error
+
+        return self.result
+
+
+def _resolve(future, call):
+    if future.done():
+        return
+
+    if call.error is not None:
+        future.set_exception(call.error)
+    else:
+        future.set_result(call.result)
+
+
+class SingleFlight(object):
+    """
+    Share one in-flight call between concurrent callers asking for the same key
+
+    Callers may be threads or asyncio tasks on any event loop. The first caller of a key runs
+    the function, everybody else arriving before it finishes gets the same result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def _join(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+
+            if call is None:
+                call = self._calls[key] = _Call()
+                return call, True
+
+            self.coalesced += 1
+            return call, False
+
+    def _finish(self, key, call, result=None, error=None):
+        with self._lock:
+            del self._calls[key]
+            call.result = result
+            call.error = error
+            waiters = list(call.waiters)
+
+        call.event.set()
+
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, call)
+
+    def do(self, key, fn):
+        """
+        Run fn once for all concurrent callers of key
+
+        @param key: hashable key of the call
+        @param fn: function without arguments doing the actual work
+        @return: return value of fn
+        """
+        call, leader = self._join(key)
+
+        if not leader:
+            call.event.wait()
+            return call.get()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+
+        self._finish(key, call, result=result)
+        return result
+
+    async def do_async(self, key, fn, executor=None):
+        """
+        Same as do(), for asyncio tasks. A leading task runs fn in the given executor.
+        """
+        loop = asyncio.get_running_loop()
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+                future = loop.create_future()
+                call.waiters.append((loop, future))
+
+        if not leader:
+            return await future
+
+        try:
+            result = await loop.run_in_executor(executor, fn)
+        except BaseException as e:
+            self._finish(key, call, error=e)
+            raise
+
+        self._finish(key, call, result=result)
+        return result
+
+
+class FileSingleFlight(SingleFlight):
+    """
+    Single flight shared between processes on the same host
+
+    Threads of one process are coalesced in memory, then one process per key holds a file lock
+    in the given directory while it calls PayPal. Processes waiting on that lock reuse the JSON
+    result the holder wrote, as long as it finished after they started waiting.
+
+    Results hold full PayPal responses, so files are created readable by the owner only. Results
+    and locks nobody holds are removed once they are `max_age` seconds old, checked at most once
+    every `max_age` seconds by the process finishing a flight, or on demand with sweep().
+    """
+
+    def __init__(self, directory, max_age=60):
+        """
+        @param directory: lock and result directory, created with mode 0700 if missing
+        @param max_age: seconds results are kept, None to keep them until sweep() is called
+        """
+        if fcntl is None:
+            raise AdaptiveApiException('cross-process single flight needs fcntl file locks')
+
+        super().__init__()
+        self.directory = directory
+        self.max_age = max_age
+        self._swept = time.time()
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def _paths(self, key):
+        name = str(key)
+        return os.path.join(self.directory, name + '.lock'), os.path.join(self.directory, name + '.json')
+
+    def _read_result(self, result_path, since):
+        try:
+            with open(result_path, encoding='utf-8') as result_file:
+                entry = json.load(result_file)
+        except (OSError, ValueError):
+            return None
+
+        if entry['finished'] < since:
+            return None
+
+        return entry
+
+    def _write_result(self, result_path, response):
+        tmp_path = '{}.{}.tmp'.format(result_path, os.getpid())
+
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w',
+                       encoding='utf-8') as result_file:
+            json.dump({'finished': time.time(), 'response': response}, result_file)
+
+        os.replace(tmp_path, result_path)
+
+    @staticmethod
+    def _lock_file(lock_path, blocking=True):
+        """
+        @return: (file descriptor holding the lock, whether another process held it first), (None, False)
+                 if not blocking and the lock is taken
+        """
+        waited = False
+
+        while True:
+            fd = os.open(lock_path, os.O_WRONLY | os.O_CREAT, 0o600)
+
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    if not blocking:
+                        os.close(fd)
+                        return None, False
+
+                    waited = True
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+
+                # sweep() may have removed the file while we waited, the lock then has to be taken on the new one
+                if os.fstat(fd).st_ino == os.stat(lock_path).st_ino:
+                    return fd, waited
+            except FileNotFoundError:
+                pass
+            except BaseException:
+                os.close(fd)
+                raise
+
+            os.close(fd)
+
+    def _locked(self, key, fn):
+        lock_path, result_path = self._paths(key)
+        arrived = time.time()
+        fd, waited = self._lock_file(lock_path)
+
+        try:
+            if waited:
+                entry = self._read_result(result_path, arrived)
+
+                if entry is not None:
+                    with self._lock:
+                        self.coalesced += 1
+
+                    return entry['response']
+
+            response = fn()
+            self._write_result(result_path, response)
+        finally:
+            os.close(fd)    # Releases the lock
+
+        if self.max_age is not None and time.time() - self._swept >= self.max_age:
+            self.sweep()
+
+        return response
+
+    def sweep(self, now=None):
+        """
+        Remove results, leftover temporary files and unheld locks older than max_age
+
+        @return: number of files removed
+        """
+        now = time.time() if now is None else now
+        self._swept = now
+        cutoff = now - (self.max_age or 0)
+        removed = 0
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+
+            try:
+                if os.stat(path).st_mtime > cutoff:
+                    continue
+
+                if name.endswith('.lock'):
+                    fd, _ = self._lock_file(path, blocking=False)
+
+                    if fd is None:
+                        continue
+
+                    try:
+                        os.unlink(path)
+                    finally:
+                        os.close(fd)
+
+                elif name.endswith(('.json', '.tmp')):
+                    os.unlink(path)
+                else:
+                    continue
+            except FileNotFoundError:
+                continue
+
+            removed += 1
+
+        return removed
+
+    def do(self, key, fn):
+        return super().do(key, lambda: self._locked(key, fn))
+
+    async def do_async(self, key, fn, executor=None):
+        return await super().do_async(key, lambda: self._locked(key, fn), executor=executor)
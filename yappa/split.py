@@ -0,0 +1,200 @@
+from array import array
+from collections import namedtuple
+from decimal import Decimal
+
+from .exceptions import InvalidReceiverException
+from .models import Receiver, ReceiverList
+from .schema import CURRENCY_CODES, FEES_PAYERS, ZERO_DECIMAL_CURRENCIES
+
+
+CommissionRule = namedtuple('CommissionRule', ['primaryEmail', 'secondaryEmail', 'rate'])
+
+
+def currency_exponent(currency):
+    if currency not in CURRENCY_CODES:
+        raise InvalidReceiverException('unsupported currency {}'.format(currency))
+
+    return 0 if currency in ZERO_DECIMAL_CURRENCIES else 2
+
+
+def _ratio(value):
+    if not isinstance(value, Decimal):
+        raise InvalidReceiverException('rates and fees need to be instance of Decimal')
+
+    return value.as_integer_ratio()
+
+
+def _rate_ratio(rate):
+    if not isinstance(rate, Decimal) or not Decimal(0) <= rate <= Decimal(1):
+        raise InvalidReceiverException('commission rate needs to be a Decimal between 0 and 1')
+
+    return rate.as_integer_ratio()
+
+
+def _round_half_even(numerator, denominator):
+    quotient, remainder = divmod(numerator, denominator)
+    twice = remainder * 2
+
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+
+    return quotient
+
+
+def _scale_column(column, ratio):
+    """
+    Multiply a column of minor units by an exact fraction, rounding half to even
+    """
+    numerator, denominator = ratio
+
+    if denominator == 1:
+        return array('q', [value * numerator for value in column])
+
+    # Round half up with one floor division, then step back down on exact ties with an odd result
+    twice_denominator = 2 * denominator
+    rounded = array('q', [(2 * value * numerator + denominator) // twice_denominator for value in column])
+    ties = [index for index, value in enumerate(column) if (value * numerator) % denominator * 2 == denominator]
+
+    for index in ties:
+        if rounded[index] % 2:
+            rounded[index] -= 1
+
+    return rounded
+
+
+class SplitResult(object):
+    """
+    Columns of a batched split, all amounts in integer minor units of the currency
+
+    `totals` is what the buyer pays and the primary receiver gets in the Pay request, `secondary`
+    is what the primary passes on, `commissions` what the primary keeps. `primaryFees`,
+    `secondaryFees` and `senderFees` are the estimated PayPal fees borne by each party.
+    """
+
+    def __init__(self, currency, fees_payer, rules, totals, commissions, secondary, primary_fees, secondary_fees,
+                 sender_fees):
+        self.currency = currency
+        self.feesPayer = fees_payer
+        self.exponent = currency_exponent(currency)
+        self.rules = rules
+        self.totals = totals
+        self.commissions = commissions
+        self.secondary = secondary
+        self.primaryFees = primary_fees
+        self.secondaryFees = secondary_fees
+        self.senderFees = sender_fees
+
+    def __len__(self):
+        return len(self.totals)
+
+    def to_decimal(self, minor_units):
+        return Decimal(minor_units).scaleb(-self.exponent)
+
+    def _rule(self, index):
+        return self.rules if isinstance(self.rules, CommissionRule) else self.rules[index]
+
+    def receiver_list(self, index):
+        """
+        @param index: order position
+        @return: ReceiverList with the primary receiver flagged, ready for Pay.request()
+        """
+        rule = self._rule(index)
+        total, secondary = self.totals[index], self.secondary[index]
+
+        # Without anything to pass on there is no chain, the primary is simply paid
+        if secondary == 0:
+            return ReceiverList([Receiver(email=rule.primaryEmail, amount=self.to_decimal(total))])
+
+        return ReceiverList([
+            Receiver(email=rule.primaryEmail, amount=self.to_decimal(total), primary=True),
+            Receiver(email=rule.secondaryEmail, amount=self.to_decimal(secondary), primary=False),
+        ])
+
+    def receiver_lists(self):
+        for index in range(len(self.totals)):
+            yield self.receiver_list(index)
+
+
+class SplitCalculator(object):
+    """
+    Compute chained payment splits and fee allocation for many orders at once
+
+    Amounts are converted to integer minor units once and every step runs as one pass over a
+    column, so no Decimal objects are created per order and rounding is exact: commission and
+    fees are rounded half to even per currency, and each order's parts always add up to its
+    total. Fees are an estimate of `fee_rate` * total + `fee_fixed`, allocated by feesPayer mode.
+    """
+
+    def __init__(self, currency, fees_payer='EACHRECEIVER', fee_rate=Decimal('0.029'), fee_fixed=Decimal('0.30')):
+        if fees_payer not in FEES_PAYERS:
+            raise InvalidReceiverException('feesPayer needs to be one of {}'.format(', '.join(sorted(FEES_PAYERS))))
+
+        self.currency = currency
+        self.fees_payer = fees_payer
+        self.exponent = currency_exponent(currency)
+        self.fee_ratio = _ratio(fee_rate)
+        self.fee_fixed = self.to_minor_units([fee_fixed])[0]
+
+    def to_minor_units(self, amounts):
+        """
+        @param amounts: iterable of Decimal amounts
+        @return: array of integer minor units
+        @raise InvalidReceiverException: for amounts with more decimals than the currency allows
+        """
+        column = array('q')
+
+        for amount in amounts:
+            if not isinstance(amount, Decimal):
+                raise InvalidReceiverException('amount needs to be instance of Decimal')
+
+            if amount < 0:
+                raise InvalidReceiverException('amount can not be negative')
+
+            minor = amount.scaleb(self.exponent)
+
+            if minor != minor.to_integral_value():
+                raise InvalidReceiverException('{} has more decimals than {} allows'.format(amount, self.currency))
+
+            column.append(int(minor))
+
+        return column
+
+    def calculate(self, totals, rules, minor_units=False):
+        """
+        @param totals: order totals as Decimals, or integers if minor_units is True
+        @param rules: one CommissionRule for every order, or a sequence with one rule per order
+        @param minor_units: whether totals are already integer minor units
+        @return: SplitResult
+        """
+        totals = array('q', totals) if minor_units else self.to_minor_units(totals)
+
+        if isinstance(rules, CommissionRule):
+            commissions = _scale_column(totals, _rate_ratio(rules.rate))
+        else:
+            if len(rules) != len(totals):
+                raise InvalidReceiverException('one commission rule per order is needed')
+
+            commissions = array('q', [_round_half_even(total * numerator, denominator)
+                                      for total, (numerator, denominator)
+                                      in zip(totals, (_rate_ratio(rule.rate) for rule in rules))])
+
+        secondary = array('q', [total - commission for total, commission in zip(totals, commissions)])
+        fees = _scale_column(totals, self.fee_ratio)
+        fixed = self.fee_fixed
+        fees = array('q', [fee + fixed if total else 0 for fee, total in zip(fees, totals)])
+        zeros = array('q', bytes(8 * len(totals)))
+
+        if self.fees_payer == 'SENDER':
+            primary_fees, secondary_fees, sender_fees = zeros, zeros, fees
+        elif self.fees_payer == 'PRIMARYRECEIVER':
+            primary_fees, secondary_fees, sender_fees = fees, zeros, zeros
+        elif self.fees_payer == 'SECONDARYONLY':
+            primary_fees, secondary_fees, sender_fees = zeros, fees, zeros
+        else:   # EACHRECEIVER, in proportion to what each receiver keeps
+            secondary_fees = array('q', [_round_half_even(fee * part, total) if total else 0
+                                         for fee, part, total in zip(fees, secondary, totals)])
+            primary_fees = array('q', [fee - part for fee, part in zip(fees, secondary_fees)])
+            sender_fees = zeros
+
+        return SplitResult(self.currency, self.fees_payer, rules, totals, commissions, secondary, primary_fees,
+                           secondary_fees, sender_fees)
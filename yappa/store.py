@@ -0,0 +1,314 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABCMeta, abstractmethod
+from collections import namedtuple
+
+
+logger = logging.getLogger(__name__)
+
+PENDING_STATUSES = ('CREATED', 'PENDING', 'PROCESSING', 'INCOMPLETE')
+
+StoredOperation = namedtuple('StoredOperation', ['id', 'operation', 'createdAt', 'ack', 'payKey', 'preapprovalKey',
+                                                 'trackingId', 'senderEmail', 'status', 'payload', 'response'])
+PaymentState = namedtuple('PaymentState', ['payKey', 'status', 'trackingId', 'senderEmail', 'createdAt',
+                                           'updatedAt'])
+
+
+def _text(value):
+    return None if value is None else str(value)
+
+
+def extract_record(operation, payload, response, created_at):
+    """
+    Pick the indexed fields out of a request payload and its raw response
+
+    @return: dict with the operation columns and the receiver (email, amount) pairs
+    """
+    def pick(*names):
+        for source in (response, payload):
+            for name in names:
+                if source.get(name):
+                    return source[name]
+        return None
+
+    receivers = payload.get('receiverList', {}).get('receiver', [])
+
+    return {
+        'operation': operation,
+        'created_at': created_at,
+        'ack': response.get('responseEnvelope', {}).get('ack'),
+        'pay_key': pick('payKey'),
+        'preapproval_key': pick('preapprovalKey'),
+        'tracking_id': pick('trackingId'),
+        'sender_email': payload.get('senderEmail') or response.get('senderEmail'),
+        'status': response.get('paymentExecStatus') or response.get('status'),
+        'payload': json.dumps(payload, separators=(',', ':'), default=str),
+        'response': json.dumps(response, separators=(',', ':'), default=str),
+        'receivers': [(receiver.get('email'), _text(receiver.get('amount'))) for receiver in receivers],
+    }
+
+
+class StateBackend(metaclass=ABCMeta):
+
+    @abstractmethod
+    def write_batch(self, records):
+        pass
+
+    @abstractmethod
+    def find_operations(self, limit=None, **filters):
+        pass
+
+    @abstractmethod
+    def find_payments(self, statuses, created_before, limit=None):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+
+class SQLiteBackend(StateBackend):
+    """
+    SQLite storage in WAL mode: one operations log, its receivers, and the latest state per payKey
+    """
+    FILTER_COLUMNS = {
+        'payKey': 'o.pay_key',
+        'preapprovalKey': 'o.preapproval_key',
+        'trackingId': 'o.tracking_id',
+        'senderEmail': 'o.sender_email',
+        'status': 'o.status',
+        'operation': 'o.operation',
+        'receiverEmail': 'r.email',
+    }
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS operations (
+            id INTEGER PRIMARY KEY,
+            operation TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            ack TEXT,
+            pay_key TEXT,
+            preapproval_key TEXT,
+            tracking_id TEXT,
+            sender_email TEXT,
+            status TEXT,
+            payload TEXT,
+            response TEXT
+        );
+        CREATE TABLE IF NOT EXISTS receivers (
+            operation_id INTEGER NOT NULL REFERENCES operations (id),
+            email TEXT NOT NULL,
+            amount TEXT
+        );
+        CREATE TABLE IF NOT EXISTS payments (
+            pay_key TEXT PRIMARY KEY,
+            status TEXT,
+            tracking_id TEXT,
+            sender_email TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS operations_pay_key ON operations (pay_key);
+        CREATE INDEX IF NOT EXISTS operations_preapproval_key ON operations (preapproval_key);
+        CREATE INDEX IF NOT EXISTS operations_tracking_id ON operations (tracking_id);
+        CREATE INDEX IF NOT EXISTS operations_sender_email ON operations (sender_email);
+        CREATE INDEX IF NOT EXISTS operations_status ON operations (status, created_at);
+        CREATE INDEX IF NOT EXISTS receivers_email ON receivers (email);
+        CREATE INDEX IF NOT EXISTS receivers_operation ON receivers (operation_id);
+        CREATE INDEX IF NOT EXISTS payments_status ON payments (status, created_at);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.executescript(self.SCHEMA)
+
+    def write_batch(self, records):
+        with self._lock:
+            cursor = self._connection.cursor()
+            # IMMEDIATE takes the write lock up front, so ids can be assigned before inserting
+            cursor.execute('BEGIN IMMEDIATE')
+
+            try:
+                first_id = cursor.execute('SELECT coalesce(max(id), 0) + 1 FROM operations').fetchone()[0]
+                operations, receivers, payments = [], [], []
+
+                for operation_id, record in enumerate(records, first_id):
+                    operations.append((operation_id, record['operation'], record['created_at'], record['ack'],
+                                       record['pay_key'], record['preapproval_key'], record['tracking_id'],
+                                       record['sender_email'], record['status'], record['payload'],
+                                       record['response']))
+                    receivers.extend((operation_id, email, amount) for email, amount in record['receivers'])
+
+                    if record['pay_key'] and record['status']:
+                        payments.append((record['pay_key'], record['status'], record['tracking_id'],
+                                         record['sender_email'], record['created_at'], record['created_at']))
+
+                cursor.executemany(
+                    'INSERT INTO operations (id, operation, created_at, ack, pay_key, preapproval_key, tracking_id, '
+                    'sender_email, status, payload, response) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', operations)
+                cursor.executemany('INSERT INTO receivers (operation_id, email, amount) VALUES (?, ?, ?)', receivers)
+                cursor.executemany(
+                    'INSERT INTO payments (pay_key, status, tracking_id, sender_email, created_at, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (pay_key) DO UPDATE SET '
+                    'status = excluded.status, updated_at = excluded.updated_at, '
+                    'tracking_id = coalesce(payments.tracking_id, excluded.tracking_id), '
+                    'sender_email = coalesce(payments.sender_email, excluded.sender_email)', payments)
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+
+    def find_operations(self, limit=None, **filters):
+        clauses, params = [], []
+
+        for name, value in filters.items():
+            if name not in self.FILTER_COLUMNS:
+                raise ValueError('unknown filter {}'.format(name))
+
+            clauses.append('{} = ?'.format(self.FILTER_COLUMNS[name]))
+            params.append(value)
+
+        join = ' JOIN receivers r ON r.operation_id = o.id' if 'receiverEmail' in filters else ''
+        query = ('SELECT DISTINCT o.id, o.operation, o.created_at, o.ack, o.pay_key, o.preapproval_key, '
+                 'o.tracking_id, o.sender_email, o.status, o.payload, o.response FROM operations o' + join)
+
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+
+        query += ' ORDER BY o.id'
+
+        if limit is not None:
+            query += ' LIMIT {:d}'.format(limit)
+
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+
+        return [StoredOperation(*row) for row in rows]
+
+    def find_payments(self, statuses, created_before, limit=None):
+        query = ('SELECT pay_key, status, tracking_id, sender_email, created_at, updated_at FROM payments '
+                 'WHERE status IN ({}) AND created_at < ? ORDER BY created_at'.format(', '.join('?' * len(statuses))))
+
+        if limit is not None:
+            query += ' LIMIT {:d}'.format(limit)
+
+        with self._lock:
+            rows = self._connection.execute(query, list(statuses) + [created_before]).fetchall()
+
+        return [PaymentState(*row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class StateStore(object):
+    """
+    Record every request and response of the operations it is given to, off the request thread
+
+    Pass it as `store` to any operation. record() only queues; a writer thread extracts the
+    indexed fields, groups records into batches of up to `batch_size` and writes each batch in one
+    transaction. When `max_queue` records are waiting, new ones are dropped and counted in
+    `dropped` instead of holding up the PayPal caller. Queries see what has been written, call
+    flush() first to include everything queued.
+    """
+
+    def __init__(self, path='yappa.db', backend=None, batch_size=500, max_queue=100000):
+        self.backend = backend if backend is not None else SQLiteBackend(path)
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name='yappa-store-writer', daemon=True)
+        self._writer.start()
+
+    def record(self, operation, payload, response):
+        try:
+            self._queue.put_nowait((operation, payload, response, time.time()))
+        except queue.Full:
+            self.dropped += 1
+
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning('state store queue is full, %d records dropped so far', self.dropped)
+
+    def _extract(self, batch):
+        records = []
+
+        for operation, payload, response, created_at in batch:
+            try:
+                records.append(extract_record(operation, payload, response, created_at))
+            except Exception:
+                logger.exception('failed to extract a %s record for the state store', operation)
+
+        return records
+
+    def _write_loop(self):
+        while True:
+            record = self._queue.get()
+
+            if record is None:
+                self._queue.task_done()
+                return
+
+            batch = [record]
+            stop = False
+
+            while len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+                if record is None:
+                    stop = True
+                    break
+
+                batch.append(record)
+
+            try:
+                self.backend.write_batch(self._extract(batch))
+            except Exception:
+                logger.exception('failed to write %d records to the state store', len(batch))
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+
+            if stop:
+                return
+
+    def flush(self):
+        """
+        Block until every queued record is written
+        """
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+        self.backend.close()
+
+    def find(self, limit=None, **filters):
+        """
+        @param filters: any of payKey, preapprovalKey, trackingId, senderEmail, receiverEmail, status, operation
+        @return: list of StoredOperation, oldest first
+        """
+        return self.backend.find_operations(limit=limit, **filters)
+
+    def pending_payments(self, older_than_minutes, statuses=PENDING_STATUSES, limit=None, now=None):
+        """
+        @return: list of PaymentState still pending and created more than the given minutes ago
+        """
+        now = time.time() if now is None else now
+        return self.backend.find_payments(statuses, now - older_than_minutes * 60, limit=limit)
@@ -0,0 +1,175 @@
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+_counter = itertools.count(1)
+
+
+def _envelope(ack='Success'):
+    return {
+        'ack': ack,
+        'build': '00000000',
+        'correlationId': 'stub',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S.000+00:00', time.gmtime()),
+    }
+
+
+def _key(prefix):
+    return '{}-{}{:010d}'.format(prefix, os.getpid(), next(_counter))
+
+
+def _pay(payload):
+    receivers = payload.get('receiverList', {}).get('receiver', [])
+    exec_status = 'CREATED' if payload.get('actionType') == 'CREATE' else 'COMPLETED'
+
+    return {
+        'payKey': _key('AP'),
+        'paymentExecStatus': exec_status,
+        'paymentInfoList': {
+            'paymentInfo': [{
+                'receiver': dict(receiver, primary=receiver.get('primary', 'false')),
+                'pendingRefund': 'false',
+                'transactionId': _key('TX'),
+                'transactionStatus': exec_status,
+            } for receiver in receivers]
+        },
+        'sender': {'accountId': 'STUBSENDER'},
+        'responseEnvelope': _envelope(),
+    }
+
+
+def _preapproval(payload):
+    return {
+        'preapprovalKey': _key('PA'),
+        'responseEnvelope': _envelope(),
+    }
+
+
+def _preapproval_details(payload):
+    return {
+        'approved': 'true',
+        'status': 'ACTIVE',
+        'currencyCode': 'USD',
+        'curPayments': '0',
+        'curPaymentsAmount': '0.00',
+        'senderEmail': 'stub-sender@example.com',
+        'responseEnvelope': _envelope(),
+    }
+
+
+def _payment_details(payload):
+    return {
+        'payKey': payload.get('payKey') or _key('AP'),
+        'trackingId': payload.get('trackingId'),
+        'status': 'COMPLETED',
+        'actionType': 'PAY',
+        'currencyCode': 'USD',
+        'paymentInfoList': {'paymentInfo': []},
+        'responseEnvelope': _envelope(),
+    }
+
+
+def _set_payment_options(payload):
+    return {
+        'responseEnvelope': _envelope(),
+    }
+
+
+STUB_OPERATIONS = {
+    'Pay': _pay,
+    'Preapproval': _preapproval,
+    'PreapprovalDetails': _preapproval_details,
+    'PaymentDetails': _payment_details,
+    'SetPaymentOptions': _set_payment_options,
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # Keep-alive, like PayPal
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        operation = self.path.rstrip('/').rsplit('/', 1)[-1]
+        build = self.server.operations.get(operation)
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if build is None:
+            self.send_error(404)
+            return
+
+        response = json.dumps(build(json.loads(body.decode('utf-8')))).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(object):
+    """
+    Local stand-in for the Adaptive Payments service, for tests and benchmarks
+
+    Answers every known operation with a successful response after `latency` seconds. With
+    `processes` > 1 the listening socket is shared by that many forked server processes.
+    Use as a context manager and pass `server.endpoint` as `endpoint` to the operations.
+    """
+
+    def __init__(self, latency=0, processes=1, operations=None):
+        self.latency = latency
+        self.processes = processes
+        self.operations = dict(STUB_OPERATIONS, **(operations or {}))
+        self._server = None
+        self._workers = []
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}/AdaptivePayments'.format(host, port)
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self._server.daemon_threads = True
+        self._server.latency = self.latency
+        self._server.operations = self.operations
+
+        if self.processes > 1:
+            context = multiprocessing.get_context('fork')
+            self._workers = [context.Process(target=self._server.serve_forever, daemon=True)
+                             for _ in range(self.processes)]
+        else:
+            self._workers = [threading.Thread(target=self._server.serve_forever, daemon=True)]
+
+        for worker in self._workers:
+            worker.start()
+
+        return self
+
+    def stop(self):
+        for worker in self._workers:
+            if isinstance(worker, threading.Thread):
+                self._server.shutdown()
+                worker.join()
+            else:
+                worker.terminate()
+                worker.join()
+
+        self._server.server_close()
+        self._workers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,128 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from decimal import Decimal
+
+from yappa.bulk import BulkPreApproval, validate_preapproval_spec, spec_id_for
+
+
+class BulkPreApprovalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+        self.spec = {
+            'startingDate': '2016-05-28T00:33:00+08:00',
+            'endingDate': '2016-06-28T00:33:00+08:00',
+            'currencyCode': 'USD',
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+            'maxAmountPerPayment': Decimal('50.00'),
+            'maxTotalAmountOfAllPayments': Decimal('1500.00'),
+        }
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_path = os.path.join(self.tmp_dir.name, 'checkpoint.jsonl')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def build_session(self):
+        counter = {'value': 0}
+
+        def post(url, data, headers):
+            counter['value'] += 1
+            response = MagicMock()
+            response.json.return_value = {
+                'preapprovalKey': 'PA-{}'.format(counter['value']),
+                'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T03:27:49.944-07:00'}
+            }
+            return response
+
+        session = MagicMock()
+        session.post.side_effect = post
+        return session
+
+    def test_validate_spec_successfully(self):
+        self.assertEqual(validate_preapproval_spec(self.spec), [])
+
+    def test_validate_spec_with_invalid_dates_and_limits(self):
+        spec = dict(self.spec, endingDate='2016-05-01T00:33:00+08:00', maxAmountPerPayment=Decimal('2000'),
+                    maxNumberOfPayments=0)
+
+        self.assertEqual(validate_preapproval_spec(spec), [
+            'maxNumberOfPayments needs to be at least 1',
+            'maxAmountPerPayment can not exceed maxTotalAmountOfAllPayments',
+            'endingDate needs to be later than startingDate',
+        ])
+
+    def test_validate_spec_with_missing_date(self):
+        spec = dict(self.spec)
+        del spec['startingDate']
+
+        self.assertEqual(validate_preapproval_spec(spec), ['startingDate is required'])
+
+    def test_validate_spec_with_invalid_date_format(self):
+        spec = dict(self.spec, endingDate='next month')
+
+        self.assertEqual(validate_preapproval_spec(spec), ['endingDate is not a valid ISO 8601 date'])
+
+    def test_bulk_request_streams_results(self):
+        session = self.build_session()
+        specs = [('customer-{}'.format(i), dict(self.spec)) for i in range(5)]
+
+        bulk = BulkPreApproval(self.credentials, debug=True, max_workers=2, session=session)
+        results = list(bulk.request(specs))
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(session.post.call_count, 5)
+        self.assertEqual({r.specId for r in results}, {'customer-{}'.format(i) for i in range(5)})
+        self.assertTrue(all(r.nextUrl.startswith('https://www.sandbox.paypal.com/cgi-bin/webscr?') for r in results))
+
+    def test_bulk_request_reports_invalid_spec_without_request(self):
+        session = self.build_session()
+        spec = dict(self.spec, maxTotalAmountOfAllPayments=1500)
+
+        bulk = BulkPreApproval(self.credentials, debug=True, session=session)
+        results = list(bulk.request([spec]))
+
+        self.assertEqual(session.post.call_count, 0)
+        self.assertEqual(results[0].ack, 'Invalid')
+        self.assertEqual(results[0].errors, ['maxTotalAmountOfAllPayments needs to be instance of Decimal'])
+
+    def test_bulk_request_resumes_from_checkpoint(self):
+        specs = [dict(self.spec, maxNumberOfPayments=i + 1) for i in range(4)]
+
+        bulk = BulkPreApproval(self.credentials, debug=True, checkpoint_path=self.checkpoint_path,
+                               session=self.build_session())
+        results = bulk.request(specs)
+        first = next(results)
+        results.close()
+
+        with open(self.checkpoint_path) as checkpoint_file:
+            recorded = [json.loads(line)['specId'] for line in checkpoint_file]
+
+        self.assertIn(first.specId, recorded)
+
+        session = self.build_session()
+        bulk = BulkPreApproval(self.credentials, debug=True, checkpoint_path=self.checkpoint_path,
+                               session=session)
+        resumed = list(bulk.request(specs))
+
+        self.assertEqual(session.post.call_count, 4 - len(recorded))
+        self.assertEqual({r.specId for r in resumed} | set(recorded), {spec_id_for(spec) for spec in specs})
+
+    def test_bulk_request_skips_duplicate_specs(self):
+        session = self.build_session()
+
+        bulk = BulkPreApproval(self.credentials, debug=True, session=session)
+        results = list(bulk.request([self.spec, dict(self.spec)]))
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(session.post.call_count, 1)
@@ -0,0 +1,127 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+import requests
+
+from yappa.api import PreApproval, PreApprovalDetails
+from yappa.capture import TrafficRecorder, ReplayTransport, TrafficReplayer, read_capture, redact
+
+
+class CaptureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def build_session(self):
+        def post(url, data, headers):
+            response = MagicMock()
+            response.json.return_value = {
+                'approved': 'true',
+                'status': 'ACTIVE',
+                'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'}
+            }
+            return response
+
+        session = MagicMock()
+        session.post.side_effect = post
+        return session
+
+    def record_details(self, path, keys):
+        recorder = TrafficRecorder(path)
+        details = PreApprovalDetails(self.credentials, debug=True, session=self.build_session(), recorder=recorder)
+
+        for key in keys:
+            details.request(preapprovalKey=key)
+
+        recorder.close()
+
+    def test_redact(self):
+        self.assertEqual(redact({'PAYPAL_PASSWORD': 'secret', 'nested': [{'PAYPAL_SIGNATURE': 'sig', 'a': 1}]}),
+                         {'PAYPAL_PASSWORD': '<redacted>', 'nested': [{'PAYPAL_SIGNATURE': '<redacted>', 'a': 1}]})
+
+    def test_record_calls_without_credentials(self):
+        path = os.path.join(self.tmp_dir.name, 'capture.jsonl')
+        self.record_details(path, ['PA-1', 'PA-2'])
+
+        with open(path) as capture_file:
+            content = capture_file.read()
+
+        self.assertNotIn('fakepassword', content)
+        self.assertNotIn('123456789', content)
+
+        calls = list(read_capture(path))
+
+        self.assertEqual([c.operation for c in calls], ['PreapprovalDetails', 'PreapprovalDetails'])
+        self.assertEqual([c.payload['preapprovalKey'] for c in calls], ['PA-1', 'PA-2'])
+        self.assertEqual(calls[0].response['status'], 'ACTIVE')
+
+    def test_record_failed_call(self):
+        path = os.path.join(self.tmp_dir.name, 'capture.jsonl')
+        session = MagicMock()
+        session.post.side_effect = requests.ConnectionError('connection reset')
+        recorder = TrafficRecorder(path)
+
+        details = PreApprovalDetails(self.credentials, debug=True, session=session, recorder=recorder)
+
+        with self.assertRaises(requests.ConnectionError):
+            details.request(preapprovalKey='PA-1')
+
+        recorder.close()
+
+        self.assertEqual(next(read_capture(path)).error, 'ConnectionError: connection reset')
+
+    def test_replay_gzip_capture(self):
+        path = os.path.join(self.tmp_dir.name, 'capture.jsonl.gz')
+        self.record_details(path, ['PA-1'])
+        self.record_details(path, ['PA-2'])  # Appending adds a second gzip member
+
+        details = PreApprovalDetails(self.credentials, debug=True, session=ReplayTransport(path, speed=None))
+
+        self.assertEqual(details.request(preapprovalKey='PA-2').status, 'ACTIVE')
+        self.assertEqual(details.request(preapprovalKey='PA-1').approved, 'true')
+
+        with self.assertRaises(requests.ConnectionError):
+            details.request(preapprovalKey='PA-1')
+
+    def test_replay_falls_back_to_same_operation(self):
+        path = os.path.join(self.tmp_dir.name, 'capture.jsonl')
+        self.record_details(path, ['PA-1'])
+
+        transport = ReplayTransport(path, speed=None)
+        details = PreApprovalDetails(self.credentials, debug=True, session=transport)
+        preapproval = PreApproval(self.credentials, debug=True, session=transport)
+
+        with self.assertRaises(requests.ConnectionError):
+            preapproval.request(startingDate='2016-05-28T00:33:00+08:00', currencyCode='USD',
+                                returnUrl='http://return.url', cancelUrl='http://cancel.url')
+
+        self.assertEqual(details.request(preapprovalKey='PA-unknown').status, 'ACTIVE')
+
+    def test_replay_with_request_timeout(self):
+        path = os.path.join(self.tmp_dir.name, 'capture.jsonl')
+        self.record_details(path, ['PA-1'])
+
+        details = PreApprovalDetails(self.credentials, debug=True, session=ReplayTransport(path, speed=None), timeout=5)
+        self.assertEqual(details.request(preapprovalKey='PA-1').status, 'ACTIVE')
+
+    def test_replayer_reports_stats(self):
+        path = os.path.join(self.tmp_dir.name, 'capture.jsonl')
+        self.record_details(path, ['PA-{}'.format(i) for i in range(10)])
+
+        details = PreApprovalDetails(self.credentials, debug=True, session=ReplayTransport(path, speed=None))
+        stats = TrafficReplayer(path, {'PreapprovalDetails': details}, speed=None, max_workers=4).run()
+
+        self.assertEqual(stats.count, 10)
+        self.assertEqual(stats.errors, 0)
+        self.assertGreater(stats.throughput, 0)
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import os
+import unittest
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+try:
+    import django
+    from django.conf import settings
+    from django.core.exceptions import ValidationError
+    from django.urls import include, path
+except ImportError:     # Optional, only the Django integration needs it
+    django = None
+
+from yappa.models import Receiver, ReceiverList
+from yappa.stub import StubServer
+
+CREDENTIALS = {
+    'PAYPAL_USER_ID': 'fakeuserid',
+    'PAYPAL_PASSWORD': 'fakepassword',
+    'PAYPAL_SIGNATURE': '123456789',
+    'PAYPAL_APP_ID': 'APP-123456'
+}
+
+if django is not None:
+    if not settings.configured:
+        settings.configure(SECRET_KEY='yappa-tests', ROOT_URLCONF=__name__, ALLOWED_HOSTS=['testserver'],
+                           INSTALLED_APPS=['yappa.contrib.django'], YAPPA_CREDENTIALS=CREDENTIALS, YAPPA_DEBUG=True,
+                           YAPPA_DONE_URL='/orders/')
+        django.setup()
+
+    from django.test import RequestFactory, override_settings
+
+    from yappa.contrib.django import clients, views
+    from yappa.contrib.django.fields import PayKeyField
+    from yappa.contrib.django.signals import ipn_received, returned
+
+    urlpatterns = [path('paypal/', include('yappa.contrib.django.urls'))]
+
+
+@unittest.skipIf(django is None, 'needs django')
+class DjangoIntegrationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer().start()
+        self.settings = override_settings(YAPPA_ENDPOINT=self.server.endpoint)
+        self.settings.enable()
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        self.settings.disable()
+        self.server.stop()
+
+    def receive(self, signal):
+        received = []
+        handler = lambda **kwargs: received.append(kwargs)  # noqa: E731
+        signal.connect(handler, weak=False)
+        self.addCleanup(signal.disconnect, handler)
+        return received
+
+    def test_payment_flow_keeps_the_key_in_a_signed_cookie(self):
+        received = self.receive(returned)
+        receivers = ReceiverList([Receiver(email='seller@example.com', amount=Decimal('10.00'))])
+
+        response = asyncio.run(views.start_payment(self.factory.get('/checkout/'), currencyCode='USD',
+                                                   actionType='CREATE', receiverList=receivers))
+
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(clients.pay().approval_url('')))
+        cookie = response.cookies[views.COOKIES['payment']]
+        self.assertTrue(cookie['httponly'])
+        pay_key = response['Location'].rsplit('=', 1)[1]
+
+        request = self.factory.get('/paypal/return/', {'kind': 'payment'})
+        request.COOKIES[cookie.key] = cookie.value
+        response = asyncio.run(views.payment_return(request))
+
+        self.assertEqual((response.status_code, response['Location']), (302, '/orders/'))
+        self.assertEqual(response.cookies[cookie.key].value, '')
+        self.assertEqual(len(received), 1)
+        self.assertEqual((received[0]['kind'], received[0]['key']), ('payment', pay_key))
+        self.assertEqual(received[0]['details'].ack, 'Success')
+
+    def test_preapproval_flow_and_tampered_cookies(self):
+        received = self.receive(returned)
+        response = asyncio.run(views.start_preapproval(self.factory.get('/subscribe/'), currencyCode='USD',
+                                                       startingDate='2030-01-01T00:00:00+00:00'))
+        cookie = response.cookies[views.COOKIES['preapproval']]
+
+        request = self.factory.get('/paypal/return/', {'kind': 'preapproval'})
+        request.COOKIES[cookie.key] = cookie.value + 'x'
+        self.assertEqual(asyncio.run(views.payment_return(request)).status_code, 400)
+        self.assertEqual(received, [])
+
+        request.COOKIES[cookie.key] = cookie.value
+        self.assertEqual(asyncio.run(views.payment_return(request)).status_code, 302)
+        self.assertEqual(received[0]['key'], response['Location'].rsplit('=', 1)[1])
+
+        request = self.factory.post('/paypal/return/?kind=preapproval')
+        self.assertEqual(asyncio.run(views.payment_return(request)).status_code, 405)
+
+    def verify(self, answer):
+        received = self.receive(ipn_received)
+        session = MagicMock()
+        session.post.return_value.text = answer
+        request = self.factory.post('/paypal/ipn/', 'txn_id=1&payment_status=Completed',
+                                    content_type='application/x-www-form-urlencoded')
+
+        with patch.object(clients, 'get_session', return_value=session):
+            response = asyncio.run(views.ipn(request))
+
+        self.assertEqual(response.status_code, 200)
+        url, = session.post.call_args[0]
+        self.assertEqual(url, views.IPN_VERIFY_URLS[True])
+        self.assertEqual(session.post.call_args[1]['data'], b'cmd=_notify-validate&txn_id=1&payment_status=Completed')
+        return received
+
+    def test_verified_ipn_is_signalled(self):
+        received = self.verify('VERIFIED')
+        self.assertEqual(received[0]['data'], {'txn_id': '1', 'payment_status': 'Completed'})
+
+    def test_invalid_ipn_is_dropped(self):
+        self.assertEqual(self.verify('INVALID'), [])
+
+    def test_clients_are_rebuilt_when_settings_change(self):
+        pay = clients.pay()
+        session = clients.get_session()
+        self.assertIs(clients.pay(), pay)
+        self.assertIs(pay.session, session)
+
+        with override_settings(YAPPA_POOL_SIZE=3):
+            self.assertIsNot(clients.pay(), pay)
+            self.assertIsNot(clients.get_session(), session)
+
+        self.assertTrue(clients.pay().endpoint.startswith(self.server.endpoint))
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_forked_worker_builds_its_own_connections(self):
+        clients.payment_details().request(payKey='AP-1')
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:    # Child: report and leave without running any cleanup
+            try:
+                before = clients.get_session().stats()
+                clients.payment_details().request(payKey='AP-2')
+                after = clients.get_session().stats()
+                os.write(write_end, json.dumps([before.created, before.rebuilds, after.created]).encode('utf-8'))
+            finally:
+                os._exit(0)
+
+        os.close(write_end)
+        os.waitpid(pid, 0)
+
+        with os.fdopen(read_end) as pipe:
+            self.assertEqual(json.loads(pipe.read()), [0, 1, 1])
+
+        self.assertEqual(clients.get_session().stats().rebuilds, 0)
+
+    def test_key_fields_validate_and_deconstruct(self):
+        field = PayKeyField()
+        field.set_attributes_from_name('pay_key')
+        field.run_validators('AP-1234567890')
+
+        with self.assertRaises(ValidationError):
+            field.run_validators('PA-1234567890')
+
+        self.assertEqual(field.deconstruct()[1], 'yappa.contrib.django.fields.PayKeyField')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+import csv
+import gzip
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+from yappa.api import PreApprovalDetails
+from yappa.exceptions import AdaptiveApiException
+from yappa.export import HistoryExporter, flatten_record, pyarrow
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.payment = {
+            'payKey': 'AP-1',
+            'status': 'COMPLETED',
+            'currencyCode': 'USD',
+            'senderEmail': 'buyer@gmail.com',
+            'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'},
+            'paymentInfoList': {'paymentInfo': [
+                {'receiver': {'email': 'seller@gmail.com', 'amount': '10.10', 'primary': 'true'},
+                 'transactionId': '1AB', 'transactionStatus': 'COMPLETED'},
+                {'receiver': {'email': 'partner@gmail.com', 'amount': '2.05', 'primary': 'false'},
+                 'transactionId': '2CD', 'transactionStatus': 'COMPLETED', 'refundedAmount': '1.00'},
+            ]},
+        }
+        self.preapproval = {
+            'ack': 'Success',
+            'preapprovalKey': 'PA-1',
+            'status': 'ACTIVE',
+            'startingDate': '2016-05-29T00:00:00.000-07:00',
+            'maxTotalAmountOfAllPayments': '500.00',
+            'curPaymentsAmount': '20.00',
+            'curPayments': '2',
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def records(self, count):
+        for index in range(count):
+            yield dict(self.payment, payKey='AP-{}'.format(index))
+
+        yield self.preapproval
+
+    def test_flatten_payment_per_receiver(self):
+        rows = flatten_record(self.payment)
+
+        self.assertEqual([(row['receiverEmail'], row['receiverAmount']) for row in rows],
+                         [('seller@gmail.com', '10.10'), ('partner@gmail.com', '2.05')])
+        self.assertEqual({(row['kind'], row['ack'], row['status']) for row in rows},
+                         {('payment', 'Success', 'COMPLETED')})
+
+    def test_flatten_response_namedtuple(self):
+        PayResponse = namedtuple('ApiResponse', ['ack', 'payKey', 'paymentExecStatus', 'paymentInfoList', 'sender'])
+        resp = PayResponse('Success', 'AP-1', 'COMPLETED', self.payment['paymentInfoList']['paymentInfo'], None)
+
+        self.assertEqual([row['status'] for row in flatten_record(resp)], ['COMPLETED', 'COMPLETED'])
+        self.assertEqual(flatten_record(self.preapproval)[0]['kind'], 'preapproval')
+
+    def test_export_gzip_csv(self):
+        path = os.path.join(self.tmp_dir.name, 'history.csv.gz')
+        rows = HistoryExporter(path, chunk_size=3).export(self.records(4))
+
+        with gzip.open(path, 'rt', newline='') as csv_file:
+            content = list(csv.DictReader(csv_file))
+
+        self.assertEqual(rows, 9)
+        self.assertEqual(len(content), 9)
+        self.assertEqual(content[1]['receiverAmount'], '2.05')
+        self.assertEqual(content[1]['refundedAmount'], '1.00')
+        self.assertEqual(content[0]['timestamp'], '2016-05-29T11:09:05.377000+00:00')
+        self.assertEqual(content[0]['receiverPrimary'], 'true')
+        self.assertEqual(content[-1]['curPayments'], '2')
+
+    def test_unknown_format(self):
+        with self.assertRaises(AdaptiveApiException):
+            HistoryExporter('history.xlsx', file_format='xlsx')
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_export_parquet_row_groups(self):
+        path = os.path.join(self.tmp_dir.name, 'history.parquet')
+        rows = HistoryExporter(path, chunk_size=4).export(self.records(5))
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        table = parquet_file.read()
+
+        self.assertEqual(rows, 11)
+        self.assertEqual(parquet_file.num_row_groups, 3)
+        self.assertEqual(table.column('receiverAmount')[0].as_py(), Decimal('10.10'))
+        self.assertEqual(table.column('timestamp')[0].as_py(),
+                         datetime(2016, 5, 29, 11, 9, 5, 377000, tzinfo=timezone.utc))
+        self.assertEqual(table.column('maxTotalAmountOfAllPayments')[10].as_py(), Decimal('500.00'))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_export_arrow(self):
+        path = os.path.join(self.tmp_dir.name, 'history.arrow')
+        HistoryExporter(path).export(self.records(2))
+
+        with pyarrow.ipc.open_file(path) as reader:
+            table = reader.read_all()
+
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(table.column('payKey').to_pylist()[:2], ['AP-0', 'AP-0'])
+
+
+    def test_export_preapproval_details_response(self):
+        response = MagicMock()
+        response.json.return_value = dict(self.preapproval, ack=None, preapprovalKey=None, approved='true',
+                                          responseEnvelope={'ack': 'Success',
+                                                            'timestamp': '2016-05-29T04:09:05.377-07:00'})
+        session = MagicMock()
+        session.post.return_value = response
+        credentials = {'PAYPAL_USER_ID': 'fakeuserid', 'PAYPAL_PASSWORD': 'fakepassword',
+                       'PAYPAL_SIGNATURE': '123456789', 'PAYPAL_APP_ID': 'APP-123456'}
+        resp = PreApprovalDetails(credentials, debug=True, session=session).request(preapprovalKey='PA-1')
+
+        path = os.path.join(self.tmp_dir.name, 'preapprovals.csv.gz')
+        HistoryExporter(path).export([('PA-1', resp)])
+
+        with gzip.open(path, 'rt', newline='') as csv_file:
+            row = next(csv.DictReader(csv_file))
+
+        self.assertEqual((row['kind'], row['preapprovalKey'], row['status']), ('preapproval', 'PA-1', 'ACTIVE'))
+        self.assertEqual(row['timestamp'], '2016-05-29T11:09:05.377000+00:00')
+
+    def test_amounts_with_more_places_are_rounded(self):
+        payment = dict(self.payment, paymentInfoList={'paymentInfo': [
+            {'receiver': {'email': 'seller@gmail.com', 'amount': '1.005'}},
+            {'receiver': {'email': 'partner@gmail.com', 'amount': '1.015'}},
+        ]})
+        path = os.path.join(self.tmp_dir.name, 'history.csv.gz')
+        exporter = HistoryExporter(path)
+        exporter.export([payment])
+
+        with gzip.open(path, 'rt', newline='') as csv_file:
+            amounts = [row['receiverAmount'] for row in csv.DictReader(csv_file)]
+
+        self.assertEqual(amounts, ['1.00', '1.02'])
+        self.assertEqual(exporter.rounded, 2)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_accepts_amounts_with_more_places(self):
+        payment = dict(self.payment, paymentInfoList={'paymentInfo': [
+            {'receiver': {'email': 'seller@gmail.com', 'amount': '1.005'}}]})
+        path = os.path.join(self.tmp_dir.name, 'history.parquet')
+        HistoryExporter(path).export([payment])
+
+        self.assertEqual(pyarrow.parquet.read_table(path).column('receiverAmount')[0].as_py(), Decimal('1.00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
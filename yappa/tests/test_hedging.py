@@ -0,0 +1,124 @@
+import itertools
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from yappa.api import Pay, PreApproval, PreApprovalDetails
+from yappa.exceptions import AdaptiveApiException
+from yappa.hedging import HedgePolicy
+
+
+class HedgingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+        self.policies = []
+
+    def tearDown(self):
+        for policy in self.policies:
+            policy.shutdown()
+
+    def build_policy(self, **kwargs):
+        policy = HedgePolicy(**kwargs)
+        self.policies.append(policy)
+        return policy
+
+    def build_session(self, delays):
+        delays = iter(delays)
+        counter = itertools.count(1)
+
+        def post(url, data, headers):
+            call = next(counter)
+            time.sleep(next(delays, 0))
+            response = MagicMock()
+            response.json.return_value = {
+                'approved': 'true',
+                'status': 'ACTIVE',
+                'senderEmail': 'call{}@gmail.com'.format(call),
+                'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'}
+            }
+            return response
+
+        session = MagicMock()
+        session.post.side_effect = post
+        return session
+
+    def test_fast_request_is_not_hedged(self):
+        policy = self.build_policy(initial_delay=0.5)
+        session = self.build_session([0])
+        details = PreApprovalDetails(self.credentials, debug=True, session=session, hedge=policy)
+
+        details.request(preapprovalKey='PA-1')
+
+        self.assertEqual(session.post.call_count, 1)
+        self.assertEqual(policy.stats().hedges, 0)
+
+    def test_slow_request_is_hedged(self):
+        policy = self.build_policy(initial_delay=0.05)
+        session = self.build_session([1.0, 0])
+        details = PreApprovalDetails(self.credentials, debug=True, session=session, hedge=policy)
+
+        resp = details.request(preapprovalKey='PA-1')
+        stats = policy.stats()
+
+        self.assertEqual(resp.senderEmail, 'call2@gmail.com')
+        self.assertEqual(session.post.call_count, 2)
+        self.assertEqual((stats.requests, stats.hedges, stats.hedgeWins, stats.winRate), (1, 1, 1, 1.0))
+
+    def test_hedge_budget_caps_extra_requests(self):
+        policy = self.build_policy(initial_delay=0.01, budget=0, burst=1)
+        session = self.build_session([0.05] * 10)
+        details = PreApprovalDetails(self.credentials, debug=True, session=session, hedge=policy)
+
+        for _ in range(3):
+            details.request(preapprovalKey='PA-1')
+
+        self.assertEqual(policy.stats().hedges, 1)
+
+    def test_calls_queued_for_a_worker_are_not_hedged(self):
+        policy = self.build_policy(initial_delay=0.4, max_workers=1)
+        session = self.build_session([0.3, 0.3])
+        details = PreApprovalDetails(self.credentials, debug=True, session=session, hedge=policy)
+
+        threads = [threading.Thread(target=details.request, kwargs={'preapprovalKey': 'PA-1'}) for _ in range(2)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(session.post.call_count, 2)
+        self.assertEqual(policy.stats().hedges, 0)
+
+    def test_delay_follows_latency_percentile(self):
+        policy = self.build_policy(percentile=90, min_delay=0.01, max_delay=1.0)
+
+        for latency in range(1, 101):
+            policy._latencies.append(latency / 1000.0)
+
+        self.assertAlmostEqual(policy.delay(), 0.09)
+
+        policy._latencies.extend([5.0] * 50)
+        self.assertEqual(policy.delay(), 1.0)
+
+    def test_mutating_operations_refuse_hedging(self):
+        policy = self.build_policy()
+
+        for operation in (Pay, PreApproval):
+            with self.assertRaises(AdaptiveApiException) as context:
+                operation(self.credentials, debug=True, hedge=policy)
+
+            self.assertEqual(context.exception.args[0],
+                             'hedging can only be used with read-only operations, not {}'.format(operation.OPERATION))
+
+        pay = Pay(self.credentials, debug=True)
+
+        with self.assertRaises(AdaptiveApiException):
+            policy.execute(pay, lambda: None)
@@ -107,3 +107,17 @@ class ModelTestCase(unittest.TestCase):
                 {'email': 'second@gmail.com', 'amount': '22.2'},
             ]
         })
+
+    def test_validate_receiver_list(self):
+        receiver_list = ReceiverList([
+            Receiver(email='first@gmail.com', amount=Decimal('11.1'), primary=True),
+            Receiver(email='second@gmail.com', amount=Decimal('-1'), primary=True),
+        ])
+
+        self.assertEqual(receiver_list.validate(), [
+            'amount of receiver second@gmail.com needs to be greater than 0',
+            'receiverList can have only one primary receiver',
+        ])
+
+    def test_validate_empty_receiver_list(self):
+        self.assertEqual(ReceiverList().validate(), ['receiverList needs at least one receiver'])
@@ -0,0 +1,318 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from yappa.api import Pay
+from yappa.exceptions import AdaptiveApiException, OutboxFullException, ValidationException
+from yappa.models import Receiver, ReceiverList
+from yappa.outbox import Outbox, DONE, FAILED, PENDING
+from yappa.stub import STUB_OPERATIONS, StubServer
+from yappa.store import StateStore
+
+
+class OutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'outbox.db')
+        self.sent = []
+        self.lookups = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def tearDown(self):
+        self.release.set()
+        self.tmp_dir.cleanup()
+
+    def build_session(self):
+        def post(url, data, headers):
+            self.release.wait()
+            payload = json.loads(data)
+            response = MagicMock()
+
+            if url.endswith('/PaymentDetails'):
+                self.lookups.append(payload['trackingId'])
+                response.json.return_value = {
+                    'responseEnvelope': {'ack': 'Failure', 'timestamp': '2016-05-29T04:09:05.377-07:00'},
+                    'error': [{'errorId': '580022', 'message': 'unknown trackingId'}],
+                }
+                return response
+
+            self.sent.append(payload)
+            response.json.return_value = {
+                'payKey': 'AP-{}'.format(len(self.sent)),
+                'paymentExecStatus': 'COMPLETED',
+                'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'}
+            }
+            return response
+
+        session = MagicMock()
+        session.post.side_effect = post
+        return session
+
+    def build_outbox(self, **kwargs):
+        pay = Pay(self.credentials, debug=True, session=self.build_session())
+        return Outbox(pay, path=self.path, **kwargs)
+
+    def pay_kwargs(self, sender='buyer@gmail.com', memo=None):
+        return {
+            'currencyCode': 'USD',
+            'senderEmail': sender,
+            'memo': memo,
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+            'receiverList': ReceiverList([Receiver(email='seller@gmail.com', amount=Decimal('10.00'))]),
+        }
+
+    def test_submit_returns_handle_and_uses_key_as_tracking_id(self):
+        with self.build_outbox() as outbox:
+            handle = outbox.submit(idempotency_key='order-1', **self.pay_kwargs())
+            resp = handle.result(timeout=5)
+
+            self.assertEqual(resp.ack, 'Success')
+            self.assertEqual(self.sent[0]['trackingId'], 'order-1')
+            self.assertEqual(handle.status(), DONE)
+
+    def test_invalid_request_is_rejected_on_submit(self):
+        with self.build_outbox() as outbox:
+            with self.assertRaises(ValidationException):
+                outbox.submit(currencyCode='USD')
+
+            self.assertEqual(outbox.pending(), 0)
+
+    def test_same_key_is_sent_once(self):
+        with self.build_outbox() as outbox:
+            first = outbox.submit(idempotency_key='order-1', **self.pay_kwargs())
+            first.result(timeout=5)
+            second = outbox.submit(idempotency_key='order-1', **self.pay_kwargs())
+
+            self.assertEqual(second.result(timeout=5).payKey, 'AP-1')
+            self.assertEqual(len(self.sent), 1)
+
+    def test_calls_of_a_sender_keep_their_order(self):
+        with self.build_outbox(workers=4) as outbox:
+            handles = [outbox.submit(**self.pay_kwargs(sender='buyer{}@gmail.com'.format(index % 3),
+                                                       memo=str(index)))
+                       for index in range(30)]
+
+            for handle in handles:
+                handle.result(timeout=5)
+
+        for sender in range(3):
+            memos = [int(payload['memo']) for payload in self.sent
+                     if payload['senderEmail'] == 'buyer{}@gmail.com'.format(sender)]
+            self.assertEqual(memos, sorted(memos))
+
+    def test_backpressure(self):
+        self.release.clear()
+
+        with self.build_outbox(workers=1, max_pending=1) as outbox:
+            outbox.submit(**self.pay_kwargs())
+
+            with self.assertRaises(OutboxFullException):
+                outbox.submit(block=False, **self.pay_kwargs())
+
+            self.release.set()
+
+    def test_callback_and_await(self):
+        called = threading.Event()
+
+        with self.build_outbox() as outbox:
+            outbox.submit(callback=lambda handle: called.set(), **self.pay_kwargs())
+
+            async def submit():
+                return await outbox.submit(**self.pay_kwargs())
+
+            resp = asyncio.run(submit())
+
+            self.assertEqual(resp.ack, 'Success')
+            self.assertTrue(called.wait(5))
+
+    def test_pending_calls_are_sent_on_start(self):
+        outbox = self.build_outbox()
+        outbox.close()
+
+        connection = sqlite3.connect(self.path)
+        payload = {'actionType': 'PAY', 'currencyCode': 'USD', 'trackingId': 'order-9'}
+        connection.execute('INSERT INTO outbox (key, sender, payload, state, created_at) VALUES (?, ?, ?, ?, ?)',
+                           ('order-9', 'buyer@gmail.com', json.dumps(payload), PENDING, time.time()))
+        connection.commit()
+        connection.close()
+
+        with self.build_outbox() as outbox:
+            handle = outbox.submit(idempotency_key='order-9', **self.pay_kwargs())
+
+            self.assertEqual(handle.result(timeout=5).ack, 'Success')
+            self.assertEqual(self.lookups, ['order-9'])
+            self.assertEqual([payload['trackingId'] for payload in self.sent], ['order-9'])
+
+    def build_stub(self, made):
+        def pay(payload):
+            # PayPal refuses a trackingId it already made a payment for
+            if payload['trackingId'] in made:
+                return {'responseEnvelope': {'ack': 'Failure', 'timestamp': '2016-05-29T04:09:05.377-07:00'},
+                        'error': [{'errorId': '579017', 'message': 'trackingId is already used'}]}
+
+            response = STUB_OPERATIONS['Pay'](payload)
+            made[payload['trackingId']] = response['payKey']
+            return response
+
+        def payment_details(payload):
+            if payload['trackingId'] not in made:
+                return {'responseEnvelope': {'ack': 'Failure', 'timestamp': '2016-05-29T04:09:05.377-07:00'},
+                        'error': [{'errorId': '580022', 'message': 'unknown trackingId'}]}
+
+            return dict(STUB_OPERATIONS['PaymentDetails'](payload), payKey=made[payload['trackingId']])
+
+        server = StubServer(operations={'Pay': pay, 'PaymentDetails': payment_details}).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_recovered_payment_that_went_out_is_looked_up(self):
+        made = {}
+        server = self.build_stub(made)
+
+        with Outbox(Pay(self.credentials, endpoint=server.endpoint), path=self.path) as outbox:
+            pay_key = outbox.submit(idempotency_key='order-1', **self.pay_kwargs()).result(timeout=5).payKey
+
+        # The process stopped after PayPal made the payment but before the outbox wrote it down
+        connection = sqlite3.connect(self.path)
+        connection.execute('UPDATE outbox SET state = ?, response = NULL', (PENDING,))
+        connection.commit()
+        connection.close()
+
+        with Outbox(Pay(self.credentials, endpoint=server.endpoint), path=self.path) as outbox:
+            resp = outbox.submit(idempotency_key='order-1', **self.pay_kwargs()).result(timeout=5)
+
+        self.assertEqual((resp.ack, resp.payKey), ('Success', pay_key))
+        self.assertEqual(list(made), ['order-1'])
+
+    def test_refused_payment_is_looked_up(self):
+        server = self.build_stub({'order-2': 'AP-EARLIER'})
+
+        with Outbox(Pay(self.credentials, endpoint=server.endpoint), path=self.path) as outbox:
+            resp = outbox.submit(idempotency_key='order-2', **self.pay_kwargs()).result(timeout=5)
+            self.assertEqual(outbox.status('order-2'), DONE)
+
+        self.assertEqual((resp.ack, resp.payKey), ('Success', 'AP-EARLIER'))
+
+    def test_unexpected_errors_fail_the_call_but_not_the_worker(self):
+        session = self.build_session()
+        post = session.post.side_effect
+        calls = []
+
+        def fail_once(*args, **kwargs):
+            calls.append(args)
+
+            if len(calls) == 1:
+                raise RuntimeError('no JSON in the response')
+
+            return post(*args, **kwargs)
+
+        session.post.side_effect = fail_once
+
+        with Outbox(Pay(self.credentials, debug=True, session=session), path=self.path, workers=1) as outbox:
+            failed = outbox.submit(**self.pay_kwargs())
+            self.assertIsInstance(failed.exception(timeout=5), RuntimeError)
+            self.assertEqual(failed.status(), FAILED)
+
+            # Same sender, so the same worker
+            self.assertEqual(outbox.submit(**self.pay_kwargs()).result(timeout=5).ack, 'Success')
+
+    def build_flaky_session(self, error, details_ack='Success'):
+        calls = []
+
+        def post(url, data, headers):
+            operation = url.rsplit('/', 1)[-1]
+            calls.append(operation)
+            response = MagicMock()
+
+            if operation == 'PaymentDetails':
+                response.json.return_value = {
+                    'payKey': 'AP-MADE', 'status': 'COMPLETED', 'trackingId': json.loads(data)['trackingId'],
+                    'responseEnvelope': {'ack': details_ack, 'timestamp': '2016-05-29T04:09:05.377-07:00'},
+                    'error': [{'errorId': '580022', 'message': 'unknown trackingId'}],
+                }
+            elif calls.count('Pay') == 1:
+                raise error
+            else:
+                response.json.return_value = {
+                    'payKey': 'AP-RETRIED', 'paymentExecStatus': 'COMPLETED',
+                    'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'}
+                }
+
+            return response
+
+        session = MagicMock()
+        session.post.side_effect = post
+        return session, calls
+
+    def test_payment_that_may_have_been_made_is_looked_up(self):
+        session, calls = self.build_flaky_session(requests.ReadTimeout('read timed out'))
+
+        with Outbox(Pay(self.credentials, debug=True, session=session), path=self.path, backoff=0) as outbox:
+            resp = outbox.submit(idempotency_key='order-1', **self.pay_kwargs()).result(timeout=5)
+
+        self.assertEqual((resp.payKey, resp.paymentExecStatus), ('AP-MADE', 'COMPLETED'))
+        self.assertEqual(calls, ['Pay', 'PaymentDetails'])
+
+    def test_payment_unknown_to_paypal_is_sent_again(self):
+        session, calls = self.build_flaky_session(requests.ConnectionError('connection reset'), details_ack='Failure')
+
+        with Outbox(Pay(self.credentials, debug=True, session=session), path=self.path, backoff=0) as outbox:
+            resp = outbox.submit(idempotency_key='order-1', **self.pay_kwargs()).result(timeout=5)
+
+        self.assertEqual(resp.payKey, 'AP-RETRIED')
+        self.assertEqual(calls, ['Pay', 'PaymentDetails', 'Pay'])
+
+    def test_connect_errors_are_retried_without_lookup(self):
+        error = requests.ConnectionError(NewConnectionError(None, 'connection refused'))
+        session, calls = self.build_flaky_session(error)
+
+        with Outbox(Pay(self.credentials, debug=True, session=session), path=self.path, backoff=0) as outbox:
+            resp = outbox.submit(idempotency_key='order-1', **self.pay_kwargs()).result(timeout=5)
+
+        self.assertEqual(resp.payKey, 'AP-RETRIED')
+        self.assertEqual(calls, ['Pay', 'Pay'])
+
+    def test_calls_are_recorded_in_the_store(self):
+        store = StateStore(os.path.join(self.tmp_dir.name, 'state.db'))
+        pay = Pay(self.credentials, debug=True, session=self.build_session(), store=store)
+
+        with Outbox(pay, path=self.path) as outbox:
+            outbox.submit(idempotency_key='order-1', **self.pay_kwargs()).result(timeout=5)
+
+        store.flush()
+        self.assertEqual([operation.trackingId for operation in store.find()], ['order-1'])
+        store.close()
+
+    def test_close_without_wait_settles_queued_handles(self):
+        self.release.clear()
+        outbox = self.build_outbox(workers=1)
+        outbox.submit(**self.pay_kwargs())
+        queued = outbox.submit(**self.pay_kwargs())
+        threading.Timer(0.1, self.release.set).start()
+        outbox.close(wait=False)
+
+        with self.assertRaises(AdaptiveApiException):
+            queued.result(timeout=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import asyncio
+import time
+import unittest
+from decimal import Decimal
+
+from yappa.api import Pay
+from yappa.exceptions import AdaptiveApiException, PayException
+from yappa.models import Receiver, ReceiverList
+from yappa.paykeys import PayKeyPool
+from yappa.stub import STUB_OPERATIONS, StubServer
+from yappa.transport import PooledSession
+
+
+class PayKeyPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+        self.options = []
+        self.server = StubServer(operations={'SetPaymentOptions': self.set_payment_options}).start()
+        self.session = PooledSession(pool_size=4)
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close()
+
+        self.session.close()
+        self.server.stop()
+
+    def set_payment_options(self, payload):
+        self.options.append(payload)
+        return STUB_OPERATIONS['SetPaymentOptions'](payload)
+
+    def build_pool(self, **kwargs):
+        pay = Pay(self.credentials, debug=True, session=self.session, endpoint=self.server.endpoint)
+        kwargs.setdefault('sweep_interval', None)
+        pool = PayKeyPool(pay, **kwargs)
+        pool.configure('ebook', currencyCode='USD', returnUrl='http://www.example.com/success/',
+                       cancelUrl='http://www.example.com/cancel/',
+                       receiverList=ReceiverList([Receiver(email='seller@gmail.com', amount=Decimal('9.99'))]))
+        self.pools.append(pool)
+        return pool
+
+    def test_checkout_takes_pooled_key(self):
+        pool = self.build_pool(size=2)
+        pool.fill()
+
+        self.assertEqual(pool.stats().ready, 2)
+
+        key = pool.checkout('ebook')
+        self.assertTrue(key.hit)
+        self.assertTrue(key.payKey.startswith('AP-'))
+        self.assertIn('cmd=_ap-payment&paykey={}'.format(key.payKey), key.nextUrl)
+        self.assertEqual(key.expiresAt - key.createdAt, pool.lifetime)
+
+    def test_empty_pool_creates_on_the_spot(self):
+        pool = self.build_pool(size=1)
+        key = pool.checkout('ebook')
+
+        self.assertFalse(key.hit)
+        pool.fill()
+
+        self.assertTrue(pool.checkout('ebook').hit)
+        stats = pool.stats()
+        self.assertEqual((stats.hits, stats.misses, stats.hitRate), (1, 1, 0.5))
+        self.assertIsNotNone(stats.refillP95)
+
+    def test_keys_about_to_expire_are_replaced(self):
+        pool = self.build_pool(size=2, lifetime=1.2, expiry_margin=1)
+        pool.fill()
+        old = {key for key, _ in pool._ready['ebook']}
+        time.sleep(0.25)
+        pool.sweep()
+        pool.fill()
+
+        self.assertEqual(pool.stats().expired, 2)
+        self.assertTrue({key for key, _ in pool._ready['ebook']}.isdisjoint(old))
+
+    def test_checkout_binds_order_options(self):
+        pool = self.build_pool(size=1)
+        pool.fill()
+        key = pool.checkout('ebook', displayOptions={'businessName': 'Bookshop'},
+                            receiverOptions=[{'receiver': {'email': 'seller@gmail.com'},
+                                              'invoiceData': {'item': [{'name': 'ebook', 'price': '9.99'}]}}])
+
+        self.assertEqual(len(self.options), 1)
+        self.assertEqual(self.options[0]['payKey'], key.payKey)
+        self.assertEqual(self.options[0]['displayOptions'], {'businessName': 'Bookshop'})
+
+    def test_async_checkout(self):
+        pool = self.build_pool(size=1)
+
+        async def run():
+            first = await pool.acheckout('ebook', displayOptions={'businessName': 'Bookshop'})
+            pool.fill()
+            return first, await pool.acheckout('ebook')
+
+        first, second = asyncio.run(run())
+        self.assertEqual((first.hit, second.hit), (False, True))
+        self.assertEqual(self.options[0]['payKey'], first.payKey)
+
+    def test_unknown_configuration(self):
+        pool = self.build_pool()
+
+        with self.assertRaises(AdaptiveApiException):
+            pool.checkout('audiobook')
+
+    def test_payment_must_be_left_for_approval(self):
+        pool = self.build_pool(size=1)
+        pool.pay.request = lambda **kwargs: pool.pay.build_response({
+            'payKey': 'AP-1', 'paymentExecStatus': 'COMPLETED',
+            'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'}})
+
+        with self.assertRaises(PayException):
+            pool.checkout('ebook')
+
+        pool.fill()
+        self.assertEqual(pool.stats().refillFailures, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
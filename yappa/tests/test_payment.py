@@ -3,7 +3,8 @@ import unittest
 from unittest.mock import patch
 from decimal import Decimal
 
-from yappa.api import Pay
+from yappa.api import Pay, PaymentDetails
+from yappa.exceptions import ValidationException
 from yappa.models import Receiver, ReceiverList
 
 
@@ -30,6 +31,13 @@ class PaymentTestCase(unittest.TestCase):
 
         self.pay_key = 'AP-2125055755555555'
 
+        self.request_kwargs = {
+            'currencyCode': self.currency,
+            'returnUrl': self.return_url,
+            'cancelUrl': self.cancel_url,
+            'receiverList': self.receiver_list,
+        }
+
     def tearDown(self):
         pass
 
@@ -127,10 +135,9 @@ class PaymentTestCase(unittest.TestCase):
         }
 
         mock_post.return_value.json.return_value = mock_response
-        receiver_list = ReceiverList([])    # No need to be true receiver list
 
         pay = Pay(self.credentials, debug=True)
-        resp = pay.request(receiverList=receiver_list)
+        resp = pay.request(**self.request_kwargs)
 
         self.assertEquals(resp.ack, 'Success')
         self.assertEquals(resp.payKey, self.pay_key)
@@ -159,10 +166,9 @@ class PaymentTestCase(unittest.TestCase):
         }
 
         mock_post.return_value.json.return_value = mock_response
-        receiver_list = ReceiverList([])
 
         pay = Pay(self.credentials, debug=True)
-        resp = pay.request(receiverList=receiver_list)
+        resp = pay.request(**self.request_kwargs)
 
         self.assertEquals(resp.ack, 'Failure')
         self.assertEquals(resp.errorId, '580022')
@@ -190,12 +196,75 @@ class PaymentTestCase(unittest.TestCase):
         }
 
         mock_post.return_value.json.return_value = mock_response
-        receiver_list = ReceiverList([])
 
         pay = Pay(self.credentials, debug=True)
-        resp = pay.request(receiverList=receiver_list)
+        resp = pay.request(**self.request_kwargs)
 
         self.assertEquals(resp.ack, 'Failure')
         self.assertEquals(resp.errorId, '579040')
         self.assertEquals(resp.message, 'Receiver PayPal accounts must be unique.')
         self.assertEquals(resp.timestamp, '2016-05-30T10:27:03.931-07:00')
+
+    @patch('yappa.api.requests')
+    def test_request_payment_details(self, mock_request):
+        expected_payload = {
+            'payKey': self.pay_key,
+            'requestEnvelope': {
+                'errorLanguage': 'en_US',
+            }
+        }
+
+        payment_details = PaymentDetails(self.credentials, debug=True)
+        payment_details.request(payKey=self.pay_key)
+
+        args, kwargs = mock_request.post.call_args
+
+        self.assertEquals(args, ('https://svcs.sandbox.paypal.com/AdaptivePayments/PaymentDetails',))
+        self.assertEquals(json.loads(kwargs['data']), expected_payload)
+
+    @patch('yappa.api.requests')
+    def test_request_timeout(self, mock_request):
+        PaymentDetails(self.credentials, debug=True).request(payKey=self.pay_key)
+        self.assertNotIn('timeout', mock_request.post.call_args[1])
+
+        PaymentDetails(self.credentials, debug=True, timeout=5).request(payKey=self.pay_key)
+        self.assertEqual(mock_request.post.call_args[1]['timeout'], 5)
+
+    @patch('yappa.api.requests.post')
+    def test_retrieve_payment_details_successfully(self, mock_post):
+        payment_info_list = [{
+            'pendingRefund': 'false',
+            'receiver': {'amount': '6.00', 'email': 'receiver1@gmail.com', 'primary': 'false'},
+            'transactionId': '111111111111',
+            'transactionStatus': 'COMPLETED'
+        }]
+        mock_post.return_value.json.return_value = {
+            'payKey': self.pay_key,
+            'trackingId': 'order-1',
+            'status': 'COMPLETED',
+            'actionType': 'PAY',
+            'currencyCode': 'USD',
+            'paymentInfoList': {'paymentInfo': payment_info_list},
+            'responseEnvelope': {
+                'ack': 'Success',
+                'build': '20420247',
+                'correlationId': 'a92e1583464e5',
+                'timestamp': '2016-05-30T08:39:34.156-07:00'
+            }
+        }
+
+        payment_details = PaymentDetails(self.credentials, debug=True)
+        resp = payment_details.request(trackingId='order-1')
+
+        self.assertEquals(resp.ack, 'Success')
+        self.assertEquals(resp.payKey, self.pay_key)
+        self.assertEquals(resp.status, 'COMPLETED')
+        self.assertEquals(resp.paymentInfoList, payment_info_list)
+
+    def test_payment_details_needs_a_key(self):
+        payment_details = PaymentDetails(self.credentials, debug=True)
+
+        with self.assertRaises(ValidationException) as context:
+            payment_details.request()
+
+        self.assertEquals(context.exception.errors, ['one of payKey, trackingId or transactionId is required'])
@@ -0,0 +1,142 @@
+import unittest
+from collections import namedtuple
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+from yappa.api import Pay
+from yappa.exceptions import ValidationException
+from yappa.planner import Payout, PayoutPlanner, PreapprovalLimits, limits_from_details
+
+
+class PlannerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+    def tearDown(self):
+        pass
+
+    def payouts(self, count, amount='10.00', **kwargs):
+        kwargs.setdefault('currencyCode', 'USD')
+        return [Payout(email='seller{}@gmail.com'.format(index), amount=Decimal(amount), **kwargs)
+                for index in range(count)]
+
+    def test_fills_receiver_lists(self):
+        plan = PayoutPlanner().plan(self.payouts(13))
+
+        self.assertEqual([len(payment.receiverList) for payment in plan], [6, 6, 1])
+        self.assertEqual(plan.lower_bound, 3)
+        self.assertEqual(plan.errors, [])
+
+    def test_groups_incompatible_payouts(self):
+        payouts = (self.payouts(2) + self.payouts(2, currencyCode='EUR') +
+                   self.payouts(2, preapprovalKey='PA-1') + self.payouts(2, feesPayer='SENDER'))
+        plan = PayoutPlanner().plan(payouts)
+
+        self.assertEqual(len(plan), 4)
+        self.assertEqual({(payment.currencyCode, payment.preapprovalKey, payment.feesPayer) for payment in plan},
+                         {('USD', None, 'EACHRECEIVER'), ('EUR', None, 'EACHRECEIVER'),
+                          ('USD', 'PA-1', 'EACHRECEIVER'), ('USD', None, 'SENDER')})
+
+    def test_merges_duplicate_receivers(self):
+        plan = PayoutPlanner().plan(self.payouts(3) + self.payouts(2, amount='5.00'))
+        amounts = {receiver.email: receiver.amount for receiver in plan.payments[0].receiverList.receivers}
+
+        self.assertEqual(plan.receivers, 3)
+        self.assertEqual(amounts['seller0@gmail.com'], Decimal('15.00'))
+        self.assertEqual(plan.payments[0].amount, Decimal('40.00'))
+
+    def test_respects_max_amount_per_payment(self):
+        limits = {'PA-1': PreapprovalLimits(maxAmountPerPayment=Decimal('25.00'))}
+        plan = PayoutPlanner(limits).plan(self.payouts(6, preapprovalKey='PA-1'))
+
+        self.assertEqual([payment.amount for payment in plan], [Decimal('20.00')] * 3)
+        self.assertEqual(plan.errors, [])
+
+    def test_reports_exceeded_preapproval_limits(self):
+        limits = {'PA-1': PreapprovalLimits(maxAmountPerPayment=Decimal('5.00'), maxNumberOfPayments=1,
+                                            maxTotalAmountOfAllPayments=Decimal('15.00'))}
+        plan = PayoutPlanner(limits).plan(self.payouts(2, preapprovalKey='PA-1'))
+
+        self.assertEqual(plan.errors, [
+            '10.00 USD to seller0@gmail.com exceeds maxAmountPerPayment 5.00 of preapproval PA-1',
+            '10.00 USD to seller1@gmail.com exceeds maxAmountPerPayment 5.00 of preapproval PA-1',
+            'preapproval PA-1 allows 1 more payments, plan needs 2',
+            'preapproval PA-1 allows 15.00 more, plan needs 20.00',
+        ])
+
+        with self.assertRaises(ValidationException):
+            plan.execute(Pay(self.credentials, debug=True))
+
+    def test_limits_apply_across_groups_of_a_preapproval(self):
+        limits = {'PA-1': PreapprovalLimits(maxNumberOfPayments=1, maxTotalAmountOfAllPayments=Decimal('100.00'))}
+        payouts = (self.payouts(1, amount='80.00', preapprovalKey='PA-1') +
+                   [Payout(email='seller9@gmail.com', amount=Decimal('80.00'), currencyCode='USD',
+                           preapprovalKey='PA-1', feesPayer='SENDER')])
+        plan = PayoutPlanner(limits).plan(payouts)
+
+        self.assertEqual(len(plan.payments), 2)
+        self.assertEqual(plan.errors, [
+            'preapproval PA-1 allows 1 more payments, plan needs 2',
+            'preapproval PA-1 allows 100.00 more, plan needs 160.00',
+        ])
+
+    def test_chain_is_paid_on_its_own(self):
+        chain = [
+            Payout(email='shop@gmail.com', amount=Decimal('100.00'), currencyCode='USD', primary=True, chain='o-1'),
+            Payout(email='seller0@gmail.com', amount=Decimal('90.00'), currencyCode='USD', primary=False,
+                   chain='o-1'),
+        ]
+        plan = PayoutPlanner().plan(chain + self.payouts(2))
+        chained = [payment for payment in plan if payment.amount == Decimal('100.00')][0]
+
+        self.assertEqual(len(plan), 2)
+        self.assertEqual([receiver.primary for receiver in chained.receiverList.receivers], [True, False])
+
+    def test_chain_needs_one_primary(self):
+        chain = [Payout(email='shop{}@gmail.com'.format(index), amount=Decimal('1.00'), currencyCode='USD',
+                        primary=True, chain='o-1') for index in range(2)]
+        plan = PayoutPlanner().plan(chain)
+
+        self.assertEqual(plan.errors, ['chain o-1 needs exactly one primary receiver, has 2'])
+        self.assertEqual(len(plan), 0)
+
+    def test_describe(self):
+        description = PayoutPlanner().plan(self.payouts(2)).describe()
+
+        self.assertEqual(description.splitlines(), [
+            '2 payouts, 2 receivers after merging, 1 Pay requests (at least 1 needed)',
+            '   1. 20.00 USD from - via - (EACHRECEIVER): seller0@gmail.com 10.00, seller1@gmail.com 10.00',
+        ])
+
+    def test_limits_from_details(self):
+        Details = namedtuple('Details', ['maxAmountPerPayment', 'maxNumberOfPayments', 'maxTotalAmountOfAllPayments',
+                                         'curPayments', 'curPaymentsAmount'])
+        limits = limits_from_details(Details('50.00', '10', '200.00', '4', '120.00'))
+
+        self.assertEqual(limits, PreapprovalLimits(Decimal('50.00'), 6, Decimal('80.00')))
+
+    def test_execute(self):
+        response = MagicMock()
+        response.json.return_value = {
+            'payKey': 'AP-1',
+            'paymentExecStatus': 'COMPLETED',
+            'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'}
+        }
+        session = MagicMock()
+        session.post.return_value = response
+        pay = Pay(self.credentials, debug=True, session=session)
+
+        results = PayoutPlanner().plan(self.payouts(7)).execute(pay, returnUrl='http://return.url',
+                                                                   cancelUrl='http://cancel.url')
+
+        self.assertEqual([resp.payKey for payment, resp in results], ['AP-1', 'AP-1'])
+        self.assertEqual(session.post.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
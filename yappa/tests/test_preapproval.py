@@ -26,6 +26,13 @@ class PreApprovalTestCase(unittest.TestCase):
 
         self.preapproval_key = 'PA-11111111111111111'
 
+        self.request_kwargs = {
+            'startingDate': self.starting_date,
+            'currencyCode': self.currency,
+            'returnUrl': self.return_url,
+            'cancelUrl': self.cancel_url,
+        }
+
     def tearDown(self):
         pass
 
@@ -86,7 +93,7 @@ class PreApprovalTestCase(unittest.TestCase):
         mock_post.return_value.json.return_value = mock_response
 
         preapproval = PreApproval(self.credentials, debug=True)
-        resp = preapproval.request()
+        resp = preapproval.request(**self.request_kwargs)
 
         self.assertEquals(resp.ack, 'Success')
         self.assertEquals(resp.preapprovalKey, self.preapproval_key)
@@ -115,7 +122,7 @@ class PreApprovalTestCase(unittest.TestCase):
         mock_post.return_value.json.return_value = mock_response
 
         preapproval = PreApproval(self.credentials, debug=True)
-        resp = preapproval.request()
+        resp = preapproval.request(**self.request_kwargs)
 
         self.assertEquals(resp.ack, 'Failure')
         self.assertEquals(resp.errorId, '580001')
@@ -144,7 +151,7 @@ class PreApprovalTestCase(unittest.TestCase):
         mock_post.return_value.json.return_value = mock_response
 
         preapproval = PreApproval(self.credentials, debug=True)
-        resp = preapproval.request()
+        resp = preapproval.request(**self.request_kwargs)
 
         self.assertEquals(resp.ack, 'Failure')
         self.assertEquals(resp.errorId, '580024')
@@ -210,7 +217,7 @@ class PreApprovalTestCase(unittest.TestCase):
         mock_post.return_value.json.return_value = mock_response
 
         preapproval_detials = PreApprovalDetails(self.credentials, debug=True)
-        resp = preapproval_detials.request()
+        resp = preapproval_detials.request(preapprovalKey=self.preapproval_key)
 
         self.assertEquals(resp.ack, 'Success')
         self.assertEquals(resp.approved, 'false')
@@ -248,7 +255,7 @@ class PreApprovalTestCase(unittest.TestCase):
         mock_post.return_value.json.return_value = mock_response
 
         preapproval_detials = PreApprovalDetails(self.credentials, debug=True)
-        resp = preapproval_detials.request()
+        resp = preapproval_detials.request(preapprovalKey=self.preapproval_key)
 
         self.assertEquals(resp.ack, 'Success')
         self.assertEquals(resp.approved, 'true')
@@ -279,7 +286,7 @@ class PreApprovalTestCase(unittest.TestCase):
         mock_post.return_value.json.return_value = mock_response
 
         preapproval_detials = PreApprovalDetails(self.credentials, debug=True)
-        resp = preapproval_detials.request()
+        resp = preapproval_detials.request(preapprovalKey=self.preapproval_key)
 
         self.assertEquals(resp.ack, 'Failure')
         self.assertEquals(resp.errorId, '580022')
@@ -0,0 +1,106 @@
+import csv
+import os
+import tempfile
+import unittest
+from collections import namedtuple
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+from yappa.reconcile import Reconciler, flatten_payment, MISSING_LOCAL, MISSING_REMOTE, AMOUNT_DIFFERS, \
+    STATUS_DIFFERS
+
+
+def payment(pay_key, status, *receivers, tracking_id=None):
+    return {
+        'payKey': pay_key,
+        'trackingId': tracking_id,
+        'paymentExecStatus': status,
+        'paymentInfoList': [{'receiver': {'email': email, 'amount': amount}} for email, amount in receivers],
+    }
+
+
+class ReconcileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.report_path = os.path.join(self.tmp_dir.name, 'report.csv')
+
+        self.remote = [
+            payment('AP-1', 'COMPLETED', ('a@gmail.com', '10.00'), ('b@gmail.com', '5.00')),
+            payment('AP-2', 'COMPLETED', ('c@gmail.com', '7.50')),
+            payment('AP-3', 'PROCESSING', ('d@gmail.com', '3.00')),
+            payment('AP-4', 'COMPLETED', ('e@gmail.com', '1.00')),
+        ]
+        self.local = [
+            {'payKey': 'AP-1', 'email': 'A@gmail.com', 'amount': Decimal('10'), 'status': 'completed'},
+            {'payKey': 'AP-1', 'email': 'b@gmail.com', 'amount': '5.00', 'status': 'COMPLETED'},
+            {'payKey': 'AP-2', 'email': 'c@gmail.com', 'amount': '8.00', 'status': 'COMPLETED'},
+            {'payKey': 'AP-3', 'email': 'd@gmail.com', 'amount': '3.00', 'status': 'COMPLETED'},
+            {'payKey': 'AP-9', 'email': 'z@gmail.com', 'amount': '2.00', 'status': 'COMPLETED'},
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_report(self):
+        with open(self.report_path, newline='') as report_file:
+            return sorted((row['kind'], row['key'], row['email']) for row in csv.DictReader(report_file))
+
+    def test_flatten_response_namedtuple(self):
+        ApiResponse = namedtuple('ApiResponse', ['ack', 'payKey', 'paymentExecStatus', 'paymentInfoList'])
+        resp = ApiResponse(ack='Success', payKey='AP-1', paymentExecStatus='COMPLETED',
+                           paymentInfoList=[{'receiver': {'email': 'A@gmail.com', 'amount': '6.00'}}])
+
+        self.assertEqual(flatten_payment(resp), [['AP-1', 'a@gmail.com', '6.00', 'COMPLETED']])
+
+    def test_classify_mismatches(self):
+        summary = Reconciler(partitions=4).run(self.local, self.remote, self.report_path)
+
+        self.assertEqual(summary.matched, 2)
+        self.assertEqual((summary.missingRemote, summary.missingLocal, summary.amountDiffers, summary.statusDiffers),
+                         (1, 1, 1, 1))
+        self.assertEqual(self.read_report(), [
+            (AMOUNT_DIFFERS, 'AP-2', 'c@gmail.com'),
+            (MISSING_LOCAL, 'AP-4', 'e@gmail.com'),
+            (MISSING_REMOTE, 'AP-9', 'z@gmail.com'),
+            (STATUS_DIFFERS, 'AP-3', 'd@gmail.com'),
+        ])
+
+    def test_match_on_tracking_id(self):
+        remote = [payment('AP-1', 'COMPLETED', ('a@gmail.com', '10.00'), tracking_id='order-1')]
+        local = [{'trackingId': 'order-1', 'email': 'a@gmail.com', 'amount': '10.00', 'status': 'COMPLETED'}]
+
+        summary = Reconciler(match_on='trackingId', partitions=2).run(local, remote, self.report_path)
+
+        self.assertEqual(summary.matched, 1)
+        self.assertEqual(self.read_report(), [])
+
+    def test_refresh_only_disputed_payments(self):
+        fresh = {
+            'AP-2': payment('AP-2', 'COMPLETED', ('c@gmail.com', '7.50')),
+            'AP-3': payment('AP-3', 'COMPLETED', ('d@gmail.com', '3.00')),
+            'AP-4': payment('AP-4', 'COMPLETED', ('e@gmail.com', '1.00')),
+        }
+
+        def request(payKey):
+            if payKey not in fresh:
+                return MagicMock(ack='Failure')
+
+            ApiResponse = namedtuple('ApiResponse', ['ack'] + list(fresh[payKey]))
+            return ApiResponse(ack='Success', **fresh[payKey])
+
+        details = MagicMock()
+        details.request.side_effect = request
+
+        summary = Reconciler(details=details, partitions=3, refresh_batch=2).run(self.local, self.remote,
+                                                                                  self.report_path)
+
+        looked_up = sorted(call[1]['payKey'] for call in details.request.call_args_list)
+
+        self.assertEqual(looked_up, ['AP-2', 'AP-3', 'AP-4', 'AP-9'])
+        self.assertEqual(summary.refreshed, 4)
+        self.assertEqual(summary.resolved, 1)   # AP-3 completed in the meantime
+        self.assertEqual(self.read_report(), [
+            (AMOUNT_DIFFERS, 'AP-2', 'c@gmail.com'),
+            (MISSING_LOCAL, 'AP-4', 'e@gmail.com'),
+            (MISSING_REMOTE, 'AP-9', 'z@gmail.com'),
+        ])
@@ -0,0 +1,113 @@
+import os
+import time
+import unittest
+from decimal import Decimal
+
+from yappa.models import Receiver, ReceiverList
+from yappa.runner import ShardedPayoutRunner, shard_by_receiver
+from yappa.stub import StubServer
+
+
+class _ExitOnArrival(object):
+    # Ends the worker process that unpickles it, like a worker crashing on its first item
+    def __reduce__(self):
+        return os._exit, (3,)
+
+
+class ShardedPayoutRunnerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+        self.server = StubServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def build_items(self, count, senders=3):
+        return [('payout-{}'.format(i), {
+            'currencyCode': 'USD',
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+            'senderEmail': 'sender{}@gmail.com'.format(i % senders),
+            'receiverList': ReceiverList([Receiver(email='receiver{}@gmail.com'.format(i), amount=Decimal('10.00'))]),
+        }) for i in range(count)]
+
+    def test_every_item_is_paid_once(self):
+        runner = ShardedPayoutRunner(self.credentials, processes=2, threads=2, endpoint=self.server.endpoint)
+        results = list(runner.run(self.build_items(30)))
+
+        self.assertEqual(sorted(r.itemId for r in results), sorted('payout-{}'.format(i) for i in range(30)))
+        self.assertTrue(all(r.ack == 'Success' and r.payKey for r in results))
+        self.assertEqual(len({r.payKey for r in results}), 30)
+        self.assertEqual(runner.metrics.items, 30)
+        self.assertEqual(runner.metrics.succeeded, 30)
+        self.assertEqual(sum(runner.metrics.perWorker), 30)
+
+    def test_items_of_one_sender_share_a_shard(self):
+        runner = ShardedPayoutRunner(self.credentials, processes=4)
+        items = self.build_items(12)
+
+        shards = {}
+        for item_id, pay_kwargs in items:
+            shards.setdefault(pay_kwargs['senderEmail'], set()).add(runner.shard_for(pay_kwargs))
+
+        self.assertTrue(all(len(shard) == 1 for shard in shards.values()))
+
+        runner = ShardedPayoutRunner(self.credentials, processes=4, shard_key=shard_by_receiver)
+        self.assertEqual(runner.shard_for(items[0][1]), runner.shard_for(items[0][1]))
+
+    def test_invalid_items_are_reported(self):
+        items = self.build_items(2)
+        items[1][1]['currencyCode'] = 'XYZ'
+
+        runner = ShardedPayoutRunner(self.credentials, processes=1, endpoint=self.server.endpoint)
+        results = {r.itemId: r for r in runner.run(items)}
+
+        self.assertEqual(results['payout-0'].ack, 'Success')
+        self.assertEqual(results['payout-1'].ack, 'Error')
+        self.assertTrue(results['payout-1'].message.startswith('currencyCode needs to be one of'))
+        self.assertEqual(runner.metrics.failed, 1)
+
+    def test_stop_cancels_queued_items(self):
+        runner = ShardedPayoutRunner(self.credentials, processes=1, threads=1, endpoint=self.server.endpoint)
+        results = []
+
+        for result in runner.run(self.build_items(50)):
+            results.append(result)
+
+            if len(results) == 1:
+                runner.stop()
+
+        paid = [r for r in results if r.ack == 'Success']
+        cancelled = [r for r in results if r.ack == 'Cancelled']
+
+        self.assertEqual(len(results), len(paid) + len(cancelled))
+        self.assertEqual(len({r.itemId for r in results}), len(results))
+        self.assertLess(len(paid), 50)
+
+    def test_dead_worker_does_not_hang_the_run(self):
+        runner = ShardedPayoutRunner(self.credentials, processes=2, threads=1, queue_size=2,
+                                     endpoint=self.server.endpoint)
+        items = self.build_items(60, senders=4)
+        doomed = runner.shard_for(items[0][1])
+        lost = sum(1 for _, pay_kwargs in items if runner.shard_for(pay_kwargs) == doomed)
+        self.assertTrue(0 < lost < 60)
+        items[0][1]['memo'] = _ExitOnArrival()
+
+        started = time.monotonic()
+        results = list(runner.run(items))
+
+        self.assertLess(time.monotonic() - started, 15)
+        self.assertEqual(sorted(r.itemId for r in results), sorted(item_id for item_id, _ in items))
+
+        for (item_id, pay_kwargs), result in zip(items, sorted(results, key=lambda r: int(r.itemId.split('-')[1]))):
+            expected = 'Unknown' if runner.shard_for(pay_kwargs) == doomed else 'Success'
+            self.assertEqual(result.ack, expected, item_id)
+
+        self.assertEqual(runner.metrics.unknown, lost)
+        self.assertEqual(runner.metrics.succeeded, 60 - lost)
@@ -0,0 +1,118 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from yappa.api import PreApprovalDetails
+from yappa.exceptions import AdaptiveApiException
+from yappa.scheduler import Lane, RequestScheduler
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+    def tearDown(self):
+        pass
+
+    def build_session(self):
+        response = MagicMock()
+        response.json.return_value = {
+            'approved': 'true',
+            'status': 'ACTIVE',
+            'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'}
+        }
+        session = MagicMock()
+        session.post.return_value = response
+        return session
+
+    def test_weighted_fair_queuing(self):
+        scheduler = RequestScheduler([Lane('interactive', weight=3), Lane('bulk', weight=1)], concurrency=1)
+        scheduler.acquire('bulk')
+        waiters = [scheduler._enqueue('bulk') for _ in range(8)] + [scheduler._enqueue('interactive')
+                                                                    for _ in range(8)]
+        order = []
+
+        for _ in range(8):
+            lane = 'bulk' if not order else order[-1]
+            scheduler.release(lane)
+            granted = [waiter for waiter in waiters if waiter.granted and waiter not in order]
+            order.append(granted[0].lane.lane.name)
+            waiters.remove(granted[0])
+
+        self.assertEqual(order.count('interactive'), 6)
+        self.assertEqual(order.count('bulk'), 2)
+
+    def test_reserved_slots(self):
+        scheduler = RequestScheduler([Lane('interactive', reserved=1), Lane('bulk')], concurrency=3)
+        scheduler.acquire('bulk')
+        scheduler.acquire('bulk')
+
+        with self.assertRaises(AdaptiveApiException):
+            scheduler.acquire('bulk', timeout=0.05)
+
+        scheduler.acquire('interactive', timeout=0.05)
+        stats = scheduler.stats()
+
+        self.assertEqual((stats['bulk'].running, stats['interactive'].running), (2, 1))
+        self.assertEqual(stats['bulk'].queued, 0)
+
+    def test_reservations_need_room(self):
+        with self.assertRaises(AdaptiveApiException):
+            RequestScheduler([Lane('interactive', reserved=2)], concurrency=2)
+
+    def test_rate_budget_is_shared(self):
+        scheduler = RequestScheduler([Lane('interactive'), Lane('bulk')], concurrency=10, rate=50, burst=1)
+        started = time.monotonic()
+
+        for lane in ['interactive', 'bulk'] * 3:
+            with scheduler.slot(lane):
+                pass
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_unknown_lane(self):
+        with self.assertRaises(AdaptiveApiException):
+            RequestScheduler().acquire('express')
+
+    def test_async_slot_and_cancellation(self):
+        scheduler = RequestScheduler([Lane('interactive'), Lane('bulk')], concurrency=1)
+
+        async def run():
+            async with scheduler.aslot('bulk'):
+                waiting = asyncio.ensure_future(scheduler.aacquire('interactive'))
+                await asyncio.sleep(0.01)
+                self.assertEqual(scheduler.stats()['interactive'].queued, 1)
+                waiting.cancel()
+
+                with self.assertRaises(asyncio.CancelledError):
+                    await waiting
+
+            async with scheduler.aslot('interactive'):
+                return scheduler.stats()
+
+        stats = asyncio.run(run())
+        self.assertEqual((stats['interactive'].queued, stats['interactive'].running), (0, 1))
+
+    def test_operations_take_slots(self):
+        scheduler = RequestScheduler()
+        details = PreApprovalDetails(self.credentials, debug=True, session=self.build_session(), scheduler=scheduler,
+                                     lane='bulk')
+
+        details.request(preapprovalKey='PA-1')
+        asyncio.run(details.arequest(preapprovalKey='PA-2'))
+        stats = scheduler.stats()
+
+        self.assertEqual(stats['bulk'].dispatched, 2)
+        self.assertEqual(stats['bulk'].running, 0)
+        self.assertEqual(stats['interactive'].dispatched, 0)
+        self.assertIsNotNone(stats['bulk'].waitP95)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from yappa.api import Pay, PreApproval, PreApprovalDetails
+from yappa.exceptions import ValidationException
+from yappa.models import Receiver, ReceiverList
+from yappa.schema import Schema, Field
+
+
+class SchemaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.receiver_list = ReceiverList([Receiver(email='receiver1@gmail.com', amount=Decimal('10.00'))])
+        self.pay_kwargs = {
+            'currencyCode': 'USD',
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+            'receiverList': self.receiver_list,
+        }
+
+    def tearDown(self):
+        pass
+
+    def test_unset_fields_are_dropped(self):
+        payload = PreApproval.schema.build({
+            'startingDate': '2016-05-28T00:33:00+08:00',
+            'currencyCode': 'USD',
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+            'maxNumberOfPayments': None,
+        })
+
+        self.assertEqual(payload, {
+            'startingDate': '2016-05-28T00:33:00+08:00',
+            'currencyCode': 'USD',
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+        })
+
+    def test_all_errors_are_reported_at_once(self):
+        with self.assertRaises(ValidationException) as context:
+            PreApproval.schema.build({
+                'currencyCode': 'XYZ',
+                'returnUrl': 'http://return.url',
+                'maxAmountPerPayment': 10,
+                'maxNumberOfPayments': True,
+                'maxTotalAmountOfAllPayments': Decimal('0'),
+            })
+
+        self.assertEqual(context.exception.errors, [
+            'startingDate is required',
+            'cancelUrl is required',
+            'currencyCode needs to be one of AUD, BRL, CAD, CHF, CZK, DKK, EUR, GBP, HKD, HUF, ILS, JPY, '
+            'MXN, MYR, NOK, NZD, PHP, PLN, SEK, SGD, THB, TWD, USD',
+            'maxAmountPerPayment needs to be instance of Decimal',
+            'maxNumberOfPayments needs to be instance of int',
+            'maxTotalAmountOfAllPayments needs to be at least 0.01',
+        ])
+
+    def test_cross_field_check(self):
+        errors = PreApproval.schema.validate({
+            'startingDate': '2016-05-28T00:33:00+08:00',
+            'currencyCode': 'USD',
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+            'maxAmountPerPayment': Decimal('100'),
+            'maxTotalAmountOfAllPayments': Decimal('50'),
+        })
+
+        self.assertEqual(errors, ['maxAmountPerPayment can not exceed maxTotalAmountOfAllPayments'])
+
+    def test_datetime_is_sent_as_iso_string(self):
+        starting_date = datetime(2016, 5, 28, 0, 33, tzinfo=timezone.utc)
+
+        payload = PreApproval.schema.build({
+            'startingDate': starting_date,
+            'currencyCode': 'USD',
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+        })
+
+        self.assertEqual(payload['startingDate'], '2016-05-28T00:33:00+00:00')
+
+    def test_preapproval_details_requires_key(self):
+        self.assertEqual(PreApprovalDetails.schema.validate({}), ['preapprovalKey is required'])
+
+    def test_pay_defaults_and_blank_memo(self):
+        payload = Pay.schema.build(dict(self.pay_kwargs, memo='   '))
+
+        self.assertEqual(payload, {
+            'actionType': 'PAY',
+            'feesPayer': 'EACHRECEIVER',
+            'currencyCode': 'USD',
+            'receiverList': {'receiver': [{'email': 'receiver1@gmail.com', 'amount': '10.00'}]},
+            'returnUrl': 'http://return.url',
+            'cancelUrl': 'http://cancel.url',
+        })
+
+    def test_pay_enums_and_receivers(self):
+        receiver_list = ReceiverList([
+            Receiver(email='receiver1@gmail.com', amount=Decimal('10.00'), primary=True),
+            Receiver(email='receiver2@gmail.com', amount=Decimal('0'), primary=True),
+        ])
+
+        errors = Pay.schema.validate(dict(self.pay_kwargs, feesPayer='NOBODY', actionType='REFUND',
+                                          receiverList=receiver_list))
+
+        self.assertEqual(errors, [
+            'actionType needs to be one of CREATE, PAY, PAY_PRIMARY',
+            'feesPayer needs to be one of EACHRECEIVER, PRIMARYRECEIVER, SECONDARYONLY, SENDER',
+            'amount of receiver receiver2@gmail.com needs to be greater than 0',
+            'receiverList can have only one primary receiver',
+        ])
+
+    def test_pay_receiver_list_type(self):
+        errors = Pay.schema.validate(dict(self.pay_kwargs, receiverList=[]))
+
+        self.assertEqual(errors, ['receiverList needs to be instance of ReceiverList'])
+
+    def test_custom_schema(self):
+        schema = Schema({
+            'count': Field(types=int, max_value=3, default=1),
+        })
+
+        self.assertEqual(schema.build({}), {'count': 1})
+        self.assertEqual(schema.validate({'count': 4}), ['count needs to be at most 3'])
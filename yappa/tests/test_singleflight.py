@@ -0,0 +1,210 @@
+import asyncio
+import os
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from yappa.api import Pay, PreApproval, PreApprovalDetails
+from yappa.exceptions import AdaptiveApiException
+from yappa.singleflight import SingleFlight, FileSingleFlight
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+        self.preapproval_key = 'PA-11111111111111111'
+
+    def tearDown(self):
+        pass
+
+    def build_slow_session(self, delay=0.1):
+        def post(url, data, headers):
+            time.sleep(delay)
+            response = MagicMock()
+            response.json.return_value = {
+                'approved': 'true',
+                'status': 'ACTIVE',
+                'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'}
+            }
+            return response
+
+        session = MagicMock()
+        session.post.side_effect = post
+        return session
+
+    def run_in_threads(self, fn, count):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(fn())) for _ in range(count)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        return results
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'result'
+
+        results = self.run_in_threads(lambda: flight.do('key', work), 5)
+
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.coalesced, 4)
+
+    def test_sequential_calls_are_not_coalesced(self):
+        flight = SingleFlight()
+        calls = []
+
+        flight.do('key', lambda: calls.append(1))
+        flight.do('key', lambda: calls.append(1))
+
+        self.assertEqual(len(calls), 2)
+
+    def test_error_is_shared_with_followers(self):
+        flight = SingleFlight()
+        errors = []
+
+        def work():
+            time.sleep(0.1)
+            raise ValueError('boom')
+
+        def call():
+            try:
+                flight.do('key', work)
+            except ValueError as e:
+                errors.append(e)
+
+        self.run_in_threads(call, 3)
+
+        self.assertEqual(len(errors), 3)
+
+    def test_asyncio_tasks_share_one_execution(self):
+        flight = SingleFlight()
+        calls = []
+
+        def work():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'result'
+
+        async def main():
+            return await asyncio.gather(*[flight.do_async('key', work) for _ in range(5)])
+
+        self.assertEqual(asyncio.run(main()), ['result'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_preapproval_details_requests_are_coalesced(self):
+        session = self.build_slow_session()
+        details = PreApprovalDetails(self.credentials, debug=True, session=session, single_flight=SingleFlight())
+
+        results = self.run_in_threads(lambda: details.request(preapprovalKey=self.preapproval_key), 4)
+
+        self.assertEqual(session.post.call_count, 1)
+        self.assertEqual([r.approved for r in results], ['true'] * 4)
+
+    def test_different_payloads_are_not_coalesced(self):
+        session = self.build_slow_session()
+        details = PreApprovalDetails(self.credentials, debug=True, session=session, single_flight=SingleFlight())
+
+        self.run_in_threads(lambda: details.request(preapprovalKey=str(threading.get_ident())), 3)
+
+        self.assertEqual(session.post.call_count, 3)
+
+    def test_arequest_is_coalesced(self):
+        session = self.build_slow_session()
+        details = PreApprovalDetails(self.credentials, debug=True, session=session, single_flight=SingleFlight())
+
+        async def main():
+            return await asyncio.gather(*[details.arequest(preapprovalKey=self.preapproval_key) for _ in range(3)])
+
+        results = asyncio.run(main())
+
+        self.assertEqual(session.post.call_count, 1)
+        self.assertEqual([r.status for r in results], ['ACTIVE'] * 3)
+
+    def test_coalesced_calls_are_stored_once(self):
+        store = MagicMock()
+        details = PreApprovalDetails(self.credentials, debug=True, session=self.build_slow_session(),
+                                     single_flight=SingleFlight(), store=store)
+
+        self.run_in_threads(lambda: details.request(preapprovalKey=self.preapproval_key), 4)
+        self.assertEqual(store.record.call_count, 1)
+
+        async def main():
+            return await asyncio.gather(*[details.arequest(preapprovalKey=self.preapproval_key) for _ in range(3)])
+
+        asyncio.run(main())
+        self.assertEqual(store.record.call_count, 2)
+
+    def test_mutating_operations_refuse_single_flight(self):
+        for operation in (Pay, PreApproval):
+            with self.assertRaises(AdaptiveApiException) as context:
+                operation(self.credentials, debug=True, single_flight=SingleFlight())
+
+            self.assertEqual(context.exception.args[0],
+                             'single flight can only be used with read-only operations, not {}'.
+                             format(operation.OPERATION))
+
+    def test_file_single_flight_across_instances(self):
+        session = self.build_slow_session()
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Separate instances behave like separate processes sharing the lock directory
+            clients = [PreApprovalDetails(self.credentials, debug=True, session=session,
+                                          single_flight=FileSingleFlight(directory)) for _ in range(3)]
+            index = iter(range(3))
+
+            results = self.run_in_threads(
+                lambda: clients[next(index)].request(preapprovalKey=self.preapproval_key), 3)
+
+        self.assertEqual(session.post.call_count, 1)
+        self.assertEqual([r.ack for r in results], ['Success'] * 3)
+
+    def test_file_single_flight_files_are_private_and_expire(self):
+        session = self.build_slow_session(delay=0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            flight = FileSingleFlight(directory, max_age=60)
+            details = PreApprovalDetails(self.credentials, debug=True, session=session, single_flight=flight)
+            details.request(preapprovalKey=self.preapproval_key)
+            names = sorted(os.listdir(directory))
+
+            self.assertEqual([os.path.splitext(name)[1] for name in names], ['.json', '.lock'])
+
+            for name in names:
+                self.assertEqual(stat.S_IMODE(os.stat(os.path.join(directory, name)).st_mode), 0o600)
+
+            self.assertEqual(flight.sweep(), 0)
+            self.assertEqual(flight.sweep(now=time.time() + 61), 2)
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_file_single_flight_keeps_held_locks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            flight = FileSingleFlight(directory, max_age=0)
+            lock_path, _ = flight._paths('key')
+            fd, _ = flight._lock_file(lock_path)
+
+            try:
+                self.assertEqual(flight.sweep(now=time.time() + 1), 0)
+                self.assertTrue(os.path.exists(lock_path))
+            finally:
+                os.close(fd)
+
+            self.assertEqual(flight.sweep(now=time.time() + 1), 1)
@@ -0,0 +1,104 @@
+import unittest
+from decimal import Decimal
+
+from yappa.exceptions import InvalidReceiverException
+from yappa.split import SplitCalculator, CommissionRule
+
+
+class SplitCalculatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rule = CommissionRule(primaryEmail='market@gmail.com', secondaryEmail='seller@gmail.com',
+                                   rate=Decimal('0.15'))
+
+    def tearDown(self):
+        pass
+
+    def test_split_each_receiver(self):
+        calculator = SplitCalculator('USD')
+        result = calculator.calculate([Decimal('100.00'), Decimal('10.05'), Decimal('0.10')], self.rule)
+
+        self.assertEqual(list(result.totals), [10000, 1005, 10])
+        self.assertEqual(list(result.commissions), [1500, 151, 2])    # 150.75 rounds half to even up to 151
+        self.assertEqual(list(result.secondary), [8500, 854, 8])
+        self.assertEqual([p + s for p, s in zip(result.primaryFees, result.secondaryFees)], [320, 59, 30])
+        self.assertEqual(list(result.senderFees), [0, 0, 0])
+
+    def test_ties_round_to_even(self):
+        result = SplitCalculator('USD').calculate([Decimal('0.10'), Decimal('0.30'), Decimal('0.50')], self.rule)
+
+        self.assertEqual(list(result.commissions), [2, 4, 8])  # 1.5, 4.5 and 7.5 cents
+
+    def test_parts_always_add_up(self):
+        calculator = SplitCalculator('USD')
+        totals = [Decimal(cents).scaleb(-2) for cents in range(1, 5000, 7)]
+        result = calculator.calculate(totals, CommissionRule('a@gmail.com', 'b@gmail.com', Decimal('0.333')))
+
+        for index in range(len(result)):
+            self.assertEqual(result.commissions[index] + result.secondary[index], result.totals[index])
+
+        self.assertEqual(sum(result.to_decimal(t) for t in result.totals), sum(totals))
+
+    def test_fee_modes(self):
+        totals = [Decimal('100.00')]
+        expected = {
+            'SENDER': ([0], [0], [320]),
+            'PRIMARYRECEIVER': ([320], [0], [0]),
+            'SECONDARYONLY': ([0], [320], [0]),
+            'EACHRECEIVER': ([48], [272], [0]),
+        }
+
+        for fees_payer, (primary, secondary, sender) in expected.items():
+            result = SplitCalculator('USD', fees_payer=fees_payer).calculate(totals, self.rule)
+
+            self.assertEqual((list(result.primaryFees), list(result.secondaryFees), list(result.senderFees)),
+                             (primary, secondary, sender), fees_payer)
+
+    def test_zero_decimal_currency(self):
+        calculator = SplitCalculator('JPY', fee_fixed=Decimal('40'))
+        result = calculator.calculate([Decimal('1005')], self.rule)
+
+        self.assertEqual(list(result.commissions), [151])
+        self.assertEqual(result.receiver_list(0).to_json(), {
+            'receiver': [
+                {'email': 'market@gmail.com', 'amount': '1005', 'primary': 'true'},
+                {'email': 'seller@gmail.com', 'amount': '854', 'primary': 'false'},
+            ]
+        })
+
+        with self.assertRaises(InvalidReceiverException) as context:
+            calculator.calculate([Decimal('10.5')], self.rule)
+
+        self.assertEqual(context.exception.args[0], '10.5 has more decimals than JPY allows')
+
+    def test_receiver_lists_with_rule_per_order(self):
+        rules = [self.rule, CommissionRule('market@gmail.com', 'seller2@gmail.com', Decimal('1'))]
+        result = SplitCalculator('USD').calculate([Decimal('20.00'), Decimal('5.00')], rules)
+        receiver_lists = list(result.receiver_lists())
+
+        self.assertEqual(receiver_lists[0].to_json(), {
+            'receiver': [
+                {'email': 'market@gmail.com', 'amount': '20.00', 'primary': 'true'},
+                {'email': 'seller@gmail.com', 'amount': '17.00', 'primary': 'false'},
+            ]
+        })
+        self.assertEqual(receiver_lists[1].to_json(), {
+            'receiver': [{'email': 'market@gmail.com', 'amount': '5.00'}]
+        })
+        self.assertEqual(receiver_lists[0].validate(), [])
+
+    def test_minor_unit_input(self):
+        result = SplitCalculator('USD').calculate([2000], self.rule, minor_units=True)
+
+        self.assertEqual(list(result.secondary), [1700])
+
+    def test_invalid_rule(self):
+        calculator = SplitCalculator('USD')
+
+        with self.assertRaises(InvalidReceiverException):
+            calculator.calculate([Decimal('1.00')], CommissionRule('a@gmail.com', 'b@gmail.com', Decimal('1.5')))
+
+        with self.assertRaises(InvalidReceiverException):
+            calculator.calculate([Decimal('1.00'), Decimal('2.00')], [self.rule])
+
+        with self.assertRaises(InvalidReceiverException):
+            SplitCalculator('USD', fees_payer='NOBODY')
@@ -0,0 +1,124 @@
+import os
+import tempfile
+import time
+import unittest
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+from yappa.api import Pay, PaymentDetails, PreApprovalDetails
+from yappa.models import Receiver, ReceiverList
+from yappa.store import StateStore, extract_record
+
+
+class StoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = StateStore(os.path.join(self.tmp_dir.name, 'state.db'), batch_size=2)
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def build_session(self, response_json):
+        response = MagicMock()
+        response.json.return_value = response_json
+        session = MagicMock()
+        session.post.return_value = response
+        return session
+
+    def pay(self, pay_key, status, tracking_id):
+        session = self.build_session({
+            'payKey': pay_key,
+            'paymentExecStatus': status,
+            'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'}
+        })
+        pay = Pay(self.credentials, debug=True, session=session, store=self.store)
+        receivers = ReceiverList([Receiver(email='seller@gmail.com', amount=Decimal('10.00'), primary=True),
+                                  Receiver(email='partner@gmail.com', amount=Decimal('2.50'), primary=False)])
+
+        return pay.request(currencyCode='USD', receiverList=receivers, senderEmail='buyer@gmail.com',
+                           returnUrl='http://return.url', cancelUrl='http://cancel.url', trackingId=tracking_id)
+
+    def test_extract_record(self):
+        record = extract_record('PreapprovalDetails', {'preapprovalKey': 'PA-1'}, {
+            'status': 'ACTIVE',
+            'senderEmail': 'buyer@gmail.com',
+            'responseEnvelope': {'ack': 'Success'}
+        }, 0)
+
+        self.assertEqual((record['ack'], record['preapproval_key'], record['sender_email'], record['status']),
+                         ('Success', 'PA-1', 'buyer@gmail.com', 'ACTIVE'))
+        self.assertEqual(record['receivers'], [])
+
+    def test_records_operations_with_indexed_fields(self):
+        self.pay('AP-1', 'COMPLETED', 'T-1')
+        self.pay('AP-2', 'CREATED', 'T-2')
+        self.store.flush()
+
+        self.assertEqual([row.payKey for row in self.store.find(senderEmail='buyer@gmail.com')], ['AP-1', 'AP-2'])
+        self.assertEqual([row.payKey for row in self.store.find(trackingId='T-2')], ['AP-2'])
+        self.assertEqual([row.payKey for row in self.store.find(receiverEmail='partner@gmail.com')], ['AP-1', 'AP-2'])
+        self.assertEqual([row.payKey for row in self.store.find(status='COMPLETED')], ['AP-1'])
+
+    def test_records_preapproval_details(self):
+        session = self.build_session({
+            'approved': 'true',
+            'status': 'ACTIVE',
+            'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'}
+        })
+        details = PreApprovalDetails(self.credentials, debug=True, session=session, store=self.store)
+        details.request(preapprovalKey='PA-1')
+        self.store.flush()
+
+        rows = self.store.find(preapprovalKey='PA-1')
+        self.assertEqual([(row.operation, row.status) for row in rows], [('PreapprovalDetails', 'ACTIVE')])
+
+    def test_pending_payments_older_than(self):
+        self.pay('AP-1', 'CREATED', 'T-1')
+        self.pay('AP-2', 'COMPLETED', 'T-2')
+        self.store.flush()
+
+        self.assertEqual(self.store.pending_payments(10), [])
+
+        pending = self.store.pending_payments(10, now=time.time() + 11 * 60)
+        self.assertEqual([payment.payKey for payment in pending], ['AP-1'])
+
+    def test_payment_state_follows_latest_status(self):
+        self.pay('AP-1', 'CREATED', 'T-1')
+        session = self.build_session({
+            'payKey': 'AP-1',
+            'status': 'COMPLETED',
+            'responseEnvelope': {'ack': 'Success', 'timestamp': '2016-05-29T04:09:05.377-07:00'}
+        })
+        PaymentDetails(self.credentials, debug=True, session=session, store=self.store).request(payKey='AP-1')
+        self.store.flush()
+
+        self.assertEqual(self.store.pending_payments(0, now=time.time() + 60), [])
+        self.assertEqual(len(self.store.find(payKey='AP-1')), 2)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        store = StateStore(os.path.join(self.tmp_dir.name, 'full.db'), max_queue=1)
+        store.close()   # No writer any more, so the queue stays full
+        store.record('Pay', {}, {'responseEnvelope': {'ack': 'Success'}})
+
+        started = time.monotonic()
+        store.record('Pay', {}, {'responseEnvelope': {'ack': 'Success'}})
+        store.record('Pay', {}, {'responseEnvelope': {'ack': 'Success'}})
+
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(store.dropped, 2)
+
+    def test_unknown_filter(self):
+        with self.assertRaises(ValueError):
+            self.store.find(amount='10.00')
+
+
+if __name__ == '__main__':
+    unittest.main()
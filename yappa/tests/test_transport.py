@@ -0,0 +1,87 @@
+import json
+import os
+import unittest
+
+from yappa.api import PreApprovalDetails
+from yappa.exceptions import AdaptiveApiException
+from yappa.stub import StubServer
+from yappa.transport import PooledSession
+
+
+class TransportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+        self.server = StubServer().start()
+        self.session = PooledSession(pool_size=4)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.stop()
+
+    def build_details(self):
+        return PreApprovalDetails(self.credentials, debug=True, session=self.session, endpoint=self.server.endpoint)
+
+    def test_connections_are_reused(self):
+        details = self.build_details()
+
+        for _ in range(3):
+            self.assertEqual(details.request(preapprovalKey='PA-1').ack, 'Success')
+
+        stats = self.session.stats()
+        self.assertEqual((stats.created, stats.requests, stats.reused, stats.idle, stats.busy), (1, 3, 2, 1, 0))
+
+    def test_prewarm_opens_idle_connections(self):
+        details = self.build_details()
+
+        self.assertEqual(details.prewarm(3), 3)
+        self.assertEqual(self.session.stats().idle, 3)
+
+        details.request(preapprovalKey='PA-1')
+        stats = self.session.stats()
+
+        self.assertEqual((stats.created, stats.requests, stats.reused), (3, 1, 1))
+
+    def test_prewarm_is_capped_by_pool_size(self):
+        self.assertEqual(self.session.prewarm(10, self.server.endpoint), 4)
+
+    def test_prewarm_needs_pooled_session(self):
+        details = PreApprovalDetails(self.credentials, debug=True)
+
+        with self.assertRaises(AdaptiveApiException):
+            details.prewarm(2)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_forked_child_builds_its_own_pool(self):
+        details = self.build_details()
+        details.request(preapprovalKey='PA-1')
+        read_end, write_end = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:    # Child: report and leave without running any cleanup
+            try:
+                before = self.session.stats()
+                details.request(preapprovalKey='PA-2')
+                after = self.session.stats()
+                os.write(write_end, json.dumps([before.created, before.rebuilds, after.created]).encode('utf-8'))
+            finally:
+                os._exit(0)
+
+        os.close(write_end)
+        os.waitpid(pid, 0)
+
+        with os.fdopen(read_end) as pipe:
+            created_before, rebuilds, created_after = json.loads(pipe.read())
+
+        self.assertEqual((created_before, rebuilds, created_after), (0, 1, 1))
+        self.assertEqual(self.session.stats().created, 1)
+        self.assertEqual(self.session.stats().rebuilds, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
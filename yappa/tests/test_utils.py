@@ -7,6 +7,7 @@ from decimal import Decimal
 
 from yappa.utils import current_local_time
 from yappa.utils import decimal_default
+from yappa.utils import percentile
 
 
 class UtilsTestCase(unittest.TestCase):
@@ -57,3 +58,14 @@ class UtilsTestCase(unittest.TestCase):
 
         result = json.dumps(product, default=decimal_default)
         self.assertEqual(result, '{"name": "Product 1"}')
+
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3, 6, 8, 7, 10, 9]
+
+        self.assertEqual(percentile(values, 50), 5)
+        self.assertEqual(percentile(values, 90), 9)
+        self.assertEqual(percentile(values, 100), 10)
+        self.assertEqual(percentile(values, 0), 1)
+
+    def test_percentile_of_empty_values(self):
+        self.assertIsNone(percentile([], 99))
@@ -0,0 +1,247 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import requests
+
+from yappa.api import Pay, PaymentDetails, PreApproval, PreApprovalDetails
+from yappa.models import Receiver, ReceiverList
+from yappa.stub import STUB_OPERATIONS, StubServer
+from yappa.transport import PooledSession
+from yappa.workflow import COMPLETED, FAILED, WorkflowEngine, dump_state, load_state, preapproval_pay_workflow
+
+
+class WorkflowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.credentials = {
+            'PAYPAL_USER_ID': 'fakeuserid',
+            'PAYPAL_PASSWORD': 'fakepassword',
+            'PAYPAL_SIGNATURE': '123456789',
+            'PAYPAL_APP_ID': 'APP-123456'
+        }
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'workflows.db')
+        self.polls = Counter()
+        self.payments = []
+        self.approve_after = 0
+        self.server = StubServer(operations={'PreapprovalDetails': self.preapproval_details,
+                                             'Pay': self.pay}).start()
+        self.session = PooledSession(pool_size=4)
+        self.engines = []
+
+    def tearDown(self):
+        for engine in self.engines:
+            engine.close()
+
+        self.session.close()
+        self.server.stop()
+        self.tmp_dir.cleanup()
+
+    def preapproval_details(self, payload):
+        self.polls[payload['preapprovalKey']] += 1
+        response = STUB_OPERATIONS['PreapprovalDetails'](payload)
+
+        if self.approve_after is None or self.polls[payload['preapprovalKey']] <= self.approve_after:
+            response['approved'] = 'false'
+
+        return response
+
+    def pay(self, payload):
+        self.payments.append(payload)
+        return STUB_OPERATIONS['Pay'](payload)
+
+    def build_engine(self, session=None, **kwargs):
+        options = {'debug': True, 'session': session or self.session, 'endpoint': self.server.endpoint}
+        workflow = preapproval_pay_workflow(PreApproval(self.credentials, **options),
+                                            PreApprovalDetails(self.credentials, **options),
+                                            Pay(self.credentials, **options),
+                                            PaymentDetails(self.credentials, **options),
+                                            poll_interval=0.01, approval_timeout=kwargs.pop('approval_timeout', None))
+        kwargs.setdefault('backoff', 0)
+        engine = WorkflowEngine(workflow, path=self.path, idle_interval=0.01, **kwargs)
+        self.engines.append(engine)
+        return engine
+
+    def build_state(self, payments=2):
+        receivers = ReceiverList([Receiver(email='seller@gmail.com', amount=Decimal('10.00'))])
+
+        return {
+            'preapproval': {
+                'startingDate': datetime(2030, 1, 1, tzinfo=timezone.utc),
+                'returnUrl': 'http://www.example.com/success/',
+                'cancelUrl': 'http://www.example.com/cancel/',
+                'currencyCode': 'USD',
+                'maxAmountPerPayment': Decimal('50.00'),
+            },
+            'payments': [{
+                'currencyCode': 'USD',
+                'returnUrl': 'http://www.example.com/success/',
+                'cancelUrl': 'http://www.example.com/cancel/',
+                'receiverList': receivers,
+            } for _ in range(payments)],
+        }
+
+    def test_flows_complete(self):
+        engine = self.build_engine()
+        ids = engine.start_many((None, self.build_state()) for _ in range(20))
+        asyncio.run(engine.run(until_done=True))
+
+        self.assertEqual(engine.counts(), {COMPLETED: 20})
+        self.assertEqual(engine.calls, 20 * 6)
+
+        instance = engine.get(ids[0])
+        self.assertEqual(len(instance.state['payKeys']), 2)
+        self.assertEqual(instance.state['confirmed'], 2)
+        self.assertTrue(instance.state['nextUrl'].endswith(instance.state['preapprovalKey']))
+
+    def test_approval_is_polled(self):
+        self.approve_after = 2
+        engine = self.build_engine()
+        instance_id = engine.start(self.build_state(payments=1))
+        asyncio.run(engine.run(until_done=True))
+
+        instance = engine.get(instance_id)
+        self.assertEqual(instance.status, COMPLETED)
+        self.assertEqual(self.polls[instance.state['preapprovalKey']], 3)
+
+    def test_approval_times_out(self):
+        self.approve_after = None
+        engine = self.build_engine(approval_timeout=0.05)
+        instance_id = engine.start(self.build_state())
+        asyncio.run(engine.run(until_done=True))
+
+        instance = engine.get(instance_id)
+        self.assertEqual((instance.status, instance.step), (FAILED, 'approval'))
+        self.assertIn('timed out', instance.error)
+        self.assertEqual(self.payments, [])
+
+    def test_resumes_after_restart(self):
+        engine = self.build_engine()
+        instance_id = engine.start(self.build_state())
+        asyncio.run(engine.run_once())
+        preapproval_key = engine.get(instance_id).state['preapprovalKey']
+        engine.close()
+        self.engines.remove(engine)
+
+        engine = self.build_engine()
+        self.assertEqual(engine.counts(), {'approval': 1})
+        asyncio.run(engine.run(until_done=True))
+
+        instance = engine.get(instance_id)
+        self.assertEqual((instance.status, instance.state['preapprovalKey']), (COMPLETED, preapproval_key))
+
+    def test_payments_are_tracked_and_use_the_preapproval(self):
+        engine = self.build_engine()
+        instance_id = engine.start(dict(self.build_state(), preapprovalKey='PA-EXISTING'), instance_id='order-1')
+        asyncio.run(engine.run(until_done=True))
+
+        self.assertEqual(engine.get(instance_id).status, COMPLETED)
+        self.assertEqual([payment['trackingId'] for payment in self.payments], ['order-1-0', 'order-1-1'])
+        self.assertEqual({payment['preapprovalKey'] for payment in self.payments}, {'PA-EXISTING'})
+        self.assertEqual(engine.calls, 5)
+
+    def test_network_errors_are_retried(self):
+        session = MagicMock()
+        session.post.side_effect = requests.ConnectionError('connection refused')
+        engine = self.build_engine(session=session, retries=2)
+        instance_id = engine.start(self.build_state())
+        asyncio.run(engine.run(until_done=True))
+
+        instance = engine.get(instance_id)
+        self.assertEqual((instance.status, instance.attempts), (FAILED, 3))
+        self.assertIn('connection refused', instance.error)
+        self.assertEqual(engine.find(FAILED)[0].id, instance_id)
+
+    @staticmethod
+    def failure(error_id, message):
+        return {
+            'responseEnvelope': {'ack': 'Failure', 'timestamp': '2016-05-29T04:09:05.377-07:00'},
+            'error': [{'errorId': error_id, 'message': message}],
+        }
+
+    def test_failure_response_fails_the_instance(self):
+        self.server.operations['Pay'] = lambda payload: self.failure('579024', 'preapproval has expired')
+        self.server.operations['PaymentDetails'] = lambda payload: self.failure('580022', 'unknown trackingId')
+        engine = self.build_engine()
+        instance_id = engine.start(self.build_state())
+        asyncio.run(engine.run(until_done=True))
+
+        instance = engine.get(instance_id)
+        self.assertEqual((instance.status, instance.step, instance.error), (FAILED, 'pay', 'preapproval has expired'))
+
+    def test_payment_made_before_a_restart_is_looked_up(self):
+        lookups = []
+
+        def pay(payload):
+            # The first payment went out before the process stopped, its answer was never written
+            if payload['trackingId'] == 'order-1-0':
+                return self.failure('579017', 'trackingId order-1-0 is already used')
+
+            return STUB_OPERATIONS['Pay'](payload)
+
+        def payment_details(payload):
+            lookups.append(payload.get('trackingId'))
+
+            if payload.get('trackingId') == 'order-1-0':
+                return dict(STUB_OPERATIONS['PaymentDetails'](payload), payKey='AP-MADE')
+
+            return STUB_OPERATIONS['PaymentDetails'](payload)
+
+        self.server.operations.update(Pay=pay, PaymentDetails=payment_details)
+        engine = self.build_engine()
+        instance_id = engine.start(dict(self.build_state(), preapprovalKey='PA-EXISTING'), instance_id='order-1')
+        asyncio.run(engine.run(until_done=True))
+
+        instance = engine.get(instance_id)
+        self.assertEqual(instance.status, COMPLETED)
+        self.assertEqual(instance.state['payKeys'][0], 'AP-MADE')
+        self.assertEqual(lookups[0], 'order-1-0')
+        self.assertEqual(engine.calls, 6)
+
+    def test_stuck_calls_time_out_and_are_retried(self):
+        stuck = []
+
+        def preapproval_details(payload):
+            if not stuck:
+                stuck.append(payload)
+                time.sleep(1)
+
+            return STUB_OPERATIONS['PreapprovalDetails'](payload)
+
+        self.server.operations['PreapprovalDetails'] = preapproval_details
+        engine = self.build_engine(call_timeout=0.2)
+        ids = engine.start_many((None, self.build_state(payments=1)) for _ in range(3))
+
+        async def two_passes():
+            started = time.monotonic()
+            await engine.run_once()
+            await engine.run_once()
+            return time.monotonic() - started
+
+        # The stuck call keeps its executor thread, but not the passes
+        self.assertLess(asyncio.run(two_passes()), 0.9)
+        instances = [engine.get(instance_id) for instance_id in ids]
+        self.assertEqual(sorted(instance.attempts for instance in instances), [0, 0, 1])
+        self.assertIn('timed out', max(instances, key=lambda instance: instance.attempts).error)
+
+        asyncio.run(engine.run(until_done=True))
+        self.assertEqual(engine.counts(), {COMPLETED: 3})
+
+    def test_state_round_trip(self):
+        state = self.build_state(payments=1)
+        loaded = load_state(dump_state(state))
+
+        self.assertEqual(loaded['preapproval'], state['preapproval'])
+        receiver = loaded['payments'][0]['receiverList'].receivers[0]
+        self.assertEqual((receiver.email, receiver.amount), ('seller@gmail.com', Decimal('10.00')))
+
+
+if __name__ == '__main__':
+    unittest.main()
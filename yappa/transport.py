@@ -0,0 +1,185 @@
+import os
+import threading
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .settings import Settings
+
+
+PoolStats = namedtuple('PoolStats', ['idle', 'busy', 'created', 'reused', 'requests', 'rebuilds'])
+
+_sessions = weakref.WeakSet()
+
+
+def _reset_after_fork():
+    for session in list(_sessions):
+        session._forked()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class PooledSession(object):
+    """
+    Keep-alive connection pool that every process builds for itself
+
+    Pass it as `session` to any operation. After a fork the child drops the pool it inherited,
+    without closing the sockets the parent still uses, and builds a new one on first use. Forks
+    are caught with os.register_at_fork, and a PID check on every call covers the rest.
+    """
+
+    def __init__(self, pool_size=10, pool_connections=2):
+        self.pool_size = pool_size
+        self.pool_connections = pool_connections
+        self.rebuilds = 0
+        self._reset()
+        _sessions.add(self)
+
+    def _reset(self):
+        # A fresh lock too, another thread may have held the old one when the process forked
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        self._busy = 0
+        self._prewarmed = 0
+
+    def _forked(self):
+        if self._pid is not None:
+            self.rebuilds += 1
+
+        self._reset()
+
+    @property
+    def session(self):
+        pid = os.getpid()
+
+        with self._lock:
+            if self._pid != pid:
+                if self._pid is not None:
+                    self.rebuilds += 1
+
+                self._session = self._build()
+                self._pid = pid
+                self._busy = 0
+                self._prewarmed = 0
+
+            return self._session
+
+    def _build(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        session = self.session
+
+        with self._lock:
+            self._busy += 1
+
+        try:
+            return session.request(method, url, **kwargs)
+        finally:
+            with self._lock:
+                self._busy -= 1
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def _pool_for(self, url):
+        session = self.session
+        adapter = session.get_adapter(url)
+
+        # verify, cert and proxies as a request resolves them, environment included, so the pool is the same one
+        settings = session.merge_environment_settings(url, {}, None, None, None)
+
+        if hasattr(adapter, 'get_connection_with_tls_context'):
+            return adapter.get_connection_with_tls_context(requests.Request('POST', url).prepare(), settings['verify'],
+                                                           proxies=settings['proxies'], cert=settings['cert'])
+
+        pool = adapter.get_connection(url, settings['proxies'])
+        adapter.cert_verify(pool, url, settings['verify'], settings['cert'])
+        return pool
+
+    def prewarm(self, count, url=None, debug=False):
+        """
+        Open keep-alive connections ahead of the first request, e.g. when a worker boots
+
+        DNS lookup, TCP and TLS handshakes happen now, concurrently, and the connections wait
+        idle in the pool. No request is sent.
+
+        @param count: connections to open, at most pool_size
+        @param url: any URL on the host to connect to, defaults to the PayPal endpoint
+        @param debug: whether the default endpoint is the sandbox
+        @return: number of connections opened
+        """
+        url = url or Settings(debug=debug).PAYPAL_ENDPOINT
+        pool = self._pool_for(url)
+        connections = [pool._get_conn() for _ in range(min(count, self.pool_size))]
+
+        def connect(connection):
+            try:
+                connection.connect()
+                return True
+            except OSError:
+                connection.close()
+                return False
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(connections) or 1) as executor:
+                opened = sum(executor.map(connect, connections))
+        finally:
+            for connection in connections:
+                pool._put_conn(connection)
+
+        with self._lock:
+            self._prewarmed += opened
+
+        return opened
+
+    def stats(self):
+        """
+        @return: PoolStats of this process; reused counts requests sent over an existing connection
+        """
+        session = self.session
+        idle = created = sent = 0
+
+        for adapter in set(session.adapters.values()):
+            manager = getattr(adapter, 'poolmanager', None)
+
+            if manager is None:
+                continue
+
+            for key in manager.pools.keys():
+                pool = manager.pools.get(key)
+
+                if pool is None or pool.pool is None:
+                    continue
+
+                idle += sum(1 for connection in list(pool.pool.queue)
+                            if connection is not None and connection.sock is not None)
+                created += pool.num_connections
+                sent += pool.num_requests
+
+        with self._lock:
+            busy, prewarmed = self._busy, self._prewarmed
+
+        return PoolStats(idle=idle, busy=busy, created=created, reused=max(0, sent - (created - prewarmed)),
+                         requests=sent, rebuilds=self.rebuilds)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+
+            self._session = None
+            self._pid = None
@@ -1,4 +1,5 @@
 import decimal
+import math
 from datetime import datetime, timezone
 
 import pytz
@@ -28,3 +29,19 @@ def decimal_default(obj):
         return float(obj)
     raise TypeError
 
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a sequence
+
+    @param values: sequence of numbers
+    @param pct: percentile between 0 and 100
+    @return: value at the percentile, None for an empty sequence
+    """
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(math.ceil(pct / 100.0 * len(ordered))) - 1))
+
+    return ordered[index]
@@ -0,0 +1,479 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+
+import requests
+
+from .exceptions import AdaptiveApiException, PayException, PreApprovalException
+from .models import Receiver, ReceiverList
+
+
+RUNNING = 'RUNNING'
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+
+# Step outcomes returned by handlers
+NEXT = 'NEXT'       # move on to the next step
+REPEAT = 'REPEAT'   # run the same step again right away, e.g. for the next of several payments
+WAIT = 'WAIT'       # run the same step again after its interval, e.g. to poll for approval
+
+WorkflowInstance = namedtuple('WorkflowInstance', ['id', 'workflow', 'step', 'status', 'state', 'attempts',
+                                                   'error', 'createdAt', 'updatedAt'])
+
+
+class Step(object):
+    """
+    One operation call of a workflow
+
+    build(instance) returns the request arguments, or None to skip the step. handle(instance, resp)
+    updates instance.state in place and returns NEXT, REPEAT or WAIT; raising fails the instance.
+    recover(instance, kwargs, resp), when given, is awaited with a failure response and returns the
+    response handle() gets instead, e.g. one found by a lookup call.
+    """
+
+    def __init__(self, name, operation, build, handle, interval=60, timeout=None, recover=None):
+        """
+        @param operation: yappa.api operation instance the step calls with arequest()
+        @param interval: seconds to wait before running the step again after WAIT
+        @param timeout: seconds an instance may spend in the step before it fails, None to wait forever
+        @param recover: coroutine function making at most one call, None to handle failures as they are
+        """
+        self.name = name
+        self.operation = operation
+        self.build = build
+        self.handle = handle
+        self.interval = interval
+        self.timeout = timeout
+        self.recover = recover
+
+
+class Workflow(object):
+
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = list(steps)
+        self._positions = {step.name: position for position, step in enumerate(self.steps)}
+
+        if len(self._positions) != len(self.steps):
+            raise AdaptiveApiException('step names of workflow {} need to be unique'.format(name))
+
+    def step(self, name):
+        return self.steps[self._positions[name]]
+
+    def after(self, name):
+        """
+        @return: the step following name, None after the last one
+        """
+        position = self._positions[name] + 1
+        return self.steps[position] if position < len(self.steps) else None
+
+
+def _encode(obj):
+    # State is kept as JSON; request arguments keep their types through a round trip
+    if isinstance(obj, Decimal):
+        return {'__decimal__': str(obj)}
+
+    if isinstance(obj, datetime):
+        return {'__datetime__': obj.isoformat()}
+
+    if isinstance(obj, ReceiverList):
+        return {'__receivers__': [{'email': receiver.email, 'amount': str(receiver.amount),
+                                   'primary': receiver.primary} for receiver in obj.receivers]}
+
+    raise TypeError('{} is not JSON serializable'.format(type(obj).__name__))
+
+
+def _decode(obj):
+    if '__decimal__' in obj:
+        return Decimal(obj['__decimal__'])
+
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+
+    if '__receivers__' in obj:
+        return ReceiverList([Receiver(email=receiver['email'], amount=Decimal(receiver['amount']),
+                                      primary=receiver['primary']) for receiver in obj['__receivers__']])
+
+    return obj
+
+
+def dump_state(state):
+    return json.dumps(state, default=_encode)
+
+
+def load_state(text):
+    return json.loads(text, object_hook=_decode)
+
+
+class WorkflowEngine(object):
+    """
+    Run many instances of a workflow on one event loop, with their state kept in SQLite
+
+    Every pass takes up to `batch_size` instances that are due, sends the calls of each step
+    together, at most `concurrency` at a time, and writes all their transitions in one
+    transaction. Instances waiting for a poll or a retry cost nothing until they are due again.
+
+    Instances left running by a stopped process carry on from their last written step when an
+    engine is opened on the same file. A call whose answer was not written yet is made again, so
+    steps that create something should be safe to repeat, e.g. Pay with a trackingId.
+
+    Calls run in the loop's default executor; give the loop one with `concurrency` threads with
+    loop.set_default_executor() to let that many calls run at once. A call not answered within
+    `call_timeout` seconds is retried like a network error, so one stuck call cannot hold up a
+    pass; give the operations a `timeout` as well to free the executor thread it keeps.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS workflow_instances (
+            id TEXT PRIMARY KEY,
+            workflow TEXT NOT NULL,
+            step TEXT NOT NULL,
+            status TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            wake_at REAL NOT NULL,
+            entered_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS workflow_instances_due ON workflow_instances (workflow, status, wake_at);
+    """
+    _COLUMNS = 'id, workflow, step, status, state, attempts, error, created_at, updated_at'
+
+    def __init__(self, workflow, path='yappa-workflows.db', batch_size=500, concurrency=100, retries=3,
+                 backoff=1.0, idle_interval=1.0, call_timeout=60):
+        """
+        @param workflow: Workflow to run
+        @param retries: attempts after a network error or timeout before an instance fails
+        @param idle_interval: longest sleep of run() while no instance is due
+        @param call_timeout: seconds to wait for each call, None to wait forever
+        """
+        self.workflow = workflow
+        self.path = path
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.idle_interval = idle_interval
+        self.call_timeout = call_timeout
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._stopping = False
+
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=FULL')
+        self._connection.executescript(self.SCHEMA)
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            return self._connection.execute(query, params).fetchall()
+
+    def _write(self, query, rows):
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+
+            try:
+                self._connection.executemany(query, rows)
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+
+            self._connection.execute('COMMIT')
+
+    def start(self, state, instance_id=None):
+        """
+        @param state: JSON serializable dict the steps read and update, may hold Decimal, datetime and ReceiverList
+        @param instance_id: defaults to a random id; starting an id again does nothing
+        @return: instance id
+        """
+        return self.start_many([(instance_id, state)])[0]
+
+    def start_many(self, items):
+        """
+        Start instances in one transaction
+
+        @param items: iterable of (instance_id or None, state) tuples
+        @return: list of instance ids
+        """
+        now = time.time()
+        first = self.workflow.steps[0].name
+        ids = []
+        rows = []
+
+        for instance_id, state in items:
+            instance_id = instance_id or uuid.uuid4().hex
+            ids.append(instance_id)
+            rows.append((instance_id, self.workflow.name, first, RUNNING, dump_state(state), now, now, now, now))
+
+        self._write('INSERT OR IGNORE INTO workflow_instances (id, workflow, step, status, state, wake_at, '
+                    'entered_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        return ids
+
+    @staticmethod
+    def _instance(row):
+        return WorkflowInstance(id=row[0], workflow=row[1], step=row[2], status=row[3], state=load_state(row[4]),
+                                attempts=row[5], error=row[6], createdAt=row[7], updatedAt=row[8])
+
+    def get(self, instance_id):
+        """
+        @return: WorkflowInstance, None for an unknown id
+        """
+        rows = self._execute('SELECT {} FROM workflow_instances WHERE id = ?'.format(self._COLUMNS), (instance_id,))
+        return self._instance(rows[0]) if rows else None
+
+    def find(self, status=FAILED, limit=100):
+        """
+        @return: list of WorkflowInstance in the given status, oldest first
+        """
+        rows = self._execute('SELECT {} FROM workflow_instances WHERE workflow = ? AND status = ? '
+                             'ORDER BY created_at LIMIT ?'.format(self._COLUMNS),
+                             (self.workflow.name, status, limit))
+        return [self._instance(row) for row in rows]
+
+    def counts(self):
+        """
+        @return: dict of COMPLETED, FAILED and the name of every step to the number of instances there
+        """
+        rows = self._execute('SELECT CASE WHEN status = ? THEN step ELSE status END, count(*) '
+                             'FROM workflow_instances WHERE workflow = ? GROUP BY 1', (RUNNING, self.workflow.name))
+        return dict(rows)
+
+    def _due(self, now):
+        return self._execute('SELECT id, step, state, attempts, entered_at FROM workflow_instances '
+                             'WHERE workflow = ? AND status = ? AND wake_at <= ? ORDER BY wake_at LIMIT ?',
+                             (self.workflow.name, RUNNING, now, self.batch_size))
+
+    def _next_wake(self):
+        rows = self._execute('SELECT min(wake_at) FROM workflow_instances WHERE workflow = ? AND status = ?',
+                             (self.workflow.name, RUNNING))
+        return rows[0][0]
+
+    async def _call(self, step, instance, semaphore):
+        try:
+            kwargs = step.build(instance)
+
+            if kwargs is None:
+                return NEXT, None
+
+            async with semaphore:
+                self.calls += 1
+                resp = await asyncio.wait_for(step.operation.arequest(**kwargs), self.call_timeout)
+
+                if step.recover is not None and resp.ack not in ('Success', 'SuccessWithWarning'):
+                    self.calls += 1
+                    resp = await asyncio.wait_for(step.recover(instance, kwargs, resp), self.call_timeout)
+
+            return step.handle(instance, resp), None
+
+        except requests.RequestException as e:
+            return None, e
+        except asyncio.TimeoutError:
+            return None, 'step {} call timed out after {}s'.format(step.name, self.call_timeout)
+        except Exception as e:   # Anything else fails only this instance, not the whole batch
+            return FAILED, e
+
+    def _transition(self, step, instance, attempts, entered_at, outcome, error, now):
+        # Returns the UPDATE parameters: step, status, state, attempts, wake_at, entered_at, updated_at, error, id
+        state = dump_state(instance.state)
+
+        if outcome is None:     # Network error, try again later with the state it had
+            attempts += 1
+
+            if attempts > self.retries:
+                return step.name, FAILED, state, attempts, now, entered_at, now, str(error), instance.id
+
+            return (step.name, RUNNING, state, attempts, now + self.backoff * 2 ** (attempts - 1), entered_at, now,
+                    str(error), instance.id)
+
+        if outcome == FAILED:
+            return step.name, FAILED, state, 0, now, entered_at, now, str(error), instance.id
+
+        if outcome == NEXT:
+            following = self.workflow.after(step.name)
+
+            if following is None:
+                return step.name, COMPLETED, state, 0, now, entered_at, now, None, instance.id
+
+            return following.name, RUNNING, state, 0, now, now, now, None, instance.id
+
+        if outcome == REPEAT:
+            return step.name, RUNNING, state, 0, now, entered_at, now, None, instance.id
+
+        if outcome == WAIT:
+            if step.timeout is not None and now - entered_at >= step.timeout:
+                return (step.name, FAILED, state, 0, now, entered_at, now,
+                        'step {} timed out after {}s'.format(step.name, step.timeout), instance.id)
+
+            return step.name, RUNNING, state, 0, now + step.interval, entered_at, now, None, instance.id
+
+        return (step.name, FAILED, state, 0, now, entered_at, now,
+                'step {} returned unknown outcome {!r}'.format(step.name, outcome), instance.id)
+
+    async def run_once(self):
+        """
+        Advance every instance that is due, up to batch_size of them
+
+        @return: number of instances advanced
+        """
+        now = time.time()
+        rows = self._due(now)
+
+        if not rows:
+            return 0
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        calls = []
+
+        for instance_id, step_name, state, attempts, entered_at in rows:
+            step = self.workflow.step(step_name)
+            instance = WorkflowInstance(id=instance_id, workflow=self.workflow.name, step=step_name, status=RUNNING,
+                                        state=load_state(state), attempts=attempts, error=None, createdAt=None,
+                                        updatedAt=None)
+            calls.append((step, instance, attempts, entered_at))
+
+        # The due calls of every step go out at once, the pass ends when the slowest one is answered
+        results = await asyncio.gather(*(self._call(step, instance, semaphore) for step, instance, _, _ in calls))
+        now = time.time()
+
+        self._write('UPDATE workflow_instances SET step = ?, status = ?, state = ?, attempts = ?, wake_at = ?, '
+                    'entered_at = ?, updated_at = ?, error = ? WHERE id = ?',
+                    [self._transition(step, instance, attempts, entered_at, outcome, error, now)
+                     for (step, instance, attempts, entered_at), (outcome, error) in zip(calls, results)])
+        return len(rows)
+
+    async def run(self, until_done=False):
+        """
+        Keep advancing instances until stop() is called
+
+        @param until_done: return once no instance is running any more
+        """
+        self._stopping = False
+
+        while not self._stopping:
+            if await self.run_once():
+                continue
+
+            wake_at = self._next_wake()
+
+            if wake_at is None and until_done:
+                return
+
+            delay = self.idle_interval if wake_at is None else min(self.idle_interval, wake_at - time.time())
+            await asyncio.sleep(max(0.0, delay))
+
+    def stop(self):
+        self._stopping = True
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def _check(resp, exception):
+    if resp.ack not in ('Success', 'SuccessWithWarning'):
+        raise exception(resp.message)
+
+
+def preapproval_pay_workflow(preapproval, preapproval_details, pay, payment_details, poll_interval=60,
+                             approval_timeout=None, confirm_interval=30, confirm_timeout=None):
+    """
+    Workflow that gets a preapproval approved, makes payments with it and waits for them to complete
+
+    Instances start with a state holding `preapproval` (PreApproval.request() arguments) and
+    `payments` (list of Pay.request() arguments, without preapprovalKey). Give `preapprovalKey`
+    instead of `preapproval` to pay with a preapproval that already exists. Send the buyer to
+    state['nextUrl'] once the preapproval step is done. Payments get the trackingId
+    `<instance id>-<index>` unless they have one, so a payment repeated after a restart or a
+    timed out call is refused by PayPal instead of made twice; when Pay fails, the payment made
+    under its trackingId is looked up with PaymentDetails and the flow carries on with it. The
+    state gains `payKeys` and `confirmed`, the number of payments found COMPLETED.
+
+    @return: Workflow with the steps preapproval, approval, pay and confirm
+    """
+
+    def build_preapproval(instance):
+        if 'preapprovalKey' in instance.state:
+            return None
+
+        return instance.state['preapproval']
+
+    def handle_preapproval(instance, resp):
+        _check(resp, PreApprovalException)
+        instance.state.update(preapprovalKey=resp.preapprovalKey, nextUrl=resp.nextUrl)
+        return NEXT
+
+    def build_approval(instance):
+        return {'preapprovalKey': instance.state['preapprovalKey']}
+
+    def handle_approval(instance, resp):
+        _check(resp, PreApprovalException)
+
+        if resp.status in ('CANCELED', 'DEACTIVATED'):
+            raise PreApprovalException('preapproval {} is {}'.format(instance.state['preapprovalKey'], resp.status))
+
+        return NEXT if resp.approved == 'true' and resp.status == 'ACTIVE' else WAIT
+
+    def build_pay(instance):
+        pay_keys = instance.state.setdefault('payKeys', [])
+        payments = instance.state['payments']
+
+        if len(pay_keys) == len(payments):
+            return None
+
+        kwargs = dict(payments[len(pay_keys)], preapprovalKey=instance.state['preapprovalKey'])
+        kwargs.setdefault('trackingId', '{}-{}'.format(instance.id, len(pay_keys)))
+        return kwargs
+
+    async def recover_pay(instance, kwargs, resp):
+        details = await payment_details.arequest(trackingId=kwargs['trackingId'])
+
+        # PayPal knows no payment under the trackingId, the failure stands
+        if details.ack not in ('Success', 'SuccessWithWarning') or not details.payKey:
+            return resp
+
+        return pay.build_response({'responseEnvelope': {'ack': details.ack}, 'payKey': details.payKey,
+                                   'paymentExecStatus': details.status, 'sender': details.sender})
+
+    def handle_pay(instance, resp):
+        _check(resp, PayException)
+
+        if resp.paymentExecStatus == 'ERROR':
+            raise PayException('payment {} failed'.format(resp.payKey))
+
+        pay_keys = instance.state['payKeys']
+        pay_keys.append(resp.payKey)
+        return NEXT if len(pay_keys) == len(instance.state['payments']) else REPEAT
+
+    def build_confirm(instance):
+        confirmed = instance.state.setdefault('confirmed', 0)
+        pay_keys = instance.state['payKeys']
+        return {'payKey': pay_keys[confirmed]} if confirmed < len(pay_keys) else None
+
+    def handle_confirm(instance, resp):
+        _check(resp, PayException)
+
+        if resp.status in ('ERROR', 'REVERSALERROR'):
+            raise PayException('payment {} ended as {}'.format(resp.payKey, resp.status))
+
+        if resp.status != 'COMPLETED':
+            return WAIT
+
+        instance.state['confirmed'] += 1
+        return NEXT if instance.state['confirmed'] == len(instance.state['payKeys']) else REPEAT
+
+    return Workflow('preapproval-pay', [
+        Step('preapproval', preapproval, build_preapproval, handle_preapproval),
+        Step('approval', preapproval_details, build_approval, handle_approval, interval=poll_interval,
+             timeout=approval_timeout),
+        Step('pay', pay, build_pay, handle_pay, recover=recover_pay),
+        Step('confirm', payment_details, build_confirm, handle_confirm, interval=confirm_interval,
+             timeout=confirm_timeout),
+    ])